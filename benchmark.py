@@ -0,0 +1,580 @@
+"""
+Benchmarks for scanning a vault for to-do items
+
+Each benchmark builds a synthetic vault (See synthetic_vault.py) in a temporary directory.  The shape of the vault
+can be set with the same options synthetic_vault.py takes.
+
+    stages:  Times each stage of a scan on its own (walk, read, digest, frontmatter, parse, hash, and the whole scan
+        of a file end to end).  Results can be written as JSON, and compared against a saved baseline so that
+        regressions show up
+    prefilter:  Times scanning every note, with and without the byte level prefilter that passes over notes with no
+        open to-do items before decoding or parsing them.  No scan index is used, so every note is read every time
+    memory:  Compares the memory held by the to-do items found in the vault, as plain dicts that each carry a copy of
+        their file and host details (as they used to be) and as TaskRecords (See task_records.py)
+    hashing:  Compares hashing short to-do items one at a time the way it used to be done (a regex, then MD5), one at
+        a time the way it's done now, and in batches (See hashing.py)
+    startup:  Times whole runs of 'python -m markdown_todoist migrate' in a fresh interpreter, as cron would start them,
+        against a vault with no open to-do items (so Todoist is never called):  a run that finds nothing has changed
+        since the last one, a forced full run, and the interpreter starting up and doing nothing, for comparison.
+        Results can be saved and compared like those of 'stages'
+    large-file:  Times scanning one huge note (e.g. a years long running journal) and rewriting its migrated lines,
+        reading the whole note into memory as smaller notes are, and through a memory map with the migrated lines
+        spliced in (See find_tasks.LARGE_FILE_MIN_SIZE).  Peak memory allocated is reported too
+
+Run them with:
+    python benchmark.py stages --notes 5000 --frontmatter plain=0.6,none=0.2,todoist_false=0.1,template=0.1 \
+        --huge-notes 1 --json results.json
+    python benchmark.py stages --baseline results.json
+    python benchmark.py prefilter --notes 5000 --task-density 0.1
+    python benchmark.py memory --tasks 100000
+    python benchmark.py hashing --tasks 1000000
+    python benchmark.py startup --notes 5000 --json startup.json
+    python benchmark.py large-file --lines 1000000 --tasks 1000
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from find_tasks import _parse_large_file
+from find_tasks import _scan_file
+from find_tasks import _walk_files
+from hashing import make_task_hash
+from hashing import make_task_hashes
+from migrate_tasks import _splice_file_atomically
+from migrate_tasks import _write_file_atomically
+from parsers import get_todoist_front_matter_setting
+from parsers import parse_tasks_from_strings
+from scan_index import digest_file_contents
+from synthetic_vault import add_vault_arguments
+from synthetic_vault import make_note
+from synthetic_vault import make_synthetic_vault
+from synthetic_vault import vault_arguments
+from task_records import FileRecord
+from task_records import get_host_record
+from task_records import make_task_records
+from vault_walk import IgnoreRules
+
+
+def _walk_file_names(vault_directory: str) -> list:
+    """
+    Returns: The notes in a vault, in walk order.  Each one has been stat'ed along the way, as for a real scan
+    """
+
+    return [file_name for file_name, _ in _walk_files(parent_directory=vault_directory, file_ext=('.md',),
+                                                       ignore_rules=IgnoreRules())]
+
+
+def _scan_file_without_prefilter(file_name: str):
+    """
+    Scans a file the way it was done before the prefilter:  every file is decoded, has its frontmatter parsed and is
+    run through the to-do regex
+    """
+
+    with open(file_name, 'rb') as f:
+        data_string = f.read().decode('utf-8')
+
+    todoist_frontmatter_setting = get_todoist_front_matter_setting(input_string=data_string, read_file=False)
+    if todoist_frontmatter_setting is False:
+        return todoist_frontmatter_setting, None
+
+    return todoist_frontmatter_setting, parse_tasks_from_strings(input_data=data_string)
+
+
+def _scan_file_with_prefilter(file_name: str):
+    return _scan_file(file_name=file_name)
+
+
+def _time_scan(scan_function, file_names: list, repeats: int = 3):
+    """
+    Returns: A tuple of (the best wall clock time of scanning every file, out of repeats tries, count of tasks found)
+    """
+
+    best = None
+    task_count = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        task_count = 0
+        for file_name in file_names:
+            todoist_frontmatter_setting, tasks = scan_function(file_name)
+            if tasks:
+                task_count += len(tasks)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, task_count
+
+
+def benchmark_prefilter(repeats: int = 3, **vault_kwargs):
+    """
+    Times scanning a synthetic vault with and without the prefilter, and prints the results
+    Args:
+        repeats:  How many times to time each scan.  The best time is kept
+        vault_kwargs:  Passed along to make_synthetic_vault()
+    """
+
+    task_density = vault_kwargs.get('task_density', 0.1)
+    with tempfile.TemporaryDirectory(prefix='markdown-todoist-benchmark-') as vault_directory:
+        make_synthetic_vault(directory=vault_directory, **vault_kwargs)
+        file_names = _walk_file_names(vault_directory=vault_directory)
+
+        without_seconds, without_tasks = _time_scan(scan_function=_scan_file_without_prefilter,
+                                                    file_names=file_names, repeats=repeats)
+        with_seconds, with_tasks = _time_scan(scan_function=_scan_file_with_prefilter, file_names=file_names,
+                                              repeats=repeats)
+
+    if with_tasks != without_tasks:
+        raise RuntimeError(f"The prefilter changed the result!  Found {with_tasks} tasks with it and {without_tasks} "
+                           f"without it")
+
+    print(f"{len(file_names)} notes, {task_density:.0%} of them with to-do items ({with_tasks} to-do items in all)")
+    print(f"Without prefilter:  {without_seconds:.3f}s  ({without_seconds / len(file_names) * 1e6:.1f}us per note)")
+    print(f"With prefilter:     {with_seconds:.3f}s  ({with_seconds / len(file_names) * 1e6:.1f}us per note)")
+    print(f"Speedup:            {without_seconds / with_seconds:.1f}x")
+
+
+def _make_task_dicts(file_name: str, parsed_tasks: list) -> list:
+    """
+    Adds file and host details to every to-do item of a file, the way find_tasks did before TaskRecords
+    """
+
+    file_inode = os.stat(file_name).st_ino
+    mac_address = hex(uuid.getnode())
+    host_name = socket.gethostname()
+    file_name_escaped = file_name.replace(' ', '\\ ')
+    obsidian_uri = f"obsidian://open?vault=benchmark&file={file_name_escaped}"
+
+    for task in parsed_tasks:
+        task['from_file_inode'] = file_inode
+        task['from_mac_address'] = mac_address
+        task['from_hostname'] = host_name
+        task['file_name'] = file_name
+        task['file_name_escaped'] = file_name_escaped
+        task['obsidian_uri'] = obsidian_uri
+
+    return parsed_tasks
+
+
+def _make_records(file_name: str, parsed_tasks: list) -> list:
+    """
+    Builds TaskRecords for the to-do items of a file, the way find_tasks does
+    """
+
+    file_name_escaped = file_name.replace(' ', '\\ ')
+    file_record = FileRecord(file_name=file_name, inode=os.stat(file_name).st_ino, file_name_escaped=file_name_escaped,
+                             obsidian_uri=f"obsidian://open?vault=benchmark&file={file_name_escaped}")
+    return make_task_records(parsed_tasks=parsed_tasks, file_record=file_record, host_record=get_host_record())
+
+
+def _measure_tasks(make_function, file_names: list):
+    """
+    Scans every file and keeps the to-do items found, as built by make_function
+    Returns: A tuple of (bytes still allocated once the scan is done, peak bytes allocated, count of to-do items)
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    all_tasks = []
+    for file_name in file_names:
+        todoist_frontmatter_setting, parsed_tasks = _scan_file(file_name=file_name)
+        if parsed_tasks:
+            all_tasks.extend(make_function(file_name, parsed_tasks))
+    gc.collect()
+    current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return current_bytes, peak_bytes, len(all_tasks)
+
+
+def benchmark_task_memory(tasks: int = 100000, tasks_per_note: int = 10):
+    """
+    Measures the memory held by the to-do items of a synthetic vault, as dicts and as TaskRecords, and prints the
+    results
+    """
+
+    get_host_record()  # Built once per run either way, so leave it out of the measurements
+
+    with tempfile.TemporaryDirectory(prefix='markdown-todoist-benchmark-') as vault_directory:
+        make_synthetic_vault(directory=vault_directory, notes=tasks // tasks_per_note, task_density=1.0,
+                             tasks_per_note=tasks_per_note)
+        file_names = _walk_file_names(vault_directory=vault_directory)
+
+        dict_bytes, dict_peak, dict_tasks = _measure_tasks(make_function=_make_task_dicts, file_names=file_names)
+        record_bytes, record_peak, record_tasks = _measure_tasks(make_function=_make_records, file_names=file_names)
+
+    print(f"{len(file_names)} notes, {record_tasks} to-do items")
+    print(f"As dicts:        {dict_bytes / 2 ** 20:.1f} MiB held ({dict_bytes / dict_tasks:.0f} bytes per to-do "
+          f"item), {dict_peak / 2 ** 20:.1f} MiB peak")
+    print(f"As TaskRecords:  {record_bytes / 2 ** 20:.1f} MiB held ({record_bytes / record_tasks:.0f} bytes per to-do "
+          f"item), {record_peak / 2 ** 20:.1f} MiB peak")
+    print(f"Saving:          {1 - record_bytes / dict_bytes:.0%}")
+
+
+def benchmark_hashing(tasks: int = 1000000, repeats: int = 3):
+    """
+    Times hashing short to-do items:  the way it used to be done (version 1 hashes), one at a time with the current
+    version, and all at once with make_task_hashes()
+    Args:
+        tasks:  How many to-do items to hash
+        repeats:  How many times to time each.  The best time is kept
+    """
+
+    rng = random.Random(0)
+    words = ['Feed', 'the', 'dog', 'call', 'Mum', 'about', 'Sunday', 'buy', 'milk', 'fix', 'bike', '#home', '@work',
+             'café', 'tomorrow:', '3pm', 'review', 'PR', '(again)', 'Ünïcode']
+    task_descriptions = [' '.join(rng.choice(words) for _ in range(rng.randint(2, 7))) + f" {i}" for i in range(tasks)]
+
+    print(f"{tasks} to-do items, {sum(map(len, task_descriptions)) / tasks:.0f} characters each on average")
+    print(f"{'':<28}{'Seconds':>10}{'ns/item':>10}{'Speed up':>10}")
+    old_seconds = None
+    for label, function in (('One at a time, version 1', lambda: [make_task_hash(task_description=t, version=1)
+                                                                  for t in task_descriptions]),
+                            ('One at a time, current', lambda: [make_task_hash(task_description=t)
+                                                                for t in task_descriptions]),
+                            ('Batch, current', lambda: make_task_hashes(task_descriptions=task_descriptions))):
+        seconds, _ = _time_stage(function, repeats=repeats)
+        old_seconds = old_seconds or seconds
+        print(f"{label:<28}{seconds:>10.3f}{seconds / tasks * 1e9:>10.0f}{old_seconds / seconds:>9.1f}x")
+
+
+def _scan_and_rewrite_whole_file(file_name: str) -> int:
+    """
+    Scans a note and rewrites each of its to-do items as done, with the whole note in memory, as for smaller notes
+    Returns: How many to-do items were rewritten
+    """
+
+    with open(file_name, 'r', encoding='utf-8', newline='') as f:
+        data_string = f.read()
+    tasks = parse_tasks_from_strings(input_data=data_string)
+
+    lines = data_string.split('\n')
+    for task in tasks:
+        lines[task['line_number'] - 1] = lines[task['line_number'] - 1].replace('- [ ]', '- [x]', 1)
+    _write_file_atomically(file_name=file_name, data='\n'.join(lines))
+
+    return len(tasks)
+
+
+def _scan_and_rewrite_large_file(file_name: str) -> int:
+    """
+    Scans a note and rewrites each of its to-do items as done, through a memory map and by splicing in the new lines
+    Returns: How many to-do items were rewritten
+    """
+
+    _, tasks = _parse_large_file(file_name=file_name)
+
+    splices = []
+    with open(file_name, 'rb') as f:
+        for task in tasks:
+            f.seek(task['byte_offset'])
+            line = f.readline().rstrip(b'\n')
+            splices.append((task['byte_offset'], task['byte_offset'] + len(line), line.replace(b'- [ ]', b'- [x]', 1)))
+    _splice_file_atomically(file_name=file_name, splices=splices)
+
+    return len(tasks)
+
+
+def benchmark_large_file(lines: int = 1000000, tasks: int = 1000, repeats: int = 3):
+    """
+    Times scanning a huge note and rewriting its to-do items, with the whole note in memory and through a memory map,
+    and prints the results
+    Args:
+        lines:  How many lines the note has
+        tasks:  How many open to-do items are spread through it
+        repeats:  How many times to time each.  The best time is kept
+    """
+
+    data = make_note(rng=random.Random(0), note_number=0, lines=lines, open_tasks=tasks,
+                     frontmatter_variant='plain').encode('utf-8')
+
+    with tempfile.TemporaryDirectory(prefix='markdown-todoist-benchmark-') as vault_directory:
+        file_name = os.path.join(vault_directory, 'journal.md')
+        print(f"One note of {lines} lines ({len(data) / 2 ** 20:.1f} MiB), with {tasks} open to-do items")
+        print(f"{'':<16}{'Seconds':>10}{'Peak MiB':>10}")
+
+        for label, function in (('Whole file', _scan_and_rewrite_whole_file),
+                                ('Memory mapped', _scan_and_rewrite_large_file)):
+            def _run():
+                with open(file_name, 'wb') as f:
+                    f.write(data)
+                return function(file_name=file_name)
+
+            seconds, rewritten = _time_stage(_run, repeats=repeats)
+
+            gc.collect()
+            tracemalloc.start()
+            _run()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            if rewritten != tasks:
+                raise RuntimeError(f"Expected to rewrite {tasks} to-do items, but rewrote {rewritten}")
+            print(f"{label:<16}{seconds:>10.3f}{peak_bytes / 2 ** 20:>10.1f}")
+
+
+BENCHMARK_FORMAT_VERSION = 1  # Bump whenever the shape of the JSON results changes
+
+
+def _time_stage(function, repeats: int = 3):
+    """
+    Returns: A tuple of (the best wall clock time of calling function, out of repeats tries, what it last returned)
+    """
+
+    best = None
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def _read_all(file_names: list) -> list:
+    data = []
+    for file_name in file_names:
+        with open(file_name, 'rb') as f:
+            data.append(f.read())
+    return data
+
+
+def benchmark_stages(repeats: int = 3, **vault_kwargs) -> dict:
+    """
+    Times each stage of scanning a synthetic vault on its own
+    Args:
+        repeats:  How many times to time each stage.  The best time is kept
+        vault_kwargs:  Passed along to make_synthetic_vault()
+    Returns: The results, ready to be written out as JSON.  Under 'stages', each stage has the seconds it took and how
+        many items (files, or to-do items for 'hash') it handled
+    """
+
+    stages = {}
+
+    def _record(stage: str, seconds: float, items: int):
+        stages[stage] = dict(seconds=seconds, items=items, us_per_item=seconds / items * 1e6 if items else None)
+
+    with tempfile.TemporaryDirectory(prefix='markdown-todoist-benchmark-') as vault_directory:
+        make_synthetic_vault(directory=vault_directory, **vault_kwargs)
+
+        seconds, file_names = _time_stage(lambda: _walk_file_names(vault_directory=vault_directory), repeats=repeats)
+        _record(stage='walk', seconds=seconds, items=len(file_names))
+
+        seconds, file_contents = _time_stage(lambda: _read_all(file_names=file_names), repeats=repeats)
+        _record(stage='read', seconds=seconds, items=len(file_names))
+
+        seconds, _ = _time_stage(lambda: [digest_file_contents(data) for data in file_contents], repeats=repeats)
+        _record(stage='digest', seconds=seconds, items=len(file_names))
+
+        file_strings = [data.decode('utf-8') for data in file_contents]
+        seconds, _ = _time_stage(lambda: [get_todoist_front_matter_setting(input_string=data_string, read_file=False)
+                                          for data_string in file_strings], repeats=repeats)
+        _record(stage='frontmatter', seconds=seconds, items=len(file_names))
+
+        seconds, parsed = _time_stage(lambda: [parse_tasks_from_strings(input_data=data_string)
+                                               for data_string in file_strings], repeats=repeats)
+        _record(stage='parse', seconds=seconds, items=len(file_names))
+
+        task_descriptions = [task['task'] for tasks in parsed if tasks for task in tasks]
+        seconds, _ = _time_stage(lambda: make_task_hashes(task_descriptions=task_descriptions), repeats=repeats)
+        _record(stage='hash', seconds=seconds, items=len(task_descriptions))
+
+        seconds, _ = _time_stage(lambda: [_scan_file(file_name=file_name) for file_name in file_names],
+                                 repeats=repeats)
+        _record(stage='scan', seconds=seconds, items=len(file_names))
+
+        total_bytes = sum(len(data) for data in file_contents)
+
+    return dict(format_version=BENCHMARK_FORMAT_VERSION,
+                created_at=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                python=platform.python_version(), platform=platform.platform(), repeats=repeats,
+                vault=dict(vault_kwargs, files=len(file_names), bytes=total_bytes, tasks=len(task_descriptions)),
+                stages=stages)
+
+
+def _time_command(command: list, cwd: str, env: dict, repeats: int = 3) -> float:
+    """
+    Returns: The best wall clock time of running a command to completion, out of repeats tries
+    """
+
+    def _run():
+        subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    seconds, _ = _time_stage(_run, repeats=repeats)
+    return seconds
+
+
+def benchmark_startup(repeats: int = 3, **vault_kwargs) -> dict:
+    """
+    Times whole runs of 'python -m markdown_todoist migrate', each in a new interpreter.  The vault has no open to-do
+    items whatever vault_kwargs say, so nothing is sent to Todoist.  The run happens in a temporary directory with
+    its own config/config.json, and a home directory whose obsidian.json knows about the vault
+    Args:
+        repeats:  How many times to time each kind of run.  The best time is kept
+        vault_kwargs:  Passed along to make_synthetic_vault()
+    Returns: The results, in the same shape as benchmark_stages().  The stages are 'interpreter' (python -c pass),
+        'noop' (a run that finds nothing has changed) and 'full' (a run with --force)
+    """
+
+    vault_kwargs = dict(vault_kwargs, task_density=0)
+    stages = {}
+
+    def _record(stage: str, seconds: float, items: int):
+        stages[stage] = dict(seconds=seconds, items=items, us_per_item=seconds / items * 1e6 if items else None)
+
+    with tempfile.TemporaryDirectory(prefix='markdown-todoist-benchmark-') as run_directory:
+        vault_directory = os.path.join(run_directory, 'vault')
+        file_names = make_synthetic_vault(directory=vault_directory, **vault_kwargs)
+        total_bytes = sum(os.path.getsize(file_name) for file_name in file_names)
+
+        os.makedirs(os.path.join(run_directory, 'config'))
+        with open(os.path.join(run_directory, 'config', 'config.json'), 'w') as f:
+            json.dump(dict(config=dict(markdown_base_directory=vault_directory)), f)
+
+        home_directory = os.path.join(run_directory, 'home')
+        obsidian_directory = os.path.join(home_directory, 'Library', 'Application Support', 'obsidian')
+        os.makedirs(obsidian_directory)
+        with open(os.path.join(obsidian_directory, 'obsidian.json'), 'w') as f:
+            json.dump(dict(vaults={uuid.uuid4().hex[:16]: dict(path=vault_directory)}), f)
+
+        env = dict(os.environ, HOME=home_directory,
+                   PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__)),
+                                               os.environ.get('PYTHONPATH', '')]).rstrip(os.pathsep))
+        migrate_command = [sys.executable, '-m', 'markdown_todoist', 'migrate']
+
+        seconds = _time_command([sys.executable, '-c', 'pass'], cwd=run_directory, env=env, repeats=repeats)
+        _record(stage='interpreter', seconds=seconds, items=1)
+
+        seconds = _time_command(migrate_command + ['--force'], cwd=run_directory, env=env, repeats=repeats)
+        _record(stage='full', seconds=seconds, items=len(file_names))
+
+        # The forced runs above recorded a stamp, so these find nothing to do
+        seconds = _time_command(migrate_command, cwd=run_directory, env=env, repeats=repeats)
+        _record(stage='noop', seconds=seconds, items=len(file_names))
+
+    return dict(format_version=BENCHMARK_FORMAT_VERSION,
+                created_at=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                python=platform.python_version(), platform=platform.platform(), repeats=repeats,
+                vault=dict(vault_kwargs, files=len(file_names), bytes=total_bytes, tasks=0),
+                stages=stages)
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = 0.1) -> list:
+    """
+    Prints how each stage compares to a baseline
+    Args:
+        results:  As returned by benchmark_stages()
+        baseline:  Results saved from an earlier run
+        tolerance:  How much slower (as a fraction) a stage may be than the baseline before it counts as a regression
+    Returns: The names of the stages that regressed
+    """
+
+    if baseline.get('format_version') != BENCHMARK_FORMAT_VERSION:
+        raise ValueError(f"The baseline is in format version {baseline.get('format_version')}, but this is version "
+                         f"{BENCHMARK_FORMAT_VERSION}.  Save a new baseline")
+
+    # Comparing runs over different vaults doesn't tell us much.  Say so, but compare anyway
+    baseline_vault = baseline['vault']
+    if json.loads(json.dumps(results['vault'])) != baseline_vault:
+        print(f"The baseline was run against a different vault ({baseline_vault}).  The comparison may not mean much",
+              file=sys.stderr)
+
+    regressions = []
+    print(f"{'Stage':<12}{'Baseline':>12}{'Now':>12}{'Change':>10}")
+    for stage, stage_results in results['stages'].items():
+        baseline_stage = baseline['stages'].get(stage)
+        if baseline_stage is None or not baseline_stage['seconds']:
+            print(f"{stage:<12}{'-':>12}{stage_results['seconds']:>11.4f}s{'new':>10}")
+            continue
+
+        change = stage_results['seconds'] / baseline_stage['seconds'] - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(stage)
+            flag = '  REGRESSION'
+        print(f"{stage:<12}{baseline_stage['seconds']:>11.4f}s{stage_results['seconds']:>11.4f}s{change:>+10.1%}{flag}")
+
+    return regressions
+
+
+def _print_stages(results: dict):
+    vault = results['vault']
+    print(f"{vault['files']} notes, {vault['bytes'] / 2 ** 20:.1f} MiB, {vault['tasks']} to-do items")
+    print(f"{'Stage':<12}{'Seconds':>12}{'Items':>10}{'us/item':>12}")
+    for stage, stage_results in results['stages'].items():
+        us_per_item = stage_results['us_per_item']
+        us_per_item = f"{us_per_item:.1f}" if us_per_item is not None else '-'
+        print(f"{stage:<12}{stage_results['seconds']:>12.4f}{stage_results['items']:>10}{us_per_item:>12}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = arg_parser.add_subparsers(dest='benchmark', required=True)
+
+    stages_parser = subparsers.add_parser('stages', help='Time each stage of a scan')
+    add_vault_arguments(arg_parser=stages_parser)
+    stages_parser.add_argument('--repeats', type=int, default=3, help='How many times to time each stage')
+    stages_parser.add_argument('--json', help='Write the results to this file')
+    stages_parser.add_argument('--baseline', help='Compare the results to those saved in this file.  Exits with 1 '
+                                                  'if any stage regressed')
+    stages_parser.add_argument('--tolerance', type=float, default=0.1,
+                               help='How much slower than the baseline a stage may be.  0.1 means 10%%')
+
+    prefilter_parser = subparsers.add_parser('prefilter', help='Time scans with and without the prefilter')
+    add_vault_arguments(arg_parser=prefilter_parser)
+    prefilter_parser.add_argument('--repeats', type=int, default=3, help='How many times to time each scan')
+
+    memory_parser = subparsers.add_parser('memory', help='Compare the memory held by to-do items')
+    memory_parser.add_argument('--tasks', type=int, default=100000, help='How many to-do items to find')
+
+    hashing_parser = subparsers.add_parser('hashing', help='Compare ways of hashing to-do items')
+    hashing_parser.add_argument('--tasks', type=int, default=1000000, help='How many to-do items to hash')
+    hashing_parser.add_argument('--repeats', type=int, default=3, help='How many times to time each')
+
+    startup_parser = subparsers.add_parser('startup', help='Time whole runs, from starting the interpreter')
+    add_vault_arguments(arg_parser=startup_parser)
+    startup_parser.add_argument('--repeats', type=int, default=5, help='How many times to time each kind of run')
+    startup_parser.add_argument('--json', help='Write the results to this file')
+    startup_parser.add_argument('--baseline', help='Compare the results to those saved in this file.  Exits with 1 '
+                                                   'if any stage regressed')
+    startup_parser.add_argument('--tolerance', type=float, default=0.1,
+                                help='How much slower than the baseline a stage may be.  0.1 means 10%%')
+
+    large_file_parser = subparsers.add_parser('large-file', help='Compare ways of scanning and rewriting huge notes')
+    large_file_parser.add_argument('--lines', type=int, default=1000000, help='How many lines the note has')
+    large_file_parser.add_argument('--tasks', type=int, default=1000, help='How many open to-do items it has')
+    large_file_parser.add_argument('--repeats', type=int, default=3, help='How many times to time each')
+
+    args = arg_parser.parse_args()
+
+    if args.benchmark in ('stages', 'startup'):
+        benchmark_function = benchmark_stages if args.benchmark == 'stages' else benchmark_startup
+        results = benchmark_function(repeats=args.repeats, **vault_arguments(args))
+        _print_stages(results=results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.baseline:
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+            if len(compare_to_baseline(results=results, baseline=baseline, tolerance=args.tolerance)) > 0:
+                sys.exit(1)
+    elif args.benchmark == 'large-file':
+        benchmark_large_file(lines=args.lines, tasks=args.tasks, repeats=args.repeats)
+    elif args.benchmark == 'hashing':
+        benchmark_hashing(tasks=args.tasks, repeats=args.repeats)
+    elif args.benchmark == 'prefilter':
+        benchmark_prefilter(repeats=args.repeats, **vault_arguments(args))
+    else:
+        benchmark_task_memory(tasks=args.tasks)
@@ -0,0 +1,201 @@
+"""
+Checks that parsers.get_todoist_front_matter_setting(), which scans frontmatter for the todoist key and only parses YAML
+when it has to, agrees with parsing all of the frontmatter with python-frontmatter (which is how it used to work)
+
+The corpus is a set of hand written notes covering the awkward corners of YAML and of Obsidian templates, notes of
+each kind synthetic_vault.py writes, and optionally every note in any directories passed in (e.g. a real vault).  Each
+note is run through both, and the results compared.  They may only differ where the full parse gave up on the note
+(returning None, or raising something other than the ValueError for a bad todoist value), e.g. on unfilled templates.
+Those are listed, along with what the scan made of them.  Any other difference is a failure, and exits with 1
+
+Run it with:
+    python compare_frontmatter.py
+    python compare_frontmatter.py ~/Obsidian --repeats 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from parsers import _get_todoist_front_matter_setting_by_full_parse
+from parsers import get_todoist_front_matter_setting
+from synthetic_vault import FRONTMATTER_VARIANTS
+from synthetic_vault import make_note
+from vault_walk import IgnoreRules
+from vault_walk import walk_vault
+
+_BODY = "# A note\n\nSome text\n\n- [ ] Something to do\n"
+
+CORPUS = {
+    'no frontmatter': _BODY,
+    'empty note': '',
+    'horizontal rule only': f"{_BODY}\n---\n\nMore text\n",
+    'horizontal rules, not frontmatter': f"# Title\n---\ntodoist: false\n---\n{_BODY}",
+    'plain': f"---\ntags:\n  - a\n  - b\ncreated: 2024-01-01\n---\n{_BODY}",
+    'empty frontmatter': f"---\n---\n{_BODY}",
+    'unclosed frontmatter': f"---\ntodoist: false\n{_BODY}",
+    'leading blank lines': f"\n\n  \n---\ntodoist: false\n---\n{_BODY}",
+    'long boundaries': f"-----\ntodoist: false\n------   \n{_BODY}",
+    'crlf': f"---\r\ntitle: x\r\ntodoist: false\r\n---\r\n{_BODY}",
+    'byte order mark': f"\ufeff---\ntodoist: false\n---\n{_BODY}",
+    'todoist false': f"---\ntitle: x\ntodoist: false\n---\n{_BODY}",
+    'todoist true': f"---\ntitle: x\ntodoist: true\n---\n{_BODY}",
+    'todoist False': f"---\ntodoist: False\n---\n{_BODY}",
+    'todoist no': f"---\ntodoist: no\n---\n{_BODY}",
+    'todoist off': f"---\ntodoist: off\n---\n{_BODY}",
+    'todoist yes': f"---\ntodoist: yes\n---\n{_BODY}",
+    'todoist null': f"---\ntodoist: null\n---\n{_BODY}",
+    'todoist tilde': f"---\ntodoist: ~\n---\n{_BODY}",
+    'todoist empty': f"---\ntodoist:\ntitle: x\n---\n{_BODY}",
+    'todoist with comment': f"---\ntodoist: false  # Not this one\n---\n{_BODY}",
+    'todoist space before colon': f"---\ntodoist : false\n---\n{_BODY}",
+    'todoist quoted key': f"---\n\"todoist\": false\n---\n{_BODY}",
+    'todoist quoted value': f"---\ntodoist: \"false\"\n---\n{_BODY}",
+    'todoist string value': f"---\ntodoist: maybe\n---\n{_BODY}",
+    'todoist number value': f"---\ntodoist: 0\n---\n{_BODY}",
+    'todoist tagged value': f"---\ntodoist: !!bool false\n---\n{_BODY}",
+    'todoist anchor and alias': f"---\noff_value: &off false\ntodoist: *off\n---\n{_BODY}",
+    'todoist nested value': f"---\ntodoist:\n  enabled: false\n---\n{_BODY}",
+    'todoist list value': f"---\ntodoist:\n- false\n---\n{_BODY}",
+    'todoist twice': f"---\ntodoist: false\ntodoist: true\n---\n{_BODY}",
+    'todoist indented': f"---\nsettings:\n  todoist: false\n---\n{_BODY}",
+    'todoist in a list': f"---\ntags: [todoist, work]\n---\n{_BODY}",
+    'todoist in a comment': f"---\n# todoist: false\ntitle: x\n---\n{_BODY}",
+    'todoist no space after colon': f"---\ntodoist:false\n---\n{_BODY}",
+    'todoist in a multi line string': f"---\ntitle: \"a long\ntodoist: false\"\n---\n{_BODY}",
+    'todoist in a block scalar': f"---\ndescription: |\n  todoist: false\n---\n{_BODY}",
+    'todoist after an apostrophe': f"---\ntitle: Bob's list\ntodoist: false\n---\n{_BODY}",
+    'todoist after an open bracket': f"---\ntags: [a,\n todoist: false]\n---\n{_BODY}",
+    'flow mapping': f"---\n{{todoist: false, title: x}}\n---\n{_BODY}",
+    'list frontmatter': f"---\n- todoist\n- b\n---\n{_BODY}",
+    'scalar frontmatter': f"---\njust some text\n---\n{_BODY}",
+    'template tags': f"---\ntags:\n  - {{{{date}}}}\n  - {{{{date:YYYY}}}}-MM-DD\n  - DailyNote\npublish: false\n---\n"
+                     f"{_BODY}",
+    'template title': f"---\ntitle: {{{{title}}}}\n---\n{_BODY}",
+    'template with todoist false': f"---\ncreated: {{{{date}}}}\ntodoist: false\n---\n{_BODY}",
+    'template with todoist true': f"---\ntags:\n  - {{{{date}}}}\ntodoist: true\n---\n{_BODY}",
+    'template with quotes and todoist': f"---\ntitle: \"{{{{title}}}}\n  - {{{{date}}}}\ntodoist: false\n---\n{_BODY}",
+    'scanner error': f"---\na: b: c\n---\n{_BODY}",
+    'tab indentation': f"---\ntitle:\tx\n\tnested: 1\n---\n{_BODY}",
+    'bad yaml with todoist false': f"---\na: b: c\ntodoist: false\n---\n{_BODY}",
+    'json frontmatter': f"{{\n\"todoist\": false\n}}\n{_BODY}",
+}
+
+
+def _outcome(function, input_string: str):
+    """
+    Returns: What function returned for the note, or the type of the exception it raised
+    """
+
+    try:
+        return function(input_string=input_string)
+    except Exception as ex:
+        return type(ex)
+
+
+def _gave_up(outcome) -> bool:
+    """
+    Returns: True if the full parse couldn't make anything of the note:  it returned None, or raised something other
+        than the ValueError raised for a todoist value that's neither true nor false
+    """
+
+    return outcome is None or (type(outcome) is type and outcome is not ValueError)
+
+
+def _describe(outcome) -> str:
+    return outcome.__name__ if type(outcome) is type else repr(outcome)
+
+
+def build_corpus(directories: list = None, synthetic_notes_per_variant: int = 5) -> dict:
+    """
+    Returns: A dict of name -> text of each note to compare.  See the module docstring
+    """
+
+    corpus = dict(CORPUS)
+
+    rng = random.Random(0)
+    for variant in FRONTMATTER_VARIANTS:
+        for note_number in range(synthetic_notes_per_variant):
+            corpus[f"synthetic {variant} {note_number}"] = make_note(rng=rng, note_number=note_number, lines=20,
+                                                                     open_tasks=1, frontmatter_variant=variant)
+
+    for directory in directories or []:
+        directory = os.path.expanduser(directory)
+        for root, files in walk_vault(directory=directory, ignore_rules=IgnoreRules()):
+            for entry in files:
+                if not entry.name.endswith('.md'):
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        corpus[entry.path] = f.read()
+                except (OSError, UnicodeDecodeError) as ex:
+                    print(f"Skipping over file '{entry.path}' which could not be read:  {ex}", file=sys.stderr)
+
+    return corpus
+
+
+def compare(corpus: dict) -> list:
+    """
+    Runs each note in the corpus through both ways of reading the todoist setting, and prints where they differ
+    Returns: The names of the notes where they differ in a way they shouldn't
+    """
+
+    failures = []
+    gave_up = []
+    for name, input_string in corpus.items():
+        expected = _outcome(_get_todoist_front_matter_setting_by_full_parse, input_string=input_string)
+        actual = _outcome(get_todoist_front_matter_setting, input_string=input_string)
+        if actual is expected or (type(actual) is type(expected) and actual == expected):
+            continue
+        if _gave_up(expected) is True:
+            gave_up.append((name, expected, actual))
+        else:
+            failures.append((name, expected, actual))
+
+    print(f"{len(corpus)} notes compared.  {len(corpus) - len(gave_up) - len(failures)} agree, {len(gave_up)} the "
+          f"full parse gave up on, {len(failures)} disagree")
+    for heading, rows in (('Gave up on by the full parse', gave_up), ('Disagree', failures)):
+        if len(rows) == 0:
+            continue
+        print(f"\n{heading}:")
+        print(f"{'Note':<48}{'Full parse':>20}{'Scan':>20}")
+        for name, expected, actual in rows:
+            print(f"{name[-48:]:<48}{_describe(expected):>20}{_describe(actual):>20}")
+
+    return [name for name, _, _ in failures]
+
+
+def time_both(corpus: dict, repeats: int = 3):
+    """
+    Prints how long each way of reading the todoist setting takes over the whole corpus.  The best of repeats runs
+    """
+
+    print(f"\n{'':<12}{'Seconds':>12}{'us/note':>12}")
+    for label, function in (('Full parse', _get_todoist_front_matter_setting_by_full_parse),
+                            ('Scan', get_todoist_front_matter_setting)):
+        best = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            for input_string in corpus.values():
+                _outcome(function, input_string=input_string)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{label:<12}{best:>12.4f}{best / len(corpus) * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('directories', nargs='*', help='Directories of notes to add to the corpus')
+    arg_parser.add_argument('--synthetic', type=int, default=5,
+                            help='How many synthetic notes of each frontmatter variant to add')
+    arg_parser.add_argument('--repeats', type=int, default=3, help='How many times to time each')
+    args = arg_parser.parse_args()
+
+    corpus = build_corpus(directories=args.directories, synthetic_notes_per_variant=args.synthetic)
+    failed = compare(corpus=corpus)
+    time_both(corpus=corpus, repeats=args.repeats)
+
+    if len(failed) > 0:
+        sys.exit(1)
@@ -0,0 +1,281 @@
+"""
+Checks that parsers.scan_task_lines(), which scans the whole of a note in one pass, finds the same to-do items as
+parsing it line by line (which is how parse_tasks_from_strings() used to work), and times the two
+
+The corpus is a set of hand written notes covering the awkward corners of to-do items (indentation, odd whitespace,
+line endings, lookalikes), the golden notes below, notes of each kind synthetic_vault.py writes, and optionally every
+note in any directories passed in (e.g. a real vault).  Each note is checked three ways:
+
+    1. With code blocks and comments not skipped and only '-' list markers, the scan must find exactly what the line by
+       line parser does:  the same to-do items, on the same lines, with the same markdown_part, task, hash and
+       original_string
+    2. Scanning the note's raw bytes, and a memory map of them, must find the same to-do items as scanning its text,
+       each with the byte_offset its line starts at
+    3. The golden notes, which have to-do items inside fenced code blocks and HTML comments, and with other list
+       markers, must give exactly the to-do items listed for them
+
+Any failure is listed, and exits with 1.  Notes where the scan (as parse_tasks_from_strings() runs it) finds something
+other than the line by line parser are listed too, for a look over, along with the lines that differ
+
+Run it with:
+    python compare_parsers.py
+    python compare_parsers.py ~/Obsidian --repeats 5
+"""
+
+import argparse
+import mmap
+import os
+import random
+import sys
+import tempfile
+import time
+
+from hashing import make_task_hashes
+from parsers import _parse_tasks_line_by_line
+from parsers import scan_task_lines
+from synthetic_vault import FRONTMATTER_VARIANTS
+from synthetic_vault import make_note
+from vault_walk import IgnoreRules
+from vault_walk import walk_vault
+
+CORPUS = {
+    'empty note': '',
+    'just a task': '- [ ] Something to do',
+    'trailing newline': '- [ ] Something to do\n',
+    'no tasks': '# A note\n\nSome text\n\n- A list item\n',
+    'done and migrated': '- [x] Done\n- [X] Also done\n- [→] ~~Moved~~ [(This Task Migrated to Todoist)](url)\n',
+    'indented': '- [ ] Top\n  - [ ] Two spaces\n    - [ ] Four spaces\n\t- [ ] A tab\n\t\t- [ ] Two tabs\n',
+    'crlf': '# Title\r\n- [ ] First\r\n- [ ] Second\r\n\r\n- [ ] Third',
+    'lone carriage returns': '- [ ] One\r- [ ] Two\r\n- [ ] Three\n',
+    'trailing whitespace': '- [ ] Spaces after   \n- [ ] A tab after\t\n- [ ] Both \t \n',
+    'whitespace after the box': '- [ ]  Two spaces\n- [ ]\tA tab\n- [ ] \t Mixed\n- [ ]\xa0No-break space\n',
+    'unicode whitespace': '\u3000- [ ] Ideographic space before\n\u2003- [ ] Em space before\n- [ ] After\u2028\n'
+                          '\x0b- [ ] Vertical tab before\n\x0c- [ ] Form feed before\n\x1c- [ ] Separator before\n',
+    'empty tasks': '- [ ]\n- [ ] \n- [ ]\t\n- [ ]  \t\n',
+    'no space after the box': '- [ ]Not a task\n- [ ]-\n',
+    'lookalikes': '-[ ] No space\n-  [ ] Two spaces\n- [  ] Wide box\n- [] No box\n- ( ) Parens\n'
+                  'Some text - [ ] in the middle\n> - [ ] In a quote\n| - [ ] | In a table |\n',
+    'hashtags and mentions': '- [ ] Call @bob about #project/alpha\n- [ ] ## Heading-ish\n- [ ] @#@#\n',
+    'markdown in the task': '- [ ] **Bold** and _italic_ with `code` and [a link](https://example.com)\n'
+                            '- [ ] A [[wiki link]] and an ![[embed.png]]\n- [ ] ~~Struck~~\n',
+    'brackets in the task': '- [ ] [ ] Box in the task\n- [ ] Two [ ] boxes [ ]\n',
+    'unicode tasks': '- [ ] Café ☕️ résumé\n- [ ] 日本語のタスク\n- [ ] Emoji 🎉🎉\n- [ ] Zero\u200bwidth\n',
+    'byte order mark': '\ufeff- [ ] After a byte order mark\n- [ ] Next\n',
+    'duplicates': '- [ ] Same\n- [ ] Same\n  - [ ] Same\n',
+    'long line': f"- [ ] {'word ' * 2000}end\n",
+    'many blank lines': '\n' * 50 + '- [ ] After blanks\n' + '\n' * 50,
+    'frontmatter': '---\ntags: [ ]\ntodoist: true\n---\n- [ ] After frontmatter\n',
+    'inline code': 'Run `- [ ] not a task` and ```- [ ] not this``` either\n- [ ] But this\n',
+}
+
+# Notes where the scan finds other to-do items than the line by line parser, and the (line_number, task) of each to-do
+# item it should find
+GOLDEN = {
+    'backtick fence': ('- [ ] Before\n```\n- [ ] In code\n```\n- [ ] After\n',
+                       [(1, 'Before'), (5, 'After')]),
+    'tilde fence': ('~~~\n- [ ] In code\n~~~\n- [ ] After\n', [(4, 'After')]),
+    'fence with an info string': ('```markdown\n- [ ] Example\n```\n- [ ] After\n', [(4, 'After')]),
+    'longer closing fence': ('```\n- [ ] In code\n`````\n- [ ] After\n', [(4, 'After')]),
+    'short fence does not close': ('````\n- [ ] In code\n```\n- [ ] Still in code\n````\n- [ ] After\n',
+                                   [(6, 'After')]),
+    'other fence does not close': ('```\n- [ ] In code\n~~~\n- [ ] Still in code\n```\n- [ ] After\n',
+                                   [(6, 'After')]),
+    'closing fence with text': ('```\n- [ ] In code\n``` not closed\n- [ ] Still in code\n```\n- [ ] After\n',
+                                [(6, 'After')]),
+    'indented fence in a list': ('- Item\n  ```\n  - [ ] In code\n  ```\n  - [ ] After\n', [(5, 'After')]),
+    'fence with trailing whitespace': ('```  \r\n- [ ] In code\r\n```\t\r\n- [ ] After\r\n', [(4, 'After')]),
+    'unclosed fence': ('- [ ] Before\n```\n- [ ] In code\n- [ ] To the end\n', [(1, 'Before')]),
+    'backticks in the info string': ('``` not `a` fence\n- [ ] Found\n```\n- [ ] In code\n', [(2, 'Found')]),
+    'two fences': ('```\n- [ ] A\n```\n- [ ] B\n~~~\n- [ ] C\n~~~\n- [ ] D\n', [(4, 'B'), (8, 'D')]),
+    'comment': ('- [ ] Before\n<!--\n- [ ] Commented out\n-->\n- [ ] After\n', [(1, 'Before'), (5, 'After')]),
+    'one line comment': ('<!-- A note to self -->\n- [ ] After\n', [(2, 'After')]),
+    'comment closed mid line': ('<!-- Start\n- [ ] Commented out\nend --> - [ ] Not at the start\n- [ ] After\n',
+                                [(4, 'After')]),
+    'indented comment': ('  <!--\n  - [ ] Commented out\n  -->\n  - [ ] After\n', [(4, 'After')]),
+    'unclosed comment': ('- [ ] Before\n<!--\n- [ ] To the end\n', [(1, 'Before')]),
+    'comment in a fence': ('```\n<!--\n```\n- [ ] After\n', [(4, 'After')]),
+    'fence in a comment': ('<!--\n```\n-->\n- [ ] After\n', [(4, 'After')]),
+    'comment mid line': ('Text <!-- not a block\n- [ ] Found\n-->\n', [(2, 'Found')]),
+    'other list markers': ('* [ ] Star\n+ [ ] Plus\n1. [ ] One\n2) [ ] Two\n10. [ ] Ten\n  * [ ] Nested star\n',
+                           [(1, 'Star'), (2, 'Plus'), (3, 'One'), (4, 'Two'), (5, 'Ten'), (6, 'Nested star')]),
+    'not list markers': ('a. [ ] Letter\n1.[ ] No space\n-- [ ] Two dashes\n1234567890. [ ] Too many digits\n'
+                         '** [ ] Two stars\n', []),
+}
+
+_TASK_FIELDS = ('markdown_part', 'task', 'task_md5_hash', 'original_string', 'line_number')
+
+
+def build_corpus(directories: list = None, synthetic_notes_per_variant: int = 5) -> dict:
+    """
+    Returns: A dict of name -> text of each note to compare.  See the module docstring
+    """
+
+    corpus = dict(CORPUS)
+    corpus.update({f"golden {name}": text for name, (text, _) in GOLDEN.items()})
+
+    rng = random.Random(0)
+    for variant in FRONTMATTER_VARIANTS:
+        for note_number in range(synthetic_notes_per_variant):
+            corpus[f"synthetic {variant} {note_number}"] = make_note(rng=rng, note_number=note_number, lines=40,
+                                                                     open_tasks=rng.randint(0, 5),
+                                                                     frontmatter_variant=variant)
+
+    for directory in directories or []:
+        directory = os.path.expanduser(directory)
+        for root, files in walk_vault(directory=directory, ignore_rules=IgnoreRules()):
+            for entry in files:
+                if not entry.name.endswith('.md'):
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8', newline='') as f:
+                        corpus[entry.path] = f.read()
+                except (OSError, UnicodeDecodeError) as ex:
+                    print(f"Skipping over file '{entry.path}' which could not be read:  {ex}", file=sys.stderr)
+
+    return corpus
+
+
+def _scan(buffer, **kwargs) -> list:
+    """
+    Returns: What scan_task_lines() finds, hashed as parse_tasks_from_strings() hashes it
+    """
+
+    tasks = scan_task_lines(buffer=buffer, **kwargs)
+    for task, task_hash in zip(tasks, make_task_hashes(task_descriptions=[task['task'] for task in tasks])):
+        task['task_md5_hash'] = task_hash
+    return tasks
+
+
+def _fields(tasks: list) -> list:
+    return [tuple(task[field] for field in _TASK_FIELDS) for task in tasks or []]
+
+
+def _scan_memory_map(data: bytes) -> list:
+    """
+    Returns: What scan_task_lines() finds in a memory map of data, as find_tasks does for large files
+    """
+
+    if len(data) == 0:
+        return []  # An empty file can't be mapped
+
+    with tempfile.TemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            return scan_task_lines(buffer=mapped_file)
+
+
+def _check_note(text: str) -> list:
+    """
+    Returns: A description of each way the scan of a note goes wrong.  See the module docstring
+    """
+
+    problems = []
+
+    line_by_line = _fields(_parse_tasks_line_by_line(input_data=text))
+    scanned = _fields(_scan(buffer=text, skip_blocks=False, all_list_markers=False))
+    if scanned != line_by_line:
+        problems.append(f"Line by line found {line_by_line}, the scan found {scanned}")
+
+    from_text = scan_task_lines(buffer=text)
+    data = text.encode('utf-8')
+    lines = text.split('\n')
+    for label, from_bytes in (('bytes', scan_task_lines(buffer=data)), ('memory map', _scan_memory_map(data=data))):
+        if [{**task, 'byte_offset': None} for task in from_bytes] != [{**task, 'byte_offset': None}
+                                                                      for task in from_text]:
+            problems.append(f"Scanning the {label} found {from_bytes}, scanning the text found {from_text}")
+            continue
+        for task in from_bytes:
+            expected_offset = len('\n'.join(lines[:task['line_number'] - 1]).encode('utf-8')) + \
+                              (1 if task['line_number'] > 1 else 0)
+            if task['byte_offset'] != expected_offset:
+                problems.append(f"Scanning the {label} put line {task['line_number']} at byte {task['byte_offset']}, "
+                                f"rather than {expected_offset}")
+
+    return problems
+
+
+def compare(corpus: dict) -> list:
+    """
+    Runs each note in the corpus through both parsers, and prints where they differ
+    Returns: The names of the notes where they differ in a way they shouldn't
+    """
+
+    failures = []
+    for name, text in corpus.items():
+        failures.extend((name, problem) for problem in _check_note(text=text))
+
+    for name, (text, expected) in GOLDEN.items():
+        actual = [(task['line_number'], task['task']) for task in scan_task_lines(buffer=text)]
+        if actual != expected:
+            failures.append((f"golden {name}", f"Expected {expected}, found {actual}"))
+
+    differ = []
+    for name, text in corpus.items():
+        line_by_line = {task['line_number'] for task in _parse_tasks_line_by_line(input_data=text) or []}
+        scanned = {task['line_number'] for task in scan_task_lines(buffer=text)}
+        if scanned != line_by_line:
+            differ.append((name, sorted(line_by_line - scanned), sorted(scanned - line_by_line)))
+
+    print(f"{len(corpus)} notes and {len(GOLDEN)} golden notes compared.  {len(differ)} where skipping code blocks and "
+          f"comments, and other list markers, make a difference.  {len(failures)} failures")
+    if len(differ) > 0:
+        print(f"\n{'Note':<48}{'Lines skipped':>24}{'Lines added':>24}")
+        for name, skipped, added in differ:
+            print(f"{name[-48:]:<48}{str(skipped)[-24:]:>24}{str(added)[-24:]:>24}")
+    if len(failures) > 0:
+        print('\nFailures:')
+        for name, problem in failures:
+            print(f"{name}:  {problem}")
+
+    return sorted({name for name, _ in failures})
+
+
+def time_both(corpus: dict, repeats: int = 3, journal_lines: int = 200000):
+    """
+    Prints how long each parser takes over the whole corpus, a synthetic vault's worth of typical notes, and one long
+    note (e.g. a years long running journal) with a to-do item every 100 lines.  Hashing the to-do items found is
+    included in both.  The best of repeats runs
+    """
+
+    rng = random.Random(1)
+    notes = [make_note(rng=rng, note_number=note_number, lines=rng.choice((20, 40, 80, 200)),
+                       open_tasks=rng.randint(1, 5)) for note_number in range(3000)]
+    journal = make_note(rng=random.Random(0), note_number=0, lines=journal_lines, open_tasks=journal_lines // 100,
+                        frontmatter_variant='plain')
+
+    for heading, texts in ((f"{len(corpus)} notes", list(corpus.values())),
+                           (f"{len(notes)} synthetic notes with to-do items", notes),
+                           (f"One note of {journal_lines} lines", [journal])):
+        mebibytes = sum(len(text.encode('utf-8')) for text in texts) / 2 ** 20
+        print(f"\n{heading} ({mebibytes:.1f} MiB)")
+        print(f"{'':<16}{'Seconds':>12}{'MiB/s':>12}{'Speed up':>10}")
+        line_by_line_seconds = None
+        for label, function in (('Line by line', _parse_tasks_line_by_line), ('Scan', _scan)):
+            best = None
+            for _ in range(repeats):
+                started = time.perf_counter()
+                for text in texts:
+                    function(text)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            line_by_line_seconds = line_by_line_seconds or best
+            print(f"{label:<16}{best:>12.4f}{mebibytes / best:>12.1f}{line_by_line_seconds / best:>9.1f}x")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('directories', nargs='*', help='Directories of notes to add to the corpus')
+    arg_parser.add_argument('--synthetic', type=int, default=5,
+                            help='How many synthetic notes of each frontmatter variant to add')
+    arg_parser.add_argument('--journal-lines', type=int, default=200000,
+                            help='How many lines the long note that both parsers are timed over has')
+    arg_parser.add_argument('--repeats', type=int, default=3, help='How many times to time each')
+    args = arg_parser.parse_args()
+
+    corpus = build_corpus(directories=args.directories, synthetic_notes_per_variant=args.synthetic)
+    failed = compare(corpus=corpus)
+    time_both(corpus=corpus, repeats=args.repeats, journal_lines=args.journal_lines)
+
+    if len(failed) > 0:
+        sys.exit(1)
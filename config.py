@@ -18,6 +18,210 @@ def _read_base_dir_from_config(config_file_name: str = "config/config.json") ->
     ret_val = config['config']['markdown_base_directory']
     return ret_val
 
+def _read_scan_workers_from_config(config_file_name: str = "config/config.json") -> int:
+    """
+    Reads the number of workers to scan markdown files with from the configuration file.
+    This is optional and defaults to 1 (i.e. a serial scan)
+    Args:
+        config_file_name:
+
+    Returns: An integer.  A value of 0 means one worker per CPU
+    """
+
+    # Read the config file
+    with open(config_file_name, 'r') as f:
+        config = json.loads(f.read())
+
+    ret_val = int(config['config'].get('scan_workers', 1))
+    if ret_val < 0:
+        raise ValueError(f"The 'scan_workers' setting must not be negative.  Got {ret_val}")
+    if ret_val == 0:
+        ret_val = os.cpu_count() or 1
+
+    return ret_val
+
+def _read_todoist_max_in_flight_from_config(config_file_name: str = "config/config.json") -> int:
+    """
+    Reads how many requests to create tasks in Todoist may be outstanding at once from the configuration file.
+    This is optional and defaults to 4
+    Args:
+        config_file_name:
+
+    Returns: An integer
+    """
+
+    # Read the config file
+    with open(config_file_name, 'r') as f:
+        config = json.loads(f.read())
+
+    ret_val = int(config['config'].get('todoist_max_in_flight', 4))
+    if ret_val < 1:
+        raise ValueError(f"The 'todoist_max_in_flight' setting must be at least 1.  Got {ret_val}")
+
+    return ret_val
+
+def _read_todoist_backend_from_config(config_file_name: str = "config/config.json") -> str:
+    """
+    Reads how tasks should be created in Todoist from the configuration file.  This is optional and defaults to 'rest'
+    (one request per task).  'sync' sends tasks in batches through Todoist's sync API
+    Args:
+        config_file_name:
+
+    Returns: A string
+    """
+
+    # Read the config file
+    with open(config_file_name, 'r') as f:
+        config = json.loads(f.read())
+
+    ret_val = config['config'].get('todoist_backend', 'rest')
+    return ret_val
+
+def _read_settle_seconds_from_config(config_file_name: str = "config/config.json") -> float:
+    """
+    Reads how long a file must go unmodified before its to-do items are migrated from the configuration file.
+    This is optional and defaults to 60 seconds.  The idea is to not migrate to-do items the user is still typing
+    Args:
+        config_file_name:
+
+    Returns: A number of seconds
+    """
+
+    # Read the config file
+    with open(config_file_name, 'r') as f:
+        config = json.loads(f.read())
+
+    ret_val = float(config['config'].get('settle_seconds', 60))
+    if ret_val < 0:
+        raise ValueError(f"The 'settle_seconds' setting must not be negative.  Got {ret_val}")
+
+    return ret_val
+
+def _read_metrics_config_from_config(config_file_name: str = "config/config.json") -> dict:
+    """
+    Reads where to write run metrics (See metrics.py) from the configuration file.  This is optional.  By default,
+    nothing is written
+    Args:
+        config_file_name:
+
+    Returns: A dict with the keys json_file, prometheus_file and profile_file.  Each is a file name, or None
+    """
+
+    # Read the config file
+    with open(config_file_name, 'r') as f:
+        config = json.loads(f.read())
+
+    metrics_config = config['config'].get('metrics') or {}
+    unknown_keys = set(metrics_config.keys()) - {'json_file', 'prometheus_file', 'profile_file'}
+    if len(unknown_keys) > 0:
+        raise ValueError(f"Unknown keys in the 'metrics' setting:  {sorted(unknown_keys)}")
+
+    ret_val = dict(json_file=metrics_config.get('json_file'),
+                   prometheus_file=metrics_config.get('prometheus_file'),
+                   profile_file=metrics_config.get('profile_file'))
+    return ret_val
+
+def _read_logging_config_from_config(config_file_name: str = "config/config.json") -> dict:
+    """
+    Reads how much to log, and whether to also log as JSON lines (See run_log.py), from the configuration file.  This
+    is optional.  By default, each command logs as much as suits it and nothing is written as JSON lines
+    Args:
+        config_file_name:
+
+    Returns: A dict with the keys verbosity (one of 'quiet', 'normal' or 'verbose') and json_file.  Each may be None
+    """
+
+    # Read the config file
+    with open(config_file_name, 'r') as f:
+        config = json.loads(f.read())
+
+    logging_config = config['config'].get('logging') or {}
+    unknown_keys = set(logging_config.keys()) - {'verbosity', 'json_file'}
+    if len(unknown_keys) > 0:
+        raise ValueError(f"Unknown keys in the 'logging' setting:  {sorted(unknown_keys)}")
+
+    verbosity = logging_config.get('verbosity')
+    if verbosity not in (None, 'quiet', 'normal', 'verbose'):
+        raise ValueError(f"The 'verbosity' of the 'logging' setting must be 'quiet', 'normal' or 'verbose'.  Got "
+                         f"{verbosity}")
+
+    ret_val = dict(verbosity=verbosity, json_file=logging_config.get('json_file'))
+    return ret_val
+
+def _read_ignore_patterns_from_config(config_file_name: str = "config/config.json") -> list:
+    """
+    Reads the patterns of the directories and files to leave alone from the configuration file.  This is optional.
+    The patterns are gitignore style (See vault_walk.py), and are applied after the defaults
+    Args:
+        config_file_name:
+
+    Returns: A list of strings
+    """
+
+    # Read the config file
+    with open(config_file_name, 'r') as f:
+        config = json.loads(f.read())
+
+    ret_val = config['config'].get('ignore_patterns') or []
+    if type(ret_val) is not list:
+        raise TypeError(f"The 'ignore_patterns' setting must be a list of strings.  Got {ret_val}")
+
+    return ret_val
+
+def _read_vaults_from_config(config_file_name: str = "config/config.json", base_dir: str = None) -> list:
+    """
+    Reads the vaults to process from the configuration file.  Either 'vaults', a list of vaults to process together in
+    one run, or 'markdown_base_directory' for just the one.  Each vault in 'vaults' needs a 'path', and may override
+    any of 'name', 'file_ext', 'ignore_patterns' and 'settle_seconds'.  Whatever a vault doesn't override comes from
+    the top level settings
+    Args:
+        config_file_name:
+        base_dir:  If supplied (e.g. from the command line), just this vault is returned, with the top level settings
+
+    Returns: A list of dicts with the keys name, path, file_ext, ignore_patterns and settle_seconds.  The name
+        defaults to the last part of the path
+    """
+
+    # Read the config file
+    with open(config_file_name, 'r') as f:
+        config = json.loads(f.read())
+
+    defaults = dict(file_ext='.md', ignore_patterns=_read_ignore_patterns_from_config(config_file_name=config_file_name),
+                    settle_seconds=_read_settle_seconds_from_config(config_file_name=config_file_name))
+
+    if base_dir is not None:
+        vault_configs = [dict(path=base_dir)]
+    elif 'vaults' in config['config']:
+        vault_configs = config['config']['vaults']
+        if type(vault_configs) is not list or len(vault_configs) == 0:
+            raise TypeError(f"The 'vaults' setting must be a non-empty list of vaults.  Got {vault_configs}")
+    else:
+        vault_configs = [dict(path=config['config']['markdown_base_directory'])]
+
+    ret_val = []
+    for vault_config in vault_configs:
+        if 'path' not in vault_config:
+            raise ValueError(f"Every vault in the 'vaults' setting needs a 'path'.  Got {vault_config}")
+        unknown_keys = set(vault_config.keys()) - {'path', 'name'} - set(defaults.keys())
+        if len(unknown_keys) > 0:
+            raise ValueError(f"Unknown keys in the settings of vault '{vault_config['path']}':  {sorted(unknown_keys)}")
+
+        vault = dict(defaults)
+        vault.update(vault_config)
+        if not vault.get('name'):
+            vault['name'] = os.path.basename(os.path.normpath(os.path.expanduser(vault['path'])))
+        vault['settle_seconds'] = float(vault['settle_seconds'])
+        if vault['settle_seconds'] < 0:
+            raise ValueError(f"The 'settle_seconds' setting of vault '{vault['name']}' must not be negative.  "
+                             f"Got {vault['settle_seconds']}")
+        ret_val.append(vault)
+
+    names = [vault['name'] for vault in ret_val]
+    duplicate_names = sorted({name for name in names if names.count(name) > 1})
+    if len(duplicate_names) > 0:
+        raise ValueError(f"Each vault needs a different name.  Give these a 'name' setting:  {duplicate_names}")
+
+    return ret_val
 
 
 def _read_api_token_from_file(file_name:str):
@@ -0,0 +1,64 @@
+"""
+An index of task hashes used to avoid creating tasks in Todoist that already exist there
+"""
+
+from hashing import make_task_hash
+from hashing import make_task_hashes
+
+
+class DedupeIndex:
+    """
+    Maps task hashes (See hashing.make_task_hash) to the Todoist task that produced them.
+
+    Build one per run from the open tasks in Todoist, then check each markdown task against it with find().
+    Each Todoist task is hashed once, when it's added, and each lookup is a single dict lookup.  Tasks created during
+    the run should be added too, so the same to-do appearing twice in the vault is only migrated once.
+    """
+
+    def __init__(self, todoist_tasks=None):
+        """
+        Args:
+            todoist_tasks:  An optional iterable of Todoist tasks (anything with a 'content' attribute) to index
+        """
+
+        self._tasks_by_hash = {}
+
+        if todoist_tasks is not None:
+            todoist_tasks = list(todoist_tasks)
+            task_hashes = make_task_hashes(task_descriptions=[todoist_task.content for todoist_task in todoist_tasks])
+            for todoist_task, task_hash in zip(todoist_tasks, task_hashes):
+                self.add(todoist_task=todoist_task, task_hash=task_hash)
+
+    def add(self, todoist_task, task_hash: str = None):
+        """
+        Adds a Todoist task to the index.  If another task with the same hash is already indexed, that one is kept
+        Args:
+            todoist_task:  A Todoist task (anything with a 'content' attribute)
+            task_hash:  The hash of the task, if the caller already has it.  Computed from the content otherwise
+        """
+
+        if task_hash is None:
+            task_hash = make_task_hash(task_description=todoist_task.content)
+        self._tasks_by_hash.setdefault(task_hash, todoist_task)
+
+    def discard(self, task_hash: str):
+        """
+        Removes whatever is indexed under a task hash, if anything is
+        """
+
+        self._tasks_by_hash.pop(task_hash, None)
+
+    def find(self, task_hash: str):
+        """
+        Args:
+            task_hash:  The hash of a task parsed from markdown
+        Returns: The Todoist task it collides with, or None if there isn't one
+        """
+
+        return self._tasks_by_hash.get(task_hash)
+
+    def __contains__(self, task_hash: str) -> bool:
+        return task_hash in self._tasks_by_hash
+
+    def __len__(self) -> int:
+        return len(self._tasks_by_hash)
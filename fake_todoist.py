@@ -0,0 +1,348 @@
+"""
+A local, in-memory stand-in for the parts of the Todoist API this package uses.
+
+Useful for exercising migrate_tasks and the functions in todoist.py without a Todoist account or network access, and
+for seeing how they behave against a slow or unreliable API.  Point the todoist functions at it with their
+api_base_url argument.  See load_test.py for running whole migrations against it.
+
+Run it on its own with:
+    python fake_todoist.py --port 8765 --latency 0.25 --error-rate 0.01 --rate-limit-rate 0.05
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+API_PATH_PREFIX = '/api/v1'
+
+
+class FakeTodoistServer:
+    """
+    A threaded HTTP server holding open Todoist tasks in memory.
+
+    Can be used as a context manager, which starts the server on a background thread and stops it on exit:
+
+        with FakeTodoistServer(latency=0.1) as server:
+            todoist.create_task(..., api_base_url=server.url)
+            print(server.tasks)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, page_size: int = 50,
+                 rejected_contents: set = None, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: int = 1, seed: int = None):
+        """
+        Args:
+            host:  The interface to listen on
+            port:  The port to listen on.  0 picks a free port.  See the url attribute for the one actually used
+            latency:  Seconds to wait before answering each request, to mimic a round trip to the real API
+            page_size:  How many tasks to return per page when listing tasks
+            rejected_contents:  Task contents that the server refuses to create, to exercise partial failures
+            error_rate:  The share of requests (0 to 1) to fail with a 500, without doing anything
+            rate_limit_rate:  The share of requests (0 to 1) to turn away with a 429, as the real API does when too
+                many requests are made
+            retry_after:  The seconds to ask for in the Retry-After header of 429 responses
+            seed:  Seed for choosing which requests fail, so that runs can be repeated
+        """
+
+        self.latency = latency
+        self.page_size = page_size
+        self.rejected_contents = set(rejected_contents or ())
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.tasks = []  # Open tasks, as the JSON dicts the real API returns
+        self.changes = []  # Every task ever added or closed, in order.  The sync_token is an index into this list
+        self.request_counts = collections.Counter()  # Keyed by '<METHOD> <path>'
+        self.injected_failures = collections.Counter()  # Keyed by the status code sent back
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Returns: The base URL of the server, e.g. http://127.0.0.1:54321
+        """
+
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Starts serving on a background thread
+        """
+
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-todoist', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and waits for the background thread to finish
+        """
+
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def choose_failure(self):
+        """
+        Decides whether a request should fail on purpose.  See error_rate and rate_limit_rate
+        Returns: The status code to fail the request with, or None to handle it as usual
+        """
+
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                status = 429
+            elif roll < self.rate_limit_rate + self.error_rate:
+                status = 500
+            else:
+                return None
+            self.injected_failures[status] += 1
+
+        return status
+
+    def add_task(self, content: str, description: str = '', due_string: str = None) -> dict:
+        """
+        Creates a task, as the real API would.  Also handy for seeding the server with existing tasks
+        Returns: The task, as a dict shaped like the real API's JSON
+        """
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            task_id = str(self._next_id)
+            self._next_id += 1
+
+            due = None
+            if due_string:
+                due = dict(date=now.strftime('%Y-%m-%d'), string=due_string, lang='en', is_recurring=False,
+                           timezone=None)
+
+            task = dict(id=task_id, content=content, description=description or '', project_id='inbox',
+                        section_id=None, parent_id=None, labels=[], priority=1, due=due, deadline=None,
+                        duration=None, is_collapsed=False, child_order=len(self.tasks) + 1, responsible_uid=None,
+                        assigned_by_uid=None, completed_at=None, added_by_uid='fake-user',
+                        added_at=now.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                        updated_at=now.strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
+            self.tasks.append(task)
+            self.changes.append(dict(task, checked=False, is_deleted=False))
+
+        return task
+
+    def close_task(self, task_id: str):
+        """
+        Marks a task as completed, as if it had been checked off in Todoist
+        """
+
+        with self._lock:
+            for task in self.tasks:
+                if task['id'] == task_id:
+                    self.tasks.remove(task)
+                    self.changes.append(dict(task, checked=True, is_deleted=False))
+                    break
+
+    def read_changes(self, sync_token: str):
+        """
+        Answers a sync API read for tasks ('items')
+        Args:
+            sync_token:  '*' for everything, otherwise a token from a previous read
+        Returns: The response payload, or None if the sync_token is not valid
+        """
+
+        with self._lock:
+            if sync_token == '*':
+                return dict(sync_token=str(len(self.changes)), full_sync=True, items=list(self.tasks))
+            if not sync_token.isdigit() or int(sync_token) > len(self.changes):
+                return None
+
+            # Only the latest version of each changed task
+            changed = {}
+            for change in self.changes[int(sync_token):]:
+                changed[change['id']] = change
+            return dict(sync_token=str(len(self.changes)), full_sync=False, items=list(changed.values()))
+
+    def sync(self, commands: list) -> dict:
+        """
+        Applies a batch of sync API commands.  Only 'item_add' is supported; anything else fails on its own without
+        affecting the rest of the batch, as with the real API
+        Returns: The response payload, with 'sync_status' and 'temp_id_mapping'
+        """
+
+        sync_status = {}
+        temp_id_mapping = {}
+        for command in commands:
+            command_args = command.get('args') or {}
+            content = command_args.get('content')
+            if command.get('type') != 'item_add':
+                sync_status[command.get('uuid')] = dict(error_code=1, error="Unsupported command type")
+            elif not content or content in self.rejected_contents:
+                sync_status[command.get('uuid')] = dict(error_code=20, error='Invalid argument value')
+            else:
+                due = command_args.get('due') or {}
+                task = self.add_task(content=content, description=command_args.get('description'),
+                                     due_string=due.get('string'))
+                sync_status[command.get('uuid')] = 'ok'
+                if command.get('temp_id'):
+                    temp_id_mapping[command['temp_id']] = task['id']
+
+        return dict(sync_status=sync_status, temp_id_mapping=temp_id_mapping)
+
+    def list_tasks(self, cursor: str = None, limit: int = None):
+        """
+        Returns: A tuple of (page of tasks, cursor for the next page or None)
+        """
+
+        limit = limit or self.page_size
+        start = int(cursor) if cursor else 0
+        with self._lock:
+            page = self.tasks[start:start + limit]
+            next_cursor = str(start + limit) if start + limit < len(self.tasks) else None
+
+        return page, next_cursor
+
+
+def _make_handler(server: FakeTodoistServer):
+    """
+    Builds a request handler class bound to a FakeTodoistServer
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+        def log_message(self, format, *args):
+            pass  # Keep the console quiet
+
+        def _send_json(self, status: int, payload, headers: dict = None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length == 0:
+                return {}
+            body = self.rfile.read(length).decode('utf-8')
+
+            # The sync API takes form encoded fields, each holding JSON (or a plain string, as with sync_token)
+            if (self.headers.get('Content-Type') or '').startswith('application/x-www-form-urlencoded'):
+                fields = {}
+                for k, v in urllib.parse.parse_qs(body).items():
+                    try:
+                        fields[k] = json.loads(v[0])
+                    except ValueError:
+                        fields[k] = v[0]
+                return fields
+            return json.loads(body)
+
+        def _begin(self, method: str):
+            """
+            Common handling for every request.  Returns the parsed URL, or None if a response was already sent
+            """
+
+            parsed_url = urllib.parse.urlparse(self.path)
+            server.request_counts[f"{method} {parsed_url.path}"] += 1
+
+            if server.latency > 0:
+                time.sleep(server.latency)
+
+            if not (self.headers.get('Authorization') or '').startswith('Bearer '):
+                self._send_json(401, dict(error='Unauthorized'))
+                return None
+
+            # Fail on purpose, as configured.  The request body still has to be read, to keep the connection usable
+            failure_status = server.choose_failure()
+            if failure_status is not None:
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if failure_status == 429:
+                    self._send_json(429, dict(error='Too many requests', error_tag='LIMITS_REACHED', http_code=429,
+                                              error_extra=dict(retry_after=server.retry_after)),
+                                    headers={'Retry-After': str(server.retry_after)})
+                else:
+                    self._send_json(failure_status, dict(error='Internal server error'))
+                return None
+
+            return parsed_url
+
+        def do_GET(self):
+            parsed_url = self._begin('GET')
+            if parsed_url is None:
+                return
+
+            if parsed_url.path == f"{API_PATH_PREFIX}/tasks":
+                query = urllib.parse.parse_qs(parsed_url.query)
+                limit = int(query['limit'][0]) if 'limit' in query else None
+                cursor = query['cursor'][0] if 'cursor' in query else None
+                page, next_cursor = server.list_tasks(cursor=cursor, limit=limit)
+                self._send_json(200, dict(results=page, next_cursor=next_cursor))
+            else:
+                self._send_json(404, dict(error='Not found'))
+
+        def do_POST(self):
+            parsed_url = self._begin('POST')
+            if parsed_url is None:
+                return
+
+            payload = self._read_json()
+            if parsed_url.path == f"{API_PATH_PREFIX}/tasks":
+                if not payload.get('content') or payload['content'] in server.rejected_contents:
+                    self._send_json(400, dict(error='Invalid argument value'))
+                    return
+                task = server.add_task(content=payload['content'], description=payload.get('description'),
+                                       due_string=payload.get('due_string'))
+                self._send_json(200, task)
+            elif parsed_url.path == f"{API_PATH_PREFIX}/sync" and 'sync_token' in payload:
+                response = server.read_changes(sync_token=str(payload['sync_token']))
+                if response is None:
+                    self._send_json(400, dict(error='Invalid sync token', error_tag='INVALID_SYNC_TOKEN'))
+                else:
+                    self._send_json(200, response)
+            elif parsed_url.path == f"{API_PATH_PREFIX}/sync":
+                self._send_json(200, server.sync(commands=payload.get('commands') or []))
+            else:
+                self._send_json(404, dict(error='Not found'))
+
+    return _Handler
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8765)
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='Seconds of delay to add to each request')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests to fail with a 500')
+    arg_parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests to fail with a 429')
+    arg_parser.add_argument('--seed', type=int, default=None)
+    args = arg_parser.parse_args()
+
+    fake_server = FakeTodoistServer(host=args.host, port=args.port, latency=args.latency, error_rate=args.error_rate,
+                                    rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    print(f"Fake Todoist API listening on {fake_server.url}.  Ctrl+C to stop")
+    try:
+        fake_server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,34 +1,398 @@
 """
 This module contains functions for parsing (potential) todo items out of markdown
 """
+import collections
+import contextlib
+import logging
+import mmap
 import os.path
-import re
+import queue
+import stat
 import sys
-import urllib.parse
-import socket
-import uuid
-
-from config import _read_base_dir_from_config
+import threading
+import time
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+from config import _read_logging_config_from_config
+from config import _read_scan_workers_from_config
+from config import _read_metrics_config_from_config
+from config import _read_vaults_from_config
+from parsers import _count_newlines
 from parsers import parse_tasks_from_strings
 from parsers import get_todoist_front_matter_setting
-from helpers import resolve_vault_name
-from helpers import running_on_wsl
+from parsers import might_contain_tasks
+from parsers import scan_task_lines
+from hashing import make_task_hashes
+from helpers import VaultResolver
+from metrics import METRICS
+from metrics import profile
+from run_log import configure_logging
+from run_log import get_logger
+from run_log import log_run_summary
+from scan_index import ScanIndex
+from scan_index import digest_file_contents
+from scan_index import scan_indexes_for_vaults
+from task_records import FileRecord
+from task_records import get_host_record
+from task_records import make_task_records
+from vault_walk import IgnoreRules
+from vault_walk import relative_vault_path
+from vault_walk import walk_vault
+
+MMAP_MIN_FILE_SIZE = 256 * 1024  # Files at least this big are mapped into memory rather than read, to test them
+
+# Files at least this big (e.g. years long running journals) are never read into memory as a whole.  They're scanned
+# through a memory map instead, and their to-do items carry the byte offset of their line, so that migrate_tasks can
+# splice the migrated lines into the file.  See _parse_large_file()
+LARGE_FILE_MIN_SIZE = 4 * 1024 * 1024
+LARGE_FILE_HEAD_SIZE = 1024 * 1024  # How much of the start of a large file is decoded to find its frontmatter in
+
+# Handed to _parse_file_contents() in place of the contents of a large file, which it maps into memory itself
+LargeFile = collections.namedtuple('LargeFile', ['file_name'])
+
+LOG = get_logger('find_tasks')
+
+
+def _parse_file_contents(data: bytes):
+    """
+    Works out the todoist frontmatter setting of a file and parses its to-do items from its raw contents
+    This is the CPU heavy part of scanning a file (YAML and regex), so it's kept free of any shared state so that it
+    can run in a worker process
+    Args:
+        data:  The raw bytes of the file, or a LargeFile
+    Returns: A tuple of (todoist frontmatter setting, list of tasks or None)
+    """
+
+    if isinstance(data, LargeFile):
+        return _parse_large_file(file_name=data.file_name)
+
+    # Most notes don't have any to-do items in them at all.  Don't bother decoding those, or parsing their frontmatter
+    if not might_contain_tasks(data):
+        return None, None
+
+    data_string = data.decode('utf-8')
+
+    # Does the frontmatter in the file indicate we should not parse for to-do items?
+    todoist_frontmatter_setting = get_todoist_front_matter_setting(input_string=data_string, read_file=False)
+    if todoist_frontmatter_setting is False:
+        tasks = None
+    else:
+        tasks = parse_tasks_from_strings(input_data=data_string)
+
+    return todoist_frontmatter_setting, tasks
+
+
+def _parse_large_file(file_name: str):
+    """
+    Works out the todoist frontmatter setting of a large file and parses its to-do items, without reading the whole file
+    into memory.  The file is mapped into memory and scanned in place by scan_task_lines(), which only decodes the lines
+    it has to test.  The same to-do items are found as by _parse_file_contents(), with the same line numbers, and each
+    also records the byte_offset its line starts at
+    Args:
+        file_name:  The fully qualified path to the file.  Expected to be at least LARGE_FILE_MIN_SIZE bytes
+    Returns: A tuple of (todoist frontmatter setting, list of tasks or None)
+    """
+
+    with open(file_name, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None, None  # Emptied since it was stat'ed.  An empty file can't be mapped
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            if not might_contain_tasks(mapped_file):
+                return None, None
+
+            # Frontmatter is at the very start of a note.  Frontmatter that runs on past LARGE_FILE_HEAD_SIZE is
+            # treated as no frontmatter at all
+            head_string = mapped_file[:LARGE_FILE_HEAD_SIZE].decode('utf-8', errors='ignore')
+            todoist_frontmatter_setting = get_todoist_front_matter_setting(input_string=head_string, read_file=False)
+            if todoist_frontmatter_setting is False:
+                return todoist_frontmatter_setting, None
+
+            started = time.perf_counter()
+            all_todos = scan_task_lines(buffer=mapped_file)
+            lines_in_file = _count_newlines(buffer=mapped_file, start=0, end=len(mapped_file)) + 1
+
+    # The same as parse_tasks_from_strings() does
+    task_hashes = make_task_hashes(task_descriptions=[todo['task'] for todo in all_todos])
+    for todo, task_hash in zip(all_todos, task_hashes):
+        todo['task_md5_hash'] = task_hash
+
+    METRICS.observe('parse', time.perf_counter() - started)
+    METRICS.increment('lines_parsed', lines_in_file)
+    METRICS.increment('large_files_parsed')
+
+    return todoist_frontmatter_setting, all_todos if len(all_todos) > 0 else None
+
+
+def _parse_file_contents_in_worker(data: bytes):
+    """
+    Runs _parse_file_contents() in a worker process, and hands back what was recorded in METRICS along the way so
+    that it can be merged into the calling process' METRICS
+    Returns: A tuple of (what _parse_file_contents() returned, METRICS snapshot)
+    """
+
+    METRICS.reset()  # Worker processes are reused.  Only report what happened while parsing this file
+    return _parse_file_contents(data=data), METRICS.snapshot()
+
+
+def _read_file(file_name: str):
+    """
+    Reads a file, and tests whether it might hold to-do items (See parsers.might_contain_tasks()).  Big files are
+    mapped into memory to be digested and tested, so that the ones without to-do items are never copied into a bytes
+    object at all
+    Args:
+        file_name:  The fully qualified path to the file
+    Returns: A tuple of (digest of the contents, the raw contents or None if the file holds no to-do items).  For a
+        file of at least LARGE_FILE_MIN_SIZE bytes, a LargeFile rather than the raw contents
+    """
+
+    with METRICS.timer('read'):
+        digest, data, size = _read_file_uninstrumented(file_name=file_name)
+
+    METRICS.increment('files_read')
+    METRICS.increment('bytes_read', size)
+    if data is None:
+        METRICS.increment('files_skipped_by_prefilter')
+
+    return digest, data
+
+
+def _read_file_uninstrumented(file_name: str):
+    """
+    See _read_file()
+    Returns: A tuple of (digest, the raw contents or None, size of the file in bytes)
+    """
+
+    with open(file_name, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_MIN_FILE_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                digest = digest_file_contents(mapped_file)
+                if not might_contain_tasks(mapped_file):
+                    return digest, None, size
+                if size >= LARGE_FILE_MIN_SIZE:
+                    return digest, LargeFile(file_name=file_name), size
+                return digest, mapped_file[:], size
+
+        data = f.read()
+
+    digest = digest_file_contents(data)
+    if not might_contain_tasks(data):
+        return digest, None, len(data)
+
+    return digest, data, len(data)
+
+
+def _read_and_submit_file(file_name: str, previous_digest: str, process_pool: Executor):
+    """
+    Runs on an I/O thread.  Reads a file and hands its contents off to the process pool for parsing, unless the
+    contents are the same as the last time the file was indexed
+    Args:
+        file_name:  The fully qualified path to the file
+        previous_digest:  The digest stored in the scan index for this file, if any
+        process_pool:  The pool to parse the file in
+    Returns: A tuple of (digest, Future of _parse_file_contents_in_worker or None if the file is unchanged)
+    """
+
+    digest, data = _read_file(file_name=file_name)
+
+    if digest == previous_digest:
+        return digest, None
+
+    # No to-do items, so there's nothing worth shipping off to another process
+    if data is None:
+        no_tasks = Future()
+        no_tasks.set_result(((None, None), None))
+        return digest, no_tasks
+
+    return digest, process_pool.submit(_parse_file_contents_in_worker, data)
+
+
+def _make_process_pool(workers: int):
+    """
+    Builds the pool of processes that files are parsed in.  Its workers are started by a fork server (or spawned,
+    where there's no fork server) rather than forked from this process:  they're first started from the I/O threads,
+    while other threads may be holding locks (e.g. METRICS' or a logging handler's).  A forked worker would inherit
+    such a lock already held, and hang the first time it took it
+    Args:
+        workers:  The number of processes
+    Returns: A concurrent.futures.ProcessPoolExecutor
+    """
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor  # Slow to import, and only needed for parallel scans
+
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+
+
+def _scan_files_in_parallel(files, scan_index: ScanIndex = None, workers: int = 2, process_pool: Executor = None):
+    """
+    Scans files using a pool of threads for reading and a pool of processes for parsing.
+    Results are yielded in the same order as files, regardless of which files finish first, so the output is the
+    same as a serial scan.  A file that fails to scan is reported and skipped rather than failing the whole scan
+    Args:
+        files:  An iterable of tuples of (fully qualified path, os.stat_result), as yielded by _walk_files()
+        scan_index:  An optional ScanIndex to consult and update.  Only touched from the calling thread
+        workers:  The number of threads and of processes to use
+        process_pool:  A pool to parse the files in, shared with other scans (See iter_tasks_in_vaults()) and left
+            running afterwards.  If not supplied, one with workers processes is built for this scan
+    Returns: A generator of tuples of (file name, os.stat_result, todoist frontmatter setting, list of tasks or None)
+    """
+
+    window = workers * 16  # How many files may be in flight at once.  Bounds memory use on big vaults
+    pending = collections.deque()
+
+    def _collect(file_name, stat_result, cached, read_future):
+        if cached is not None:
+            return cached
+        digest, parse_future = read_future.result()
+        if parse_future is None:
+            entry = scan_index.revalidate(file_name=file_name, stat_result=stat_result, digest=digest)
+            if entry is not None:
+                return entry['todoist_setting'], [dict(t) for t in entry['tasks']] if entry['tasks'] else None
+            # Someone changed the index under us.  Unlikely, but parse the file in this process
+            with open(file_name, 'rb') as f:
+                todoist_frontmatter_setting, tasks = _parse_file_contents(data=f.read())
+        else:
+            (todoist_frontmatter_setting, tasks), worker_metrics = parse_future.result()
+            if worker_metrics is not None:
+                METRICS.merge(worker_metrics)
+        if scan_index is not None:
+            scan_index.store(file_name=file_name, stat_result=stat_result, digest=digest,
+                             todoist_setting=todoist_frontmatter_setting, tasks=tasks)
+        return todoist_frontmatter_setting, tasks
+
+    def _collect_isolated(item):
+        file_name, stat_result = item[0], item[1]
+        try:
+            return (file_name, stat_result) + _collect(*item)
+        except Exception as ex:
+            LOG.warning(f"Skipping over file '{file_name}' after an exception of type {type(ex)} while scanning it:  "
+                        f"{ex}")
+            return None
+
+    if process_pool is None:
+        process_pool_context = _make_process_pool(workers=workers)
+    else:
+        process_pool_context = contextlib.nullcontext(process_pool)  # The caller's to shut down
+
+    with ThreadPoolExecutor(max_workers=workers) as io_pool, process_pool_context as process_pool:
+        for file_name, stat_result in files:
+            # Unchanged files are served from the index without going anywhere near the pools
+            cached = None
+            read_future = None
+            previous_digest = None
+            if scan_index is not None:
+                entry = scan_index.lookup(file_name=file_name, stat_result=stat_result)
+                if entry is not None:
+                    cached = entry['todoist_setting'], [dict(t) for t in entry['tasks']] if entry['tasks'] else None
+                else:
+                    previous_digest = scan_index.previous_digest(file_name=file_name)
+            if cached is None:
+                read_future = io_pool.submit(_read_and_submit_file, file_name, previous_digest, process_pool)
+
+            pending.append((file_name, stat_result, cached, read_future))
+
+            while len(pending) >= window:
+                result = _collect_isolated(pending.popleft())
+                if result is not None:
+                    yield result
+
+        while len(pending) > 0:
+            result = _collect_isolated(pending.popleft())
+            if result is not None:
+                yield result
+
+
+def _scan_files_serially(files, scan_index: ScanIndex = None):
+    """
+    Scans files one at a time, on this thread.  Like _scan_files_in_parallel(), a file that can't be scanned (e.g. it
+    isn't valid UTF-8) is reported and skipped, rather than ending the scan of the rest of the vault
+    Args:
+        files:  An iterable of tuples of (fully qualified file name, os.stat_result), as yielded by _walk_files()
+        scan_index:  An optional ScanIndex to consult and update
+    Returns: A generator of tuples of (file name, os.stat_result, todoist frontmatter setting, list of tasks or None)
+    """
+
+    for file_name, stat_result in files:
+        try:
+            scanned = _scan_file(file_name=file_name, scan_index=scan_index, stat_result=stat_result)
+        except Exception as ex:
+            LOG.warning(f"Skipping over file '{file_name}' after an exception of type {type(ex)} while scanning it:  "
+                        f"{ex}")
+            continue
+
+        yield (file_name, stat_result) + scanned
+
+
+def _scan_file(file_name: str, scan_index: ScanIndex = None, stat_result: os.stat_result = None):
+    """
+    Reads a file (once) and works out both its todoist frontmatter setting and the to-do items in it.
+    If a scan index is supplied and the file hasn't changed since it was indexed, the file isn't read at all
+    Args:
+        file_name:  The fully qualified path to the file
+        scan_index:  An optional ScanIndex to consult and update
+        stat_result:  The file's os.stat_result, if the caller already has it (e.g. from the walk).  Stat'ed here if
+            not supplied
+    Returns: A tuple of (todoist frontmatter setting, list of tasks or None).  The tasks carry no file metadata yet
+    """
+
+    if stat_result is None:
+        stat_result = os.stat(file_name)
+
+    if scan_index is not None:
+        entry = scan_index.lookup(file_name=file_name, stat_result=stat_result)
+        if entry is not None:
+            tasks = [dict(t) for t in entry['tasks']] if entry['tasks'] else None
+            return entry['todoist_setting'], tasks
+
+    digest, data = _read_file(file_name=file_name)
+
+    # The file was touched, but its contents are the same as the last time we parsed it
+    if scan_index is not None:
+        entry = scan_index.revalidate(file_name=file_name, stat_result=stat_result, digest=digest)
+        if entry is not None:
+            tasks = [dict(t) for t in entry['tasks']] if entry['tasks'] else None
+            return entry['todoist_setting'], tasks
+
+    if data is None:
+        todoist_frontmatter_setting, tasks = None, None
+    else:
+        todoist_frontmatter_setting, tasks = _parse_file_contents(data=data)
+
+    if scan_index is not None:
+        scan_index.store(file_name=file_name, stat_result=stat_result, digest=digest,
+                         todoist_setting=todoist_frontmatter_setting, tasks=tasks)
+
+    return todoist_frontmatter_setting, tasks
 
 
-def _find_tasks_in_file(file_name: str):
+def _find_tasks_in_file(file_name: str, tasks: list = None, vault_resolver: VaultResolver = None,
+                        stat_result: os.stat_result = None):
     """
 
     Args:
         file_name:  The file name we wish to look for / parse to-do items from
-    Returns: a dictionary object with any to-do items found
+        tasks:  Tasks that were already parsed out of the file (See _scan_file).  If omitted, the file is read and
+            parsed here
+        vault_resolver:  Resolves the vault, note name and Obsidian URI of the file.  One is built if not supplied,
+            but callers handling many files should build one and pass it in
+        stat_result:  The file's os.stat_result, if the caller already has it.  Stat'ed here if not supplied
+    Returns: a list of TaskRecords (See task_records.py) for any to-do items found, or None
     """
 
-    # Read the file as a string
-    with open(file_name, 'r') as f:
-        data_string = f.read()
+    if tasks is None and os.path.getsize(file_name) >= LARGE_FILE_MIN_SIZE:
+        _, tasks = _parse_large_file(file_name=file_name)
+    elif tasks is None:
+        # Read the file as a string
+        with open(file_name, 'r') as f:
+            data_string = f.read()
 
-    # Parse each of the lines from the string for to-do items
-    tasks = parse_tasks_from_strings(input_data=data_string)
+        # Parse each of the lines from the string for to-do items
+        tasks = parse_tasks_from_strings(input_data=data_string)
 
     # Exit if we didn't find anything in the file
     if tasks is None:
@@ -36,50 +400,122 @@ def _find_tasks_in_file(file_name: str):
 
     # If we get to this point, we found 1 or more tasks in the file
 
-    # Get some metadata about this host and the file the to-dos were found in to augment the payload
-    file_inode = os.stat(file_name).st_ino
-    mac_address = hex(uuid.getnode())
-    host_name = socket.gethostname()
+    # Get some metadata about the file the to-dos were found in.  It's shared by all of the file's to-do items
+    if stat_result is None:
+        stat_result = os.stat(file_name)
+    file_inode = stat_result.st_ino
+
+    # Resolve the note name, Vault name and Obsidian URI.  See:  https://help.obsidian.md/Advanced+topics/Using+obsidian+URI
+    if vault_resolver is None:
+        vault_resolver = VaultResolver()
+    file_details = vault_resolver.describe_file(file_name=file_name)
+    note_name = file_details['note_name']
+    obsidian_uri = file_details['obsidian_uri']
+    file_name_escaped = file_details['file_name_escaped']
+
+    file_record = FileRecord(file_name=file_name, inode=file_inode, file_name_escaped=file_name_escaped,
+                             obsidian_uri=obsidian_uri)
+    tasks = make_task_records(parsed_tasks=tasks, file_record=file_record, host_record=get_host_record())
+    METRICS.increment('files_with_tasks')
+    METRICS.increment('tasks_found', len(tasks))
+
+    # Log some nice messages about what we found.  Only worth building them if they'll be shown (See run_log.py)
+    if LOG.isEnabledFor(logging.DEBUG):
+        LOG.debug(f"\nFound {len(tasks)} To-Do items in note: '{note_name}'\nObsidian URI: {obsidian_uri}\n"
+                  f"Path to File:  {file_name_escaped}",
+                  extra=dict(fields=dict(event='note_with_tasks', file_name=file_name, task_count=len(tasks))))
+        for task in tasks:
+            LOG.debug(f"To-Do:  '{task.task}'",
+                      extra=dict(fields=dict(event='task_found', file_name=file_name, line_number=task.line_number,
+                                             task=task.task)))
 
-    # Get note name from fully qualified path.  It's the short file name with the '.md' extension removed
-    note_name = re.sub(pattern=r'.md$', repl='', string=os.path.basename(file_name))
+    return tasks
 
-    # Resolve the Obsidian Vault name.  This allows us to use more of the methods in the Obsidian URI scheme
-    vault_name = resolve_vault_name(file_name=file_name)
+def _walk_files(parent_directory: str, file_ext: tuple, ignore_rules: IgnoreRules = None):
+    """
+    Walks a directory (See vault_walk.walk_vault()) yielding the files that have one of the desired extensions.
+    Ignored directories are pruned from the walk, and each file is stat'ed once, here, for the rest of the scan to use
+    Args:
+        parent_directory:  The directory to walk
+        file_ext:  A tuple of file extensions, each prefixed with a '.'
+        ignore_rules:  The IgnoreRules to prune the walk with.  Nothing is ignored if not supplied
+    Returns: A generator of tuples of (fully qualified file name, os.stat_result), in walk order
+    """
 
-    # Create Obsidian URI.  See:  https://help.obsidian.md/Advanced+topics/Using+obsidian+URI
-    # obsidian_uri = f"obsidian://open?path={urllib.parse.quote(file_name,safe='')}"  # Areese, 2023-09-27.  Commented out to match similar line from markdown_to_omnifocus
-    obsidian_uri = f"obsidian://open?vault={urllib.parse.quote(vault_name,safe='')}" \
-                   f"&file={urllib.parse.quote(note_name,safe='')}"
-    file_name_escaped = file_name.replace(' ', '\ ')
+    walker = walk_vault(directory=parent_directory, ignore_rules=ignore_rules)
+    while True:
+        started = time.perf_counter()
+        walked = next(walker, None)
+        METRICS.observe('walk', time.perf_counter() - started)
+        if walked is None:
+            break
 
-    # Print some nice messages about what we found
-    print(f"\nFound {len(tasks)} To-Do items in note: '{note_name}'")
-    print(f"Obsidian URI: {obsidian_uri}")
-    print(f"Path to File:  {file_name_escaped}")
-    for task in tasks:
-        task_description = task['task']
+        root, files = walked
+        METRICS.increment('directories_walked')
 
-        # Inject file metadata
-        task['from_file_inode'] = file_inode
-        task['from_mac_address'] = mac_address
-        task['from_hostname'] = host_name
-        task['file_name'] = file_name
-        task['file_name_escaped'] = file_name_escaped  # This shows double escaped in json output
-        task['obsidian_uri'] = obsidian_uri
+        for entry in files:
+            # One suffix test against every extension at once
+            if not entry.name.endswith(file_ext):
+                continue
 
-        print(f"To-Do:  '{task['task']}'") # That's a 'white square' just for visual reasons.  See:  https://www.alt-codes.net/square-symbols
+            try:
+                stat_result = entry.stat()
+            except OSError as ex:
+                LOG.warning(f"Skipping over file '{entry.path}' which could not be stat'ed:  {ex}")
+                continue
+
+            METRICS.increment('files_walked')
+            yield entry.path, stat_result
+
+
+def _stat_files(parent_directory: str, file_names: list, file_ext: tuple, ignore_rules: IgnoreRules = None):
+    """
+    The counterpart of _walk_files() for a list of files (e.g. the ones that just changed), rather than a walk.
+    Files that no longer exist, that don't have one of the desired extensions or that are ignored are skipped
+    Returns: A generator of tuples of (fully qualified file name, os.stat_result)
+    """
+
+    for file_name in file_names:
+        if not file_name.endswith(file_ext):
+            continue
+        if ignore_rules is not None and ignore_rules.is_path_ignored(relative_vault_path(file_name, parent_directory)):
+            continue
+
+        try:
+            stat_result = os.stat(file_name)
+        except OSError:
+            continue
+        if not stat.S_ISREG(stat_result.st_mode):
+            continue
+
+        yield file_name, stat_result
 
-    return tasks
 
-def find_tasks(parent_directory:str = '~/Obsidian', file_ext= ".md") -> dict:
+def iter_tasks(parent_directory:str = '~/Obsidian', file_ext= ".md", scan_index: ScanIndex = None,
+               workers: int = 1, vault_resolver: VaultResolver = None, file_names: list = None,
+               ignore_rules: IgnoreRules = None, process_pool: Executor = None):
     """
     Recurses over a directory and any subdirectories found within looking for files with the
-    extension(s) defined in the file_ext argument.  These are parsed for to-do items
+    extension(s) defined in the file_ext argument.  These are parsed for to-do items, which are yielded one file at a
+    time, as soon as each file has been parsed.  Unlike find_tasks(), the caller can get on with the first file's
+    to-do items while the rest of the vault is still being walked
     Args:
         parent_directory:  The parent director to seek files within
         file_ext: a string or list of file extensions to parse for to-do items within
-    Returns: A dict describing all found matches
+        scan_index: An optional ScanIndex.  Files that haven't changed since they were indexed are not re-read.
+            The index is pruned of deleted files and saved once the walk is complete (or just saved, if the caller
+            stops early)
+        workers: The number of workers to scan files with.  With more than 1, files are read on a pool of threads
+            and parsed on a pool of processes.  The output is the same (and in the same order) as a serial scan
+        vault_resolver: An optional VaultResolver.  If not supplied, one is built the first time a file with tasks
+            in it is found
+        file_names: Optionally, a list of fully qualified paths to scan instead of walking parent_directory (e.g.
+            the files that just changed).  Files that no longer exist are skipped.  The scan index isn't pruned
+        ignore_rules: The IgnoreRules (See vault_walk.py) saying which directories and files to leave alone.  If not
+            supplied, only the defaults (.obsidian/, .trash/, .git/ and the like) are ignored
+        process_pool: With more than 1 worker, an optional pool of processes to parse files in (See
+            _make_process_pool()), e.g. shared by several vaults.  If not supplied, one is built for this scan
+    Returns: A generator of lists of TaskRecords.  Each list holds the to-do items found in one file
     """
 
     """
@@ -92,7 +528,7 @@ def find_tasks(parent_directory:str = '~/Obsidian', file_ext= ".md") -> dict:
     if not os.path.isdir(parent_directory):
         raise FileNotFoundError(f"The parent_directory argument '{parent_directory}' does not exist!")
     else:
-        print(f"Files will be sought under the path '{parent_directory}'")
+        LOG.info(f"Files will be sought under the path '{parent_directory}'")
 
     """
     Handle file_extension(s)
@@ -100,61 +536,118 @@ def find_tasks(parent_directory:str = '~/Obsidian', file_ext= ".md") -> dict:
 
     # Check the type of the argument
     if not type(file_ext) in (str, list):
-        raise TypeError(f"The file_ext argument must be a string or list of strings with the file extensions to seek.")
+        raise TypeError("The file_ext argument must be a string or list of strings with the file extensions to seek.")
 
     # Coerce to list as necessary
     if type(file_ext) is str:
         file_ext = [file_ext]
 
-    # Make sure every entry is unique
-    file_ext = list(set(file_ext))
-
     # See that every entry is a string and that it is prefixed with a '.'
     for item in file_ext:
         if type(item) is not str:
             raise TypeError(f"File Extension arguments should be strings.  Got value [{item}] which is of type "
                             f"{type(item)}")
-        if not item.startswith('.'):
-            file_ext.remove(item)
-            file_ext.append(f".{item}")
+
+    # Make sure every entry is unique.  A tuple, so that each file name can be tested with a single str.endswith()
+    file_ext = tuple(sorted({item if item.startswith('.') else f".{item}" for item in file_ext}))
+
+    if ignore_rules is None:
+        ignore_rules = IgnoreRules()
+
+    # The arguments are checked up front, but nothing is walked or read until the caller asks for the first file
+    return _iter_tasks(parent_directory=parent_directory, file_ext=file_ext, scan_index=scan_index, workers=workers,
+                       vault_resolver=vault_resolver, file_names=file_names, ignore_rules=ignore_rules,
+                       process_pool=process_pool)
+
+
+def _iter_tasks(parent_directory: str, file_ext: tuple, scan_index: ScanIndex = None, workers: int = 1,
+                vault_resolver: VaultResolver = None, file_names: list = None, ignore_rules: IgnoreRules = None,
+                process_pool: Executor = None):
+    """
+    The generator behind iter_tasks().  Arguments are as for iter_tasks(), already checked
+    """
 
     """
     Recurse over the directory, and parse files with desired extensions for to-do items
     """
 
-    all_todo_items = [] # Running list of to-do items, augmented with file, host, metadata
+    walk_whole_vault = file_names is None
+    if scan_index is not None:
+        scan_index.start_run()
+    if walk_whole_vault is True:
+        files = _walk_files(parent_directory=parent_directory, file_ext=file_ext, ignore_rules=ignore_rules)
+    else:
+        files = _stat_files(parent_directory=parent_directory, file_names=file_names, file_ext=file_ext,
+                            ignore_rules=ignore_rules)
+
+    if workers > 1:
+        scan_results = _scan_files_in_parallel(files=files, scan_index=scan_index, workers=workers,
+                                               process_pool=process_pool)
+    else:
+        scan_results = _scan_files_serially(files=files, scan_index=scan_index)
 
-    for root, dirs, files in os.walk(parent_directory):
+    walk_complete = False
+    try:
+        for long_file_name, stat_result, todoist_frontmatter_setting, tasks in scan_results:
 
-        # Short circuit if there are no files in the dir
-        if len(files) == 0:
-            continue
+            # Does the frontmatter in the file indicate we should not parse for to-do items?
+            if todoist_frontmatter_setting is False:
+                # print(f"\nSkipping over file '{long_file_name}' due to todoist frontmatter setting value: "
+                #       f"[{todoist_frontmatter_setting}].")
+                continue
+
+            # Nothing to do in this file
+            if tasks is None:
+                continue
+
+            if vault_resolver is None:
+                vault_resolver = VaultResolver()
+
+            tasks_from_file = _find_tasks_in_file(file_name=long_file_name, tasks=tasks, vault_resolver=vault_resolver,
+                                                  stat_result=stat_result)
+
+            if tasks_from_file is not None:
+                yield tasks_from_file
 
-        # Test each file for desired extension(s)
-        for short_file_name in files:
+        walk_complete = True
+    finally:
+        # Forget about files that have since been deleted, and persist the index for next time.  If the caller
+        # stopped early, files that weren't reached yet can't be told apart from deleted ones, so nothing is pruned
+        if scan_index is not None:
+            if walk_whole_vault is True and walk_complete is True:
+                scan_index.prune(parent_directory=parent_directory)
+            scan_index.save()
+            LOG.info(scan_index.summary())
 
-            file_ext_match = False
-            for extension in file_ext:
-                if short_file_name.endswith(extension):
-                    file_ext_match = True
-                    break
+            METRICS.increment('scan_index_hits', scan_index.hits)
+            METRICS.increment('scan_index_misses', scan_index.misses)
+            METRICS.increment('scan_index_evictions', scan_index.evictions)
 
-            # Found a file extension match.  Parse for to-do items
-            if file_ext_match is True:
-                long_file_name = os.path.join(root, short_file_name)
-                # print(f"Inspecting file: {long_file_name}")
 
-                # Does the frontmatter in the file indicate we should not parse for to-do items?
-                todoist_frontmatter_setting = get_todoist_front_matter_setting(input_string=long_file_name)
-                if todoist_frontmatter_setting is False:
-                    # print(f"\nSkipping over file '{long_file_name}' due to todoist frontmatter setting value: "
-                    #       f"[{todoist_frontmatter_setting}].")
-                    continue
+def find_tasks(parent_directory:str = '~/Obsidian', file_ext= ".md", scan_index: ScanIndex = None,
+               workers: int = 1, vault_resolver: VaultResolver = None, file_names: list = None,
+               ignore_rules: IgnoreRules = None) -> dict:
+    """
+    Recurses over a directory and any subdirectories found within looking for files with the
+    extension(s) defined in the file_ext argument.  These are parsed for to-do items.  See iter_tasks() for a
+    version that hands back each file's to-do items as soon as they're found
+    Args:
+        parent_directory:  The parent director to seek files within
+        file_ext: a string or list of file extensions to parse for to-do items within
+        scan_index: An optional ScanIndex.  See iter_tasks()
+        workers: The number of workers to scan files with.  See iter_tasks()
+        vault_resolver: An optional VaultResolver.  See iter_tasks()
+        file_names: Optionally, a list of fully qualified paths to scan instead of walking parent_directory
+        ignore_rules: An optional IgnoreRules.  See iter_tasks()
+    Returns: A list of TaskRecords (See task_records.py) describing all found matches, or None
+    """
 
-                tasks_from_file = _find_tasks_in_file(file_name=long_file_name)
+    all_todo_items = [] # Running list of to-do items, augmented with file, host, metadata
 
-                if tasks_from_file is not None:
-                    all_todo_items.extend(tasks_from_file)
+    for tasks_from_file in iter_tasks(parent_directory=parent_directory, file_ext=file_ext, scan_index=scan_index,
+                                      workers=workers, vault_resolver=vault_resolver, file_names=file_names,
+                                      ignore_rules=ignore_rules):
+        all_todo_items.extend(tasks_from_file)
 
     # Return the payload of all the sweet, sweet to-do items we found
     if len(all_todo_items) > 0:
@@ -165,13 +658,101 @@ def find_tasks(parent_directory:str = '~/Obsidian', file_ext= ".md") -> dict:
     return ret_val
 
 
+_VAULT_DONE = object()  # Put on the queue by each vault's thread once it's done.  See iter_tasks_in_vaults()
+
+
+def iter_tasks_in_vaults(vaults: list, scan_indexes: dict = None, workers: int = 1,
+                         vault_resolver: VaultResolver = None):
+    """
+    Finds the to-do items in several vaults at the same time.  Each vault is walked and scanned on its own thread, with
+    its own file extensions, ignore rules and ScanIndex.  The to-do items of each file are yielded as soon as they're
+    found, whichever vault they're in
+    Args:
+        vaults:  A list of dicts, one per vault, with the keys name, path, file_ext and ignore_patterns.  See
+            config._read_vaults_from_config()
+        scan_indexes:  Optionally, a dict of vault name -> ScanIndex.  Vaults can't share a ScanIndex
+        workers:  The number of workers to scan each vault with.  See iter_tasks().  With more than 1, each vault
+            reads its files on threads of its own, but they're all parsed in one pool of this many processes
+        vault_resolver:  A VaultResolver for all of the vaults.  One is built if not supplied
+    Returns: A generator of tuples of (vault dict, list of TaskRecords).  A vault that can't be scanned (e.g. it isn't
+        mounted) is reported and skipped, without holding up the others
+    """
+
+    if scan_indexes is None:
+        scan_indexes = {}
+    if vault_resolver is None:
+        vault_resolver = VaultResolver()
+
+    results = queue.Queue(maxsize=len(vaults) * 4)  # Keeps the vaults from getting far ahead of the caller
+    stop = threading.Event()  # Set if the caller stops early, so the threads don't wait on a queue nobody reads
+
+    # Built before any vault thread is started, rather than by each vault while the others are busy
+    process_pool = _make_process_pool(workers=workers) if workers > 1 else None
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _scan_vault(vault: dict):
+        try:
+            files_with_tasks = iter_tasks(parent_directory=vault['path'], file_ext=vault['file_ext'],
+                                          scan_index=scan_indexes.get(vault['name']), workers=workers,
+                                          vault_resolver=vault_resolver,
+                                          ignore_rules=IgnoreRules(patterns=vault['ignore_patterns']),
+                                          process_pool=process_pool)
+            try:
+                for tasks_from_file in files_with_tasks:
+                    if _put((vault, tasks_from_file)) is False:
+                        break
+            finally:
+                files_with_tasks.close()  # Saves the vault's scan index, even if we stopped early
+        except Exception as ex:
+            METRICS.increment('vaults_failed', vault=vault['name'])
+            LOG.error(f"Skipping over vault '{vault['name']}' after an exception of type {type(ex)} while scanning "
+                      f"it:  {ex}")
+        finally:
+            _put(_VAULT_DONE)
+
+    threads = [threading.Thread(target=_scan_vault, args=(vault,), name=f"scan-{vault['name']}", daemon=True)
+               for vault in vaults]
+    for thread in threads:
+        thread.start()
+
+    try:
+        remaining = len(threads)
+        while remaining > 0:
+            item = results.get()
+            if item is _VAULT_DONE:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if process_pool is not None:
+            process_pool.shutdown()
+
+
 if __name__ == '__main__':
-    # Resolve the path to the vault.  If it's not passed in, get it from the config file
+    # Resolve the path to the vault.  If it's not passed in, get the vault(s) from the config file
     args = sys.argv
-    if len(args) >= 2:
-        base_dir = args[1]
-    else:
-        base_dir = _read_base_dir_from_config()
+    vaults = _read_vaults_from_config(base_dir=args[1] if len(args) >= 2 else None)
+
+    metrics_config = _read_metrics_config_from_config()
+    logging_config = _read_logging_config_from_config()
+    configure_logging(verbosity=logging_config['verbosity'] or 'verbose', json_file=logging_config['json_file'])
 
-    todo_items = find_tasks(parent_directory=base_dir)
+    with profile(output_file=metrics_config['profile_file']):
+        todo_items = [task for _, tasks_from_file in iter_tasks_in_vaults(vaults=vaults,
+                                                                          scan_indexes=scan_indexes_for_vaults(vaults),
+                                                                          workers=_read_scan_workers_from_config())
+                      for task in tasks_from_file]
+    log_run_summary(command='find')
 
+    METRICS.export(json_file=metrics_config['json_file'], prometheus_file=metrics_config['prometheus_file'])
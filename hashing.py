@@ -1,8 +1,34 @@
+"""
+Hashes of to-do items, for telling whether two of them are the same task
+
+Hashes are versioned, since they're kept on disk (in the scan index and the Todoist task cache) and compared with
+each other.  Version 1 hashes are the MD5 hex digests this used to make, with no prefix.  Later versions are prefixed
+with their version number, e.g. '2:1f3870be274f6c49'.  See hash_version() and upgrade_task_hash()
+"""
+
 import hashlib
 import re
 
+HASH_VERSION = 2  # The version of the hashes made by default.  Bump it, and add a branch below, to change them
+
+# Deletes every byte but ASCII letters and digits, and lowercases the letters that are left (See bytes.translate)
+_LOWERCASE_TABLE = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ', b'abcdefghijklmnopqrstuvwxyz')
+_NOT_LETTERS_OR_DIGITS = bytes(set(range(256)) - set(b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'))
+
 
-def make_task_hash(task_description: str):
+def _normalize(task_description: str) -> bytes:
+    """
+    Returns: The letters and digits of a task, lowercased, as bytes.  The same as what version 1 hashes, but without a
+        regex:  anything that isn't ASCII is dropped by the encode, and the rest is handled by one bytes.translate()
+    """
+
+    if not task_description.isascii():
+        # str.lower() can turn some characters that aren't ASCII into ones that are (e.g. the Kelvin sign into 'k')
+        task_description = task_description.lower()
+    return task_description.encode('ascii', 'ignore').translate(_LOWERCASE_TABLE, _NOT_LETTERS_OR_DIGITS)
+
+
+def make_task_hash(task_description: str, version: int = HASH_VERSION):
     """
     A helper function that returns a hash of a task after applying some basic transformations
     to the input string to try to handle for leading / trailing spaces, dropping punctuation and the like.
@@ -21,12 +47,70 @@ def make_task_hash(task_description: str):
     Args:
         task_description:  The task to return a hash for.  Just the task part, not the markdown part
         Otherwise you'll get different digests out of this function
+        version:  Which version of hash to make.  See the module docstring
 
-    Returns:
+    Returns: The hash, as a string.  Hashes of different versions never compare equal
 
     """
 
-    task_description_for_hash = re.sub(r'[^a-z0-9]', '', task_description.strip().lower()) # Keep numbers and letters, lowercased
-    task_md5_hash = hashlib.md5(bytes(str(f"{task_description_for_hash}"),encoding='utf-8')).hexdigest() # Then, hash those
+    if version == 1:
+        task_description_for_hash = re.sub(r'[^a-z0-9]', '', task_description.strip().lower()) # Keep numbers and letters, lowercased
+        task_md5_hash = hashlib.md5(bytes(str(f"{task_description_for_hash}"),encoding='utf-8')).hexdigest() # Then, hash those
+        return task_md5_hash
+    elif version == 2:
+        return f"2:{hashlib.blake2b(_normalize(task_description), digest_size=8).hexdigest()}"
+
+    raise ValueError(f"There is no task hash version {version}.  The latest is {HASH_VERSION}")
+
+
+def make_task_hashes(task_descriptions, version: int = HASH_VERSION) -> list:
+    """
+    Hashes many tasks at once.  The same as calling make_task_hash() on each, but quicker
+    Args:
+        task_descriptions:  An iterable of tasks.  See make_task_hash()
+        version:  Which version of hash to make
+    Returns: A list of the hashes, in the same order
+    """
+
+    if version != 2:
+        return [make_task_hash(task_description=task_description, version=version)
+                for task_description in task_descriptions]
+
+    blake2b = hashlib.blake2b
+    table = _LOWERCASE_TABLE
+    delete = _NOT_LETTERS_OR_DIGITS
+
+    hashes = []
+    append = hashes.append
+    for task_description in task_descriptions:
+        if not task_description.isascii():
+            task_description = task_description.lower()
+        append('2:' + blake2b(task_description.encode('ascii', 'ignore').translate(table, delete),
+                              digest_size=8).hexdigest())
+
+    return hashes
+
+
+def hash_version(task_hash: str) -> int:
+    """
+    Returns: The version of a hash made by make_task_hash().  See the module docstring
+    """
+
+    version, separator, _ = task_hash.partition(':')
+    if separator == '':
+        return 1
+    return int(version)
+
+
+def upgrade_task_hash(task_hash: str, task_description: str) -> str:
+    """
+    Brings a stored hash up to the current version, for reading hashes saved by an older version of this module
+    Args:
+        task_hash:  The stored hash
+        task_description:  The task it was made from
+    Returns: task_hash if it's already the current version, otherwise a new hash of task_description
+    """
 
-    return task_md5_hash
+    if task_hash is not None and task_hash.startswith(f"{HASH_VERSION}:"):
+        return task_hash
+    return make_task_hash(task_description=task_description)
@@ -4,8 +4,14 @@ This module contains helper functions
 
 import os
 import json
-import sys
+import re
 import subprocess
+import urllib.parse
+
+from metrics import METRICS
+from run_log import get_logger
+
+LOG = get_logger('helpers')
 
 
 def running_on_wsl():
@@ -23,8 +29,7 @@ def running_on_wsl():
             if 'microsoft' in s and 'wsl' in s:
                 return True
     except Exception as ex:
-        print(f"An exception occurred when trying to detect WSL.  It will be ignored.")
-        print(ex, file=sys.stderr)
+        LOG.warning(f"An exception occurred when trying to detect WSL.  It will be ignored.\n{ex}")
         pass
 
     return False
@@ -74,17 +79,22 @@ def _transform_windows_style_path_to_wsl_equivalent(some_path:str) -> str:
 
 
 
-def _read_obsidian_json():
+def _read_obsidian_json(on_wsl: bool = None):
     """
     Reads the contents of obsidian.json into a dictionary and returns it.
     See:  https://help.obsidian.md/Advanced+topics/Using+Obsidian+URI#Action+%60open%60
+    Args:
+        on_wsl:  Whether we're running under WSL.  Detected if not supplied
     Returns:
     """
 
     # Todo:  Modify this function as applicable to support other Operating systems
 
+    if on_wsl is None:
+        on_wsl = running_on_wsl()
+
     # Resolve path to the Obsidian JSON file
-    if running_on_wsl() is True:
+    if on_wsl is True:
         wsl_windows_home = _resolve_windows_style_home_under_wsl()
         obsidian_json_location = os.path.join(wsl_windows_home, 'AppData', 'Roaming', 'obsidian', 'obsidian.json')
         pass
@@ -112,35 +122,128 @@ def _get_obsidian_vaults():
     return vaults
 
 
+class VaultResolver:
+    """
+    Resolves which Obsidian vault a file belongs to, along with the other per-file bits that go into a task
+    (note name, Obsidian URI, escaped path).
+
+    Build one of these once per run.  obsidian.json is read and the platform is detected just once, when the resolver
+    is constructed.  Vault roots are translated for WSL up front and kept in a dict, so resolving a file walks up its
+    directory path looking for the longest vault root that contains it.  That costs the same regardless of how many
+    vaults are configured.  Results are cached per directory (vault names) and per file (URI, note name, etc.)
+    """
+
+    def __init__(self, vaults: dict = None):
+        """
+        Args:
+            vaults:  The 'vaults' object from obsidian.json.  Read from obsidian.json if not supplied
+        """
+
+        self.on_wsl = running_on_wsl()
+
+        if vaults is None:
+            vaults = _read_obsidian_json(on_wsl=self.on_wsl)['vaults']
+
+        self._vault_names_by_root = {}  # Vault root path (as seen from this OS) -> Vault name
+        for vault in vaults.keys():
+            vault_path = vaults[vault]['path']
+
+            # Transform as needed for WSL
+            if self.on_wsl is True:
+                vault_path = _transform_windows_style_path_to_wsl_equivalent(some_path=vault_path)
+
+            vault_path = vault_path.rstrip('/')
+            self._vault_names_by_root[vault_path] = vault_path.split('/')[-1]
+
+        self._vault_names_by_directory = {}
+        self._file_details = {}
+
+    def resolve_vault_name(self, file_name: str) -> str:
+        """
+        Returns the vault name (e.g. Obsidian Remote Vault) of a given file
+        Args:
+            file_name: The fully qualified path to the note file
+        Returns: A string with just the Vault Name
+        Raises: ValueError if the file isn't in any of the vaults configured in Obsidian
+        """
+
+        directory = os.path.dirname(file_name)
+        vault_name = self._vault_names_by_directory.get(directory)
+        if vault_name is not None:
+            return vault_name
+
+        # Walk up from the file's directory.  The first vault root we hit is the longest one that contains the file
+        candidate = directory
+        while True:
+            vault_name = self._vault_names_by_root.get(candidate)
+            if vault_name is not None:
+                break
+            parent = os.path.dirname(candidate)
+            if parent == candidate:
+                break
+            candidate = parent
+
+        # Raise Exception if we didn't resolve a vault name
+        if vault_name is None:
+            raise ValueError(f"Unable to resolve vault name for file: {file_name}.  Is it in an Obsidian vault?")
+
+        self._vault_names_by_directory[directory] = vault_name
+        return vault_name
+
+    def describe_file(self, file_name: str) -> dict:
+        """
+        Returns the per-file details that are attached to every task found in a file
+        Args:
+            file_name: The fully qualified path to the note file
+        Returns: A dict with the keys note_name, vault_name, obsidian_uri and file_name_escaped
+        """
+
+        details = self._file_details.get(file_name)
+        if details is not None:
+            METRICS.increment('vault_resolver_cache_hits')
+            return details
+
+        with METRICS.timer('resolve_vault'):
+            details = self._describe_file(file_name=file_name)
+        self._file_details[file_name] = details
+        return details
+
+    def _describe_file(self, file_name: str) -> dict:
+        """
+        See describe_file().  Uncached
+        """
+
+        # Get note name from fully qualified path.  It's the short file name with the '.md' extension removed
+        note_name = re.sub(pattern=r'.md$', repl='', string=os.path.basename(file_name))
+
+        # Resolve the Obsidian Vault name.  This allows us to use more of the methods in the Obsidian URI scheme
+        vault_name = self.resolve_vault_name(file_name=file_name)
+
+        # Create Obsidian URI.  See:  https://help.obsidian.md/Advanced+topics/Using+obsidian+URI
+        obsidian_uri = f"obsidian://open?vault={urllib.parse.quote(vault_name,safe='')}" \
+                       f"&file={urllib.parse.quote(note_name,safe='')}"
+
+        details = dict(note_name=note_name,
+                       vault_name=vault_name,
+                       obsidian_uri=obsidian_uri,
+                       file_name_escaped=file_name.replace(' ', '\\ '))
+        return details
+
+
 def resolve_vault_name(file_name:str):
     """
     Returns the vault name (e.g. Obsidian Remote Vault) of a given file
     By comparing it's fully qualified path to the list of vaults configured in Obsidian
 
     Why?  To have more flexibility with the Obsidian URI scheme methods that leverage the Vault name
+
+    Note that this reads obsidian.json on every call.  When resolving many files, build a VaultResolver once instead
     Args:
         file_name: The fully qualified path to the note file=
     Returns: A string with just the Vault Name
     """
 
-    vaults = _get_obsidian_vaults()
-    vault_name = None
-    for vault in vaults.keys():
-        vault_path = vaults[vault]['path']
-
-        # Transform as needed for WSL
-        if running_on_wsl() is True:
-            vault_path = _transform_windows_style_path_to_wsl_equivalent(some_path=vault_path)
-
-        if file_name.startswith(vault_path):
-            vault_name = vault_path.split('/')[-1]
-            break
-
-    # Raise Exception if we didn't resolve a vault name
-    if vault_name is None:
-        raise ValueError(f"Unable to resolve vault name for file: {file_name}.  Is it in an Obsidian vault?")
-
-    return vault_name
+    return VaultResolver().resolve_vault_name(file_name=file_name)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,251 @@
+"""
+Load tests migrate_tasks end to end, against a fake Todoist server (See fake_todoist.py) and a synthetic vault (See
+synthetic_vault.py)
+
+Migrations are run over the vault, pass after pass (as cron would), until every to-do item has been migrated or
+max_passes is reached.  A pass that fails outright (e.g. an injected failure on the request for the existing tasks)
+is retried without counting towards max_passes, up to max_failed_passes of them, so that the verdict doesn't hang on
+where the failures happened to land.  Some share of the vault's to-do items can be created in the fake server up
+front, to check that they're recognised as duplicates.  Once done, the vault and the fake server are checked:
+
+    - Every to-do item is either migrated, and linked to a task in the server with the same content, or was
+      already in the server and is left as it was
+    - No task was created in the server more than once
+    - No other line of any note was changed
+
+Run it with:
+    python load_test.py --notes 2000 --backend sync --latency 0.02 --error-rate 0.02 --rate-limit-rate 0.05
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import todoist
+from fake_todoist import FakeTodoistServer
+from helpers import VaultResolver
+from migrate_tasks import migrate_tasks
+from parsers import parse_tasks_from_strings
+from scan_index import ScanIndex
+from synthetic_vault import add_vault_arguments
+from synthetic_vault import make_synthetic_vault
+from synthetic_vault import vault_arguments
+from todoist_cache import TodoistTaskCache
+
+_MIGRATED_LINE_PATTERN = re.compile(r"^(\s*)- \[→\] ~~(.*)~~ \[\(This Task Migrated to Todoist\)\]\((.*)/([^/]+)\)$")
+
+
+def _read_vault(file_names: list) -> dict:
+    """
+    Returns: Fully qualified path -> list of lines, for every note
+    """
+
+    contents = {}
+    for file_name in file_names:
+        with open(file_name, 'r', encoding='utf-8', newline='') as f:
+            contents[file_name] = f.read().split('\n')
+    return contents
+
+
+def verify_migration(before: dict, after: dict, server: FakeTodoistServer, seeded_contents: set) -> list:
+    """
+    Checks the vault and the fake server after a migration
+    Args:
+        before:  The vault before migrating.  See _read_vault()
+        after:  The vault after migrating
+        server:  The fake server that was migrated into
+        seeded_contents:  The contents of the tasks that were in the server before migrating
+    Returns: A list of problems found.  Empty if all is well
+    """
+
+    problems = []
+    tasks_by_id = {task['id']: task for task in server.tasks}
+
+    # No task should be in todoist twice
+    seen_contents = {}
+    for task in server.tasks:
+        seen_contents[task['content']] = seen_contents.get(task['content'], 0) + 1
+    for content, count in seen_contents.items():
+        if count > 1:
+            problems.append(f"The task '{content}' is in todoist {count} times")
+
+    for file_name, lines_before in before.items():
+        lines_after = after[file_name]
+        if len(lines_after) != len(lines_before):
+            problems.append(f"'{file_name}' went from {len(lines_before)} lines to {len(lines_after)}")
+            continue
+
+        task_line_numbers = {t['line_number']: t for t in parse_tasks_from_strings(input_data=lines_before) or []}
+        for line_number, (line_before, line_after) in enumerate(zip(lines_before, lines_after), start=1):
+            parsed_task = task_line_numbers.get(line_number)
+            if parsed_task is None:
+                if line_after != line_before:
+                    problems.append(f"Line {line_number} of '{file_name}' has no to-do item but was changed")
+                continue
+
+            if parsed_task['task'] in seeded_contents:
+                if line_after != line_before:
+                    problems.append(f"The to-do item on line {line_number} of '{file_name}' was already in todoist, "
+                                    f"but was migrated anyway")
+                continue
+
+            match = _MIGRATED_LINE_PATTERN.match(line_after)
+            if match is None:
+                problems.append(f"The to-do item on line {line_number} of '{file_name}' was not migrated")
+                continue
+
+            task_id = match.group(4).rsplit('-', 1)[-1]  # REST task URLs lead with a slug of the content
+            if match.group(1) != line_before[:len(line_before) - len(line_before.lstrip())]:
+                problems.append(f"The indentation of line {line_number} of '{file_name}' was changed")
+            if match.group(2) != parsed_task['task']:
+                problems.append(f"Line {line_number} of '{file_name}' was migrated with the wrong text")
+            if task_id not in tasks_by_id:
+                problems.append(f"Line {line_number} of '{file_name}' links to task {task_id}, which is not in todoist")
+            elif tasks_by_id[task_id]['content'] != parsed_task['task']:
+                problems.append(f"Line {line_number} of '{file_name}' links to task {task_id}, which is a different "
+                                f"task ('{tasks_by_id[task_id]['content']}')")
+
+    return problems
+
+
+def run_load_test(backend: str = 'rest', max_in_flight: int = 4, workers: int = 1, latency: float = 0.0,
+                  error_rate: float = 0.0, rate_limit_rate: float = 0.0, duplicate_share: float = 0.0,
+                  use_task_cache: bool = False, max_passes: int = 5, max_failed_passes: int = 10, seed: int = 0,
+                  **vault_kwargs) -> dict:
+    """
+    Runs migrations over a synthetic vault against a fake Todoist server, and checks the result
+    Args:
+        backend:  See migrate_tasks()
+        max_in_flight:  See migrate_tasks()
+        workers:  See migrate_tasks()
+        latency:  See FakeTodoistServer
+        error_rate:  See FakeTodoistServer
+        rate_limit_rate:  See FakeTodoistServer
+        duplicate_share:  The share (0 to 1) of the vault's to-do items to create in the server up front
+        use_task_cache:  Whether to use a TodoistTaskCache (and so the sync API) to check for duplicates
+        max_passes:  The most migrations to run before giving up on to-do items that failed to migrate.  Passes that
+            failed outright don't count
+        max_failed_passes:  The most passes that may fail outright (See the module docstring) before giving up
+        seed:  Seed for the fake server's failures and for choosing duplicates
+        vault_kwargs:  Passed along to make_synthetic_vault()
+    Returns: A dict of results.  'problems' lists anything that was wrong with the end result
+    """
+
+    with tempfile.TemporaryDirectory(prefix='markdown-todoist-load-test-') as work_directory:
+        vault_directory = os.path.join(work_directory, 'vault')
+        file_names = make_synthetic_vault(directory=vault_directory, seed=seed, **vault_kwargs)
+        before = _read_vault(file_names=file_names)
+
+        all_contents = sorted({t['task'] for lines in before.values()
+                               for t in parse_tasks_from_strings(input_data=lines) or []})
+        seeded_contents = set(random.Random(seed).sample(all_contents, k=round(len(all_contents) * duplicate_share)))
+
+        with FakeTodoistServer(latency=latency, error_rate=error_rate, rate_limit_rate=rate_limit_rate,
+                               seed=seed) as server:
+            for content in sorted(seeded_contents):
+                server.add_task(content=content)
+
+            scan_index = ScanIndex(index_file_name=os.path.join(work_directory, 'scan_index.json'))
+            todoist_task_cache = None
+            if use_task_cache is True:
+                todoist_task_cache = TodoistTaskCache(cache_file_name=os.path.join(work_directory, 'tasks.json'))
+            vault_resolver = VaultResolver(vaults=dict(load_test=dict(path=vault_directory)))
+
+            passes = []
+            started = time.perf_counter()
+            with todoist.TodoistClient(todoist_api_token='load-test', api_base_url=server.url,
+                                       max_connections=max_in_flight) as todoist_client:
+                while sum(1 for p in passes if p['error'] is None) < max_passes and \
+                        sum(1 for p in passes if p['error'] is not None) <= max_failed_passes:
+                    tasks_before_pass = len(server.tasks)
+                    pass_started = time.perf_counter()
+                    error = None
+                    try:
+                        migrate_tasks(parent_directory=vault_directory, scan_index=scan_index, workers=workers,
+                                      max_in_flight=max_in_flight, backend=backend, todoist_client=todoist_client,
+                                      todoist_task_cache=todoist_task_cache, settle_seconds=0,
+                                      vault_resolver=vault_resolver)
+                    except Exception as ex:
+                        # A real cron job would just try again next time.  So do we
+                        error = f"{type(ex).__name__}: {ex}"
+                    passes.append(dict(seconds=time.perf_counter() - pass_started,
+                                       tasks_created=len(server.tasks) - tasks_before_pass, error=error))
+
+                    if len(server.tasks) >= len(all_contents) and error is None:
+                        break
+            elapsed = time.perf_counter() - started
+
+            after = _read_vault(file_names=file_names)
+            problems = verify_migration(before=before, after=after, server=server, seeded_contents=seeded_contents)
+
+            migrated_count = len(server.tasks) - len(seeded_contents)
+            api_calls = sum(server.request_counts.values())
+            files_rewritten = sum(1 for file_name in file_names if after[file_name] != before[file_name])
+
+            return dict(files=len(file_names), todo_items=len(all_contents), already_in_todoist=len(seeded_contents),
+                        tasks_migrated=migrated_count, files_rewritten=files_rewritten, seconds=elapsed,
+                        tasks_per_second=migrated_count / elapsed if elapsed > 0 else None,
+                        api_calls=api_calls, api_calls_by_endpoint=dict(server.request_counts),
+                        api_calls_per_migrated_task=api_calls / migrated_count if migrated_count else None,
+                        injected_failures={str(k): v for k, v in server.injected_failures.items()},
+                        passes=passes, failed_passes=sum(1 for p in passes if p['error'] is not None),
+                        problems=problems)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_vault_arguments(arg_parser=arg_parser)
+    arg_parser.add_argument('--backend', choices=todoist.BACKENDS, default='rest')
+    arg_parser.add_argument('--max-in-flight', type=int, default=4)
+    arg_parser.add_argument('--workers', type=int, default=1)
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='Seconds of delay to add to each request')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests to fail with a 500')
+    arg_parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests to fail with a 429')
+    arg_parser.add_argument('--duplicate-share', type=float, default=0.0,
+                            help='Share of to-do items to create in the fake server up front')
+    arg_parser.add_argument('--task-cache', action='store_true', help='Check for duplicates with a TodoistTaskCache')
+    arg_parser.add_argument('--max-passes', type=int, default=5)
+    arg_parser.add_argument('--max-failed-passes', type=int, default=10,
+                            help="Passes that fail outright, which don't count towards --max-passes")
+    arg_parser.add_argument('--json', help='Write the results to this file')
+    args = arg_parser.parse_args()
+
+    vault_kwargs = vault_arguments(args)
+    seed = vault_kwargs.pop('seed')
+
+    # migrate_tasks talks a lot, and complains about every failure injected.  Only the results are of interest here
+    stdout, stderr = sys.stdout, sys.stderr
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = sys.stderr = devnull
+        try:
+            results = run_load_test(backend=args.backend, max_in_flight=args.max_in_flight, workers=args.workers,
+                                    latency=args.latency, error_rate=args.error_rate,
+                                    rate_limit_rate=args.rate_limit_rate, duplicate_share=args.duplicate_share,
+                                    use_task_cache=args.task_cache, max_passes=args.max_passes,
+                                    max_failed_passes=args.max_failed_passes, seed=seed, **vault_kwargs)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    print(f"{results['files']} notes, {results['todo_items']} to-do items ({results['already_in_todoist']} already "
+          f"in todoist)")
+    print(f"Migrated {results['tasks_migrated']} tasks in {results['seconds']:.2f}s over {len(results['passes'])} "
+          f"passes, {results['failed_passes']} of which failed outright ({results['tasks_per_second'] or 0:.1f} tasks "
+          f"per second)")
+    print(f"API calls:  {results['api_calls']} ({results['api_calls_per_migrated_task'] or 0:.2f} per migrated "
+          f"task).  Injected failures:  {results['injected_failures']}")
+    print(f"Files rewritten:  {results['files_rewritten']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if len(results['problems']) > 0:
+        print(f"{len(results['problems'])} problems found:", file=sys.stderr)
+        for problem in results['problems'][:50]:
+            print(f"\t{problem}", file=sys.stderr)
+        sys.exit(1)
+    print("No problems found")
@@ -0,0 +1,144 @@
+"""
+The one entry point for everything markdown_todoist does.  Run it from the directory the config folder is in:
+
+    python -m markdown_todoist migrate                # Migrate the to-do items in every vault in config/config.json
+    python -m markdown_todoist migrate ~/Obsidian     # Or in just the one directory
+    python -m markdown_todoist find                   # Just list the to-do items.  See find_tasks.py
+    python -m markdown_todoist watch --vault work     # Migrate as notes change.  See watch.py
+
+Modules are only imported once they're needed.  In particular, 'migrate' first checks each vault against the stamp
+recorded at the end of the last run that left it with nothing to do (See run_stamp.py).  If none of the vaults have
+changed it exits straight away, without importing anything that parses markdown or talks to Todoist
+"""
+
+import argparse
+import runpy
+import sys
+import time
+
+from config import _read_logging_config_from_config
+from config import _read_metrics_config_from_config
+from config import _read_vaults_from_config
+from metrics import METRICS
+from metrics import profile
+from run_log import SUMMARY
+from run_log import add_verbosity_arguments
+from run_log import configure_logging
+from run_log import get_logger
+from run_log import log_run_summary
+from run_stamp import RunStamps
+from run_stamp import stamp_vault
+
+# The commands that are handed straight to the __main__ block of another module, along with their arguments
+_PASS_THROUGH_COMMANDS = {'find': 'find_tasks', 'watch': 'watch'}
+
+LOG = get_logger('markdown_todoist')
+
+
+def migrate(base_dir: str = None, force: bool = False, max_stamp_age_seconds: float = 3600) -> list:
+    """
+    Migrates the to-do items of each vault that has changed since the last run that left it with nothing to do.
+    See migrate_tasks.migrate_vaults()
+    Args:
+        base_dir:  Just migrate the vault in this directory, rather than those in config/config.json
+        force:  Migrate every vault, whether or not it has changed
+        max_stamp_age_seconds:  Migrate a vault anyway if it's been this long since its stamp was recorded
+    Returns: The names of the vaults that were migrated
+    """
+
+    vaults = _read_vaults_from_config(base_dir=base_dir)
+    run_stamps = RunStamps()
+
+    started_at = time.time()
+    changed_vaults = []
+    for vault in vaults:
+        stamp, _ = stamp_vault(vault=vault)
+        if force is True or not run_stamps.is_unchanged(vault_name=vault['name'], stamp=stamp,
+                                                         max_age_seconds=max_stamp_age_seconds):
+            changed_vaults.append(vault)
+
+    METRICS.increment('vaults_unchanged', len(vaults) - len(changed_vaults))
+    if len(changed_vaults) == 0:
+        LOG.log(SUMMARY, f"Nothing has changed in {', '.join(vault['name'] for vault in vaults)} since the last run.  "
+                         f"There is nothing to do", extra=dict(fields=dict(event='run_summary', command='migrate',
+                                                                           vaults_unchanged=len(vaults))))
+        return []
+
+    # Only now is there any call for the modules that parse markdown and talk to todoist
+    from config import _read_scan_workers_from_config
+    from config import _read_todoist_backend_from_config
+    from config import _read_todoist_max_in_flight_from_config
+    from migrate_tasks import migrate_vaults
+    from migration_ledger import MigrationLedger
+    from scan_index import ScanIndex
+    from scan_index import index_file_name_for_vault
+    from todoist_cache import TodoistTaskCache
+
+    # Should the run fail part way through, the next one has to be a full one
+    for vault in changed_vaults:
+        run_stamps.forget(vault_name=vault['name'])
+    run_stamps.save()
+
+    scan_indexes = {vault['name']: ScanIndex(index_file_name=index_file_name_for_vault(vault_name=vault['name'],
+                                                                                       vault_count=len(vaults)))
+                    for vault in changed_vaults}
+    migrate_vaults(vaults=changed_vaults, scan_indexes=scan_indexes, workers=_read_scan_workers_from_config(),
+                   max_in_flight=_read_todoist_max_in_flight_from_config(),
+                   backend=_read_todoist_backend_from_config(), todoist_task_cache=TodoistTaskCache(),
+                   migration_ledger=MigrationLedger())
+
+    # Only a vault the run left with nothing to do gets a stamp.  Notes that were still settling, or that were
+    # rewritten by the run itself, are newer than the start of the run
+    for vault in changed_vaults:
+        stamp, newest_modified_time = stamp_vault(vault=vault)
+        if METRICS.total('tasks_failed') > 0 or METRICS.total('vaults_failed', vault=vault['name']) > 0:
+            continue
+        if newest_modified_time is not None and (newest_modified_time >= started_at or
+                                                 newest_modified_time > time.time() - vault['settle_seconds']):
+            continue
+        run_stamps.record(vault_name=vault['name'], stamp=stamp)
+    run_stamps.save()
+
+    return [vault['name'] for vault in changed_vaults]
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(prog='python -m markdown_todoist', description=__doc__,
+                                         formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subparsers.add_parser('migrate', help='Migrate to-do items into Todoist')
+    migrate_parser.add_argument('base_dir', nargs='?',
+                                help='The directory to migrate.  The vaults in config/config.json if omitted')
+    migrate_parser.add_argument('--force', action='store_true', help='Migrate every vault, even if none has changed')
+    migrate_parser.add_argument('--max-stamp-age', type=float, default=3600,
+                                help='Migrate a vault anyway if this many seconds have passed since the last full run '
+                                     'over it')
+    add_verbosity_arguments(arg_parser=migrate_parser)
+
+    # Anything after these is passed along untouched, including --help
+    subparsers.add_parser('find', help='List the to-do items in the vaults.  See find_tasks.py', add_help=False)
+    subparsers.add_parser('watch', help='Migrate to-do items as notes change.  See watch.py', add_help=False)
+
+    args, remaining_args = arg_parser.parse_known_args()
+
+    if args.command in _PASS_THROUGH_COMMANDS:
+        module_name = _PASS_THROUGH_COMMANDS[args.command]
+        sys.argv = [f"{module_name}.py"] + remaining_args
+        runpy.run_module(module_name, run_name='__main__', alter_sys=True)
+        sys.exit(0)
+
+    if len(remaining_args) > 0:
+        arg_parser.error(f"unrecognized arguments: {' '.join(remaining_args)}")
+
+    metrics_config = _read_metrics_config_from_config()
+    logging_config = _read_logging_config_from_config()
+    configure_logging(verbosity=args.verbosity or logging_config['verbosity'] or 'quiet',
+                      json_file=logging_config['json_file'])
+
+    with profile(output_file=metrics_config['profile_file']):
+        migrated_vaults = migrate(base_dir=args.base_dir, force=args.force, max_stamp_age_seconds=args.max_stamp_age)
+    if len(migrated_vaults) > 0:
+        log_run_summary(command='migrate')
+
+    METRICS.export(json_file=metrics_config['json_file'], prometheus_file=metrics_config['prometheus_file'])
@@ -0,0 +1,265 @@
+"""
+Counters and timers for finding out where the time goes during a run
+
+Every module records into the one process-wide registry, METRICS:
+
+    METRICS.increment('files_walked')
+    with METRICS.timer('frontmatter'):
+        ...
+
+Timers keep a count, a total, a maximum and a histogram of how long each timed thing took.  Counters and timers can
+carry labels (e.g. METRICS.increment('api_calls', endpoint='/api/v1/tasks')).  At the end of a run the lot can be
+written out as a JSON summary and/or as a Prometheus textfile (for node_exporter's textfile collector).  See
+export().  For a closer look, profile() runs a block of code under cProfile.
+"""
+
+import bisect
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+from run_log import get_logger
+
+# Upper bounds (in seconds) of the histogram buckets kept for every timer.  Anything slower goes in a final +Inf bucket
+TIMER_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_PREFIX = 'markdown_todoist'
+
+LOG = get_logger('metrics')
+
+
+def _label_string(labels: tuple, extra: str = None) -> str:
+    """
+    Returns: Labels in Prometheus' format, e.g. '{endpoint="/api/v1/tasks"}', or '' if there are none
+    """
+
+    parts = [f'{k}="{str(v)}"' for k, v in labels]
+    if extra is not None:
+        parts.append(extra)
+    if len(parts) == 0:
+        return ''
+    return '{' + ','.join(parts) + '}'
+
+
+class Metrics:
+    """
+    A thread safe registry of counters and timers.  Use the process-wide METRICS rather than making more of these
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+        # A process forked while another thread held the lock would otherwise hang the first time it recorded anything
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reinit_lock)
+
+    def _reinit_lock(self):
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        Forgets everything recorded so far
+        """
+
+        with self._lock:
+            self._counters = {}  # (name, labels) -> value
+            self._timers = {}  # (name, labels) -> [count, total seconds, max seconds, bucket counts]
+            self.started_at = time.time()
+
+    def increment(self, name: str, amount: int = 1, **labels):
+        """
+        Adds to a counter
+        Args:
+            name:  The name of the counter, e.g. 'files_walked'
+            amount:  How much to add
+            labels:  Optional labels, to keep separate counts of the same thing
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Records how long something took.  See timer()
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(TIMER_BUCKETS, seconds)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = [0, 0.0, 0.0, [0] * (len(TIMER_BUCKETS) + 1)]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            timer[3][bucket] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Times the enclosed block of code, whether or not it raises
+        """
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def total(self, name: str, **labels) -> int:
+        """
+        Returns: The sum of a counter over every set of labels it was incremented with, or just over those that
+            include the given labels
+        """
+
+        with self._lock:
+            return sum(value for (counter_name, counter_labels), value in self._counters.items()
+                       if counter_name == name and set(labels.items()) <= set(counter_labels))
+
+    def snapshot(self) -> dict:
+        """
+        Returns: A copy of everything recorded so far, which can be pickled (e.g. back from a worker process) and
+            merged into another registry.  See merge()
+        """
+
+        with self._lock:
+            return dict(counters=dict(self._counters),
+                        timers={key: [t[0], t[1], t[2], list(t[3])] for key, t in self._timers.items()})
+
+    def merge(self, snapshot: dict):
+        """
+        Adds the counts and timings of a snapshot (See snapshot()) to this registry
+        """
+
+        with self._lock:
+            for key, value in snapshot['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (count, total, maximum, buckets) in snapshot['timers'].items():
+                timer = self._timers.get(key)
+                if timer is None:
+                    timer = self._timers[key] = [0, 0.0, 0.0, [0] * (len(TIMER_BUCKETS) + 1)]
+                timer[0] += count
+                timer[1] += total
+                timer[2] = max(timer[2], maximum)
+                timer[3] = [a + b for a, b in zip(timer[3], buckets)]
+
+    def to_dict(self) -> dict:
+        """
+        Returns: A summary of everything recorded, ready to be written out as JSON.  Counters and timers with labels
+            are nested under a key made of their labels, e.g. 'endpoint=/api/v1/tasks,status=200'
+        """
+
+        snapshot = self.snapshot()
+
+        def _place(container: dict, name: str, labels: tuple, value):
+            if len(labels) == 0:
+                container[name] = value
+            else:
+                container.setdefault(name, {})[','.join(f"{k}={v}" for k, v in labels)] = value
+
+        counters = {}
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            _place(counters, name, labels, value)
+
+        timers = {}
+        for (name, labels), (count, total, maximum, buckets) in sorted(snapshot['timers'].items()):
+            bucket_bounds = [str(b) for b in TIMER_BUCKETS] + ['+Inf']
+            _place(timers, name, labels, dict(count=count, total_seconds=total, max_seconds=maximum,
+                                              mean_seconds=total / count if count else None,
+                                              buckets=dict(zip(bucket_bounds, buckets))))
+
+        return dict(started_at=self.started_at, duration_seconds=time.time() - self.started_at, counters=counters,
+                    timers=timers)
+
+    def to_prometheus(self, prefix: str = PROMETHEUS_PREFIX) -> str:
+        """
+        Returns: Everything recorded, in Prometheus' text exposition format.  Counters become '<prefix>_<name>_total'
+            and timers become histograms named '<prefix>_<name>_seconds'
+        """
+
+        snapshot = self.snapshot()
+        lines = []
+
+        counters_by_name = {}
+        for (name, labels), value in snapshot['counters'].items():
+            counters_by_name.setdefault(name, []).append((labels, value))
+        for name in sorted(counters_by_name):
+            metric_name = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric_name} counter")
+            for labels, value in sorted(counters_by_name[name]):
+                lines.append(f"{metric_name}{_label_string(labels)} {value}")
+
+        timers_by_name = {}
+        for (name, labels), timer in snapshot['timers'].items():
+            timers_by_name.setdefault(name, []).append((labels, timer))
+        for name in sorted(timers_by_name):
+            metric_name = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric_name} histogram")
+            for labels, (count, total, maximum, buckets) in sorted(timers_by_name[name]):
+                cumulative = 0
+                for bound, bucket_count in zip(list(TIMER_BUCKETS) + ['+Inf'], buckets):
+                    cumulative += bucket_count
+                    bucket_labels = _label_string(labels, extra=f'le="{bound}"')
+                    lines.append(f"{metric_name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{metric_name}_sum{_label_string(labels)} {total}")
+                lines.append(f"{metric_name}_count{_label_string(labels)} {count}")
+
+        lines.append(f"# TYPE {prefix}_last_run_timestamp_seconds gauge")
+        lines.append(f"{prefix}_last_run_timestamp_seconds {time.time()}")
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, json_file: str = None, prometheus_file: str = None):
+        """
+        Writes everything recorded out to either or both kinds of file.  Each file is written to a temporary file
+        first then renamed into place, so that whatever is reading it (e.g. node_exporter) never sees half a file
+        Args:
+            json_file:  Where to write a JSON summary.  See to_dict()
+            prometheus_file:  Where to write a Prometheus textfile.  See to_prometheus()
+        """
+
+        for file_name, render in ((json_file, lambda: json.dumps(self.to_dict(), indent=2)),
+                                  (prometheus_file, self.to_prometheus)):
+            if not file_name:
+                continue
+
+            file_dir = os.path.dirname(file_name)
+            if file_dir:
+                os.makedirs(file_dir, exist_ok=True)
+            tmp_file_name = f"{file_name}.tmp"
+            with open(tmp_file_name, 'w') as f:
+                f.write(render())
+            os.replace(tmp_file_name, file_name)
+
+
+METRICS = Metrics()
+
+
+@contextlib.contextmanager
+def profile(output_file: str = None):
+    """
+    Runs the enclosed block of code under cProfile, and writes the stats out to output_file.  Does nothing if
+    output_file is not set, so callers can leave this in place and switch it on from config.
+    Read the stats with:  python -m pstats <output_file>
+    """
+
+    if not output_file:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        profiler.dump_stats(output_file)
+        LOG.info(f"Profile written to '{output_file}'.  Read it with:  python -m pstats {output_file}")
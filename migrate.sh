@@ -1,7 +1,7 @@
 #!/bin/bash
 
 ###
-### Wrapper script around migrate_tasks.py.  Useful for automation
+### Wrapper script around markdown_todoist.py (migrate).  Useful for automation
 ### Here, we're relying on pyenv (and thus .python-version) to point to the right python with installed requrements
 ### If it's not working reliably, try running make_pyenv_venv.sh to re-create the virtual environment
 ###
@@ -82,10 +82,13 @@ echo "pidFileName = ${pidFileName}"
 
 	echo "pipToUse = ${pipToUse}"
 
-## Best effor to ensure that the right packages are installed
-	${pipToUse} install -U -r ${thisDir}/requirements.txt > /dev/null 2>&1 
-
-## Call the Find Tasks script.
-	program="${thisDir}/migrate_tasks.py"
+## Best effor to ensure that the right packages are installed.  Only when requirements.txt has changed since the last
+## install, since pip alone takes longer than a run that finds nothing to do
+	installedMarker="${thisDir}/.requirements.installed"
+	if [[ ! -f "${installedMarker}" ]] || [[ "${thisDir}/requirements.txt" -nt "${installedMarker}" ]]
+	then
+		${pipToUse} install -U -r ${thisDir}/requirements.txt > /dev/null 2>&1 && touch "${installedMarker}"
+	fi
 
-	${pythonToUse} ${program}
+## Call the entry point.  See markdown_todoist.py
+	cd "${thisDir}" && ${pythonToUse} -m markdown_todoist migrate
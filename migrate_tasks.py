@@ -10,182 +10,901 @@ avoid duplications, forget about tracking file names and locations, and
 take advantage of the very nature of sync.
 """
 
+import logging
+import mmap
 import os.path
+import queue
 import sys
 import shutil
+import tempfile
+import threading
+import time
+import types
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 import todoist
-from find_tasks import find_tasks
-from config import _read_base_dir_from_config
+from find_tasks import iter_tasks
+from find_tasks import iter_tasks_in_vaults
+from scan_index import ScanIndex
+from scan_index import scan_indexes_for_vaults
+from helpers import VaultResolver
+from config import _read_scan_workers_from_config
+from config import _read_todoist_max_in_flight_from_config
+from config import _read_todoist_backend_from_config
+from config import _read_metrics_config_from_config
+from config import _read_logging_config_from_config
+from config import _read_vaults_from_config
 import re
 import datetime
 from datetime import timezone
-from hashing import make_task_hash
-
-
-def migrate_tasks(parent_directory:str = '~/Obsidian'):
+from dedupe_index import DedupeIndex
+from migration_ledger import MigrationLedger
+from migration_ledger import PLANNED
+from todoist_cache import TodoistTaskCache
+from vault_walk import IgnoreRules
+from metrics import METRICS
+from metrics import profile
+from run_log import configure_logging
+from run_log import get_logger
+from run_log import log_run_summary
+
+LOG = get_logger('migrate_tasks')
+
+
+def migrate_tasks(parent_directory:str = '~/Obsidian', scan_index: ScanIndex = None, workers: int = 1,
+                  max_in_flight: int = 4, api_base_url: str = None, backend: str = 'rest',
+                  todoist_client: todoist.TodoistClient = None, todoist_task_cache: TodoistTaskCache = None,
+                  settle_seconds: float = 60, file_names: list = None, vault_resolver: VaultResolver = None,
+                  ignore_rules: IgnoreRules = None, file_ext='.md', migration_ledger: MigrationLedger = None,
+                  written_files: dict = None):
 	"""
 	Migrates open tasks into todoist by creating a task in todoist then modifying the markdown
 	File / line from where the task was encountered
+	Args:
+		parent_directory:  The directory to seek markdown files within
+		scan_index:  An optional ScanIndex, passed along to iter_tasks so unchanged files aren't re-read
+		workers:  The number of workers iter_tasks should scan files with
+		max_in_flight:  The most requests to create tasks in todoist to have outstanding at any one time
+		api_base_url:  Optionally, a server to talk to instead of the real Todoist API (See fake_todoist.py)
+		backend:  How to create tasks in todoist.  'rest' for one request per task (max_in_flight at a time),
+			or 'sync' to send them in batches through the sync API
+		todoist_client:  A TodoistClient to make every request in the run with.  If not supplied, one is built
+			(only once there is something to migrate) and closed when the run is done
+		todoist_task_cache:  An optional TodoistTaskCache.  If supplied, duplicates are checked against it after an
+			incremental sync, rather than after downloading every open task in todoist
+		settle_seconds:  Files modified more recently than this are left alone for now, since the user might still be
+			typing.  0 disables the check (e.g. when the caller already knows the file has settled)
+		file_names:  Optionally, only migrate tasks from these files rather than walking parent_directory
+		vault_resolver:  An optional VaultResolver, passed along to iter_tasks
+		ignore_rules:  An optional IgnoreRules (See vault_walk.py), passed along to iter_tasks
+		file_ext:  The extension (or list of extensions) of the markdown files, passed along to iter_tasks
+		migration_ledger:  An optional MigrationLedger.  If supplied, each step of each task's migration is recorded in
+			it, and tasks an earlier run was stopped part way through migrating are picked up where they were left
+		written_files:  An optional dict.  If supplied, each file the run rewrites is added to it, as file name ->
+			(st_mtime_ns, st_size) of the file as written.  Lets a watcher tell its own writes from the user's
 	"""
 
 	# TODO:  Read the parent directory path out of a config file
 
-	tasks_from_markdown_files = find_tasks(parent_directory=parent_directory)
+	if backend not in todoist.BACKENDS:
+		raise ValueError(f"The backend argument must be one of {todoist.BACKENDS}.  Got '{backend}'")
+
+	files_with_tasks = iter_tasks(parent_directory=parent_directory, file_ext=file_ext, scan_index=scan_index,
+	                              workers=workers, vault_resolver=vault_resolver, file_names=file_names,
+	                              ignore_rules=ignore_rules)
+
+	with METRICS.timer('migrate'):
+		found_tasks = _migrate_found_tasks(files_with_tasks=files_with_tasks, todoist_client=todoist_client,
+		                                   api_base_url=api_base_url, max_in_flight=max_in_flight, backend=backend,
+		                                   todoist_task_cache=todoist_task_cache, settle_seconds=settle_seconds,
+		                                   migration_ledger=migration_ledger, written_files=written_files)
 
 	# Exit if there's nothing to do
-	if not tasks_from_markdown_files:
+	if found_tasks is False:
 		# Nothing to do
-		print(f"There are no tasks to migrate.  Call to find_tasks results in: {str(tasks_from_markdown_files)}")
-		return
+		LOG.info("There are no tasks to migrate.")
 
-	# Get the current list of tasks from the todoist API  This will help ensure we don't duplicate tasks
-	todoist_api_token = todoist.get_api_token()
-	todoist_tasks = todoist.get_todoist_tasks(todoist_api_token=todoist_api_token)
 
-	recently_modified_files = [] #Tracks files that were modified by current invocation.  To not-skip due to modify time.
+def migrate_vaults(vaults: list, scan_indexes: dict = None, workers: int = 1, max_in_flight: int = 4,
+                   api_base_url: str = None, backend: str = 'rest', todoist_client: todoist.TodoistClient = None,
+                   todoist_task_cache: TodoistTaskCache = None, vault_resolver: VaultResolver = None,
+                   migration_ledger: MigrationLedger = None):
+	"""
+	Migrates open tasks from several vaults in one run.  The vaults are walked and scanned at the same time (See
+	find_tasks.iter_tasks_in_vaults()), and all of their tasks go through the one pipeline.  So the vaults share one
+	todoist client and one dedupe index, which means open tasks are fetched from todoist once per run rather than
+	once per vault, and a to-do item that's in two vaults is only migrated once
+	Args:
+		vaults:  A list of dicts, one per vault.  See config._read_vaults_from_config().  Each vault's settle_seconds
+			applies to its own files
+		scan_indexes:  Optionally, a dict of vault name -> ScanIndex.  See scan_index.scan_indexes_for_vaults()
+		workers:  The number of workers to scan each vault with
+		max_in_flight:  See migrate_tasks()
+		api_base_url:  See migrate_tasks()
+		backend:  See migrate_tasks()
+		todoist_client:  See migrate_tasks()
+		todoist_task_cache:  See migrate_tasks()
+		vault_resolver:  An optional VaultResolver for all of the vaults
+		migration_ledger:  See migrate_tasks()
+	"""
 
+	if backend not in todoist.BACKENDS:
+		raise ValueError(f"The backend argument must be one of {todoist.BACKENDS}.  Got '{backend}'")
 
-	for task_dict in tasks_from_markdown_files:
+	found_tasks = False
 
-		"""
-		Check the last modified time of the file.  If it's less than X seconds ago, don't bother with it
-		The idea here is to not ship incomplete to-do items that the user might still by typing out into to
-		Todoist prematurely.  For example, if this program was scheduled on a cron job
-		"""
+	def _settled_files():
+		nonlocal found_tasks
+		for vault, file_tasks in iter_tasks_in_vaults(vaults=vaults, scan_indexes=scan_indexes, workers=workers,
+		                                              vault_resolver=vault_resolver):
+			found_tasks = True
+			if _file_has_settled(markdown_file_name=file_tasks[0]['file_name'],
+			                     settle_seconds=vault['settle_seconds']) is True:
+				yield file_tasks
 
-		markdown_file_name = task_dict['file_name']
+	with METRICS.timer('migrate'):
+		_migrate_found_tasks(files_with_tasks=_settled_files(), todoist_client=todoist_client,
+		                     api_base_url=api_base_url, max_in_flight=max_in_flight, backend=backend,
+		                     todoist_task_cache=todoist_task_cache, settle_seconds=0,
+		                     migration_ledger=migration_ledger)
 
-		# take note of the current timestamp in UTC
-		right_now = datetime.datetime.now(timezone.utc)
-		right_now_utc_timestamp = right_now.timestamp()
+	# Exit if there's nothing to do
+	if found_tasks is False:
+		LOG.info("There are no tasks to migrate.")
 
-		# take note of the timestamp on the file
-		file_last_modified_timestamp = os.path.getmtime(markdown_file_name)
 
-		time_diff_sec = right_now_utc_timestamp - file_last_modified_timestamp
-		if file_last_modified_timestamp > right_now_utc_timestamp or time_diff_sec < 60:
-			# TODO:  Read this seconds threshold out of a config file and allow the user bypass this behavior entirely
-			# File is too new.  Skip it for now
-			if markdown_file_name not in recently_modified_files:
-				# We might have just modified a file due to another to-do item, changing its TS.
-				# It's ok to modify again in such cases.
+# How many tasks are sent to todoist at a time, and how many such batches may be waiting on todoist at once.  Between
+# them, these bound how much of the vault is held in memory while files are still being walked
+PIPELINE_BATCH_SIZE = todoist.SYNC_COMMANDS_PER_REQUEST
+PIPELINE_MAX_BATCHES_IN_FLIGHT = 2
+
+# A batch is sent once its first file has waited this long, however few tasks it has.  Until a file's new lines are
+# written, edits made to it mean reading it again, and may leave some of its tasks to be linked next time (See
+# _carry_over_edits()).  So files shouldn't wait on a long walk of the rest of the vault
+PIPELINE_BATCH_MAX_WAIT_SECONDS = 5
+PIPELINE_TICK_SECONDS = 1  # How often the pipeline checks on its batches while the walk has nothing for it
+
+_WALK_DONE = object()  # Put on the queue once the walk is over.  See _iter_with_ticks()
+
+
+def _iter_with_ticks(iterable, tick_seconds: float):
+	"""
+	Yields the items of iterable, which is consumed on a thread of its own, and None whenever tick_seconds pass without
+	one.  That way the caller gets a chance to do other things (e.g. send a batch that's waited long enough) even while
+	the next item is slow in coming
+	Raises: Whatever iterating over iterable raised
+	"""
+
+	items = queue.Queue(maxsize=1)  # Keeps the walk from getting ahead of the caller
+	stop = threading.Event()  # Set if the caller stops early, so the thread doesn't wait on a queue nobody reads
+
+	def _put(item) -> bool:
+		while not stop.is_set():
+			try:
+				items.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def _walk():
+		try:
+			for item in iterable:
+				if _put((item, None)) is False:
+					break
+		except BaseException as ex:
+			_put((None, ex))
+		finally:
+			if hasattr(iterable, 'close'):
+				iterable.close()  # e.g. saves the scan index of a generator stopped early
+			_put((_WALK_DONE, None))
+
+	thread = threading.Thread(target=_walk, name='migrate-walk', daemon=True)
+	thread.start()
+	try:
+		while True:
+			try:
+				item, ex = items.get(timeout=tick_seconds)
+			except queue.Empty:
+				yield None
 				continue
+			if ex is not None:
+				raise ex
+			if item is _WALK_DONE:
+				return
+			yield item
+	finally:
+		stop.set()
+		thread.join()
+
+
+def _migrate_found_tasks(files_with_tasks, todoist_client: todoist.TodoistClient = None, api_base_url: str = None,
+                         max_in_flight: int = 4, backend: str = 'rest', todoist_task_cache: TodoistTaskCache = None,
+                         settle_seconds: float = 60, migration_ledger: MigrationLedger = None,
+                         written_files: dict = None) -> bool:
+	"""
+	Migrates the tasks found by iter_tasks.  See migrate_tasks()
+
+	This is a pipeline.  While one batch of tasks is being created in todoist (on a background thread), the walk
+	carries on finding the next batch, and the files of batches that are done are rewritten.  A batch is sent once it
+	has PIPELINE_BATCH_SIZE tasks, or once its first file has waited PIPELINE_BATCH_MAX_WAIT_SECONDS, whichever comes
+	first, even if the walk is slow to find the next file
+	Args:
+		files_with_tasks:  An iterable of lists of tasks, one list per file, as yielded by iter_tasks()
+		todoist_client:  If None, a client is opened once the first task is found, and closed when we're done
+		migration_ledger:  Compacted once the run is over
+		written_files:  See migrate_tasks()
+	Returns: True if any tasks were found (whether or not they needed migrating), otherwise False
+	"""
+
+	owns_client = todoist_client is None
+	dedupe_index = None
+	found_tasks = False
+
+	batch = []  # File migrations (see _plan_file_migration()) waiting to be sent to todoist
+	batch_task_count = 0
+	batch_started_at = None  # When the first file in the batch was planned
+	in_flight = collections.deque()  # (future, file migrations) for batches sent to todoist, oldest first
+
+	try:
+		with ThreadPoolExecutor(max_workers=1, thread_name_prefix='todoist-sender') as sender:
+
+			def _send_pending_batch():
+				nonlocal batch, batch_task_count
+				in_flight.append(_send_batch(sender=sender, file_migrations=batch, todoist_client=todoist_client,
+				                             max_in_flight=max_in_flight, backend=backend,
+				                             migration_ledger=migration_ledger))
+				batch = []
+				batch_task_count = 0
+
+			try:
+				for file_tasks in _iter_with_ticks(iterable=files_with_tasks, tick_seconds=PIPELINE_TICK_SECONDS):
+					if file_tasks is not None:
+						found_tasks = True
+						markdown_file_name = file_tasks[0]['file_name']
+
+						if _file_has_settled(markdown_file_name=markdown_file_name, settle_seconds=settle_seconds) is False:
+							# File is too new.  Skip it for now
+							continue
+
+						# Only talk to todoist once there's actually something to migrate.  Tasks an earlier run
+						# already created in todoist don't count
+						if dedupe_index is None and not _all_created_by_earlier_run(file_tasks=file_tasks,
+						                                                            migration_ledger=migration_ledger):
+							if todoist_client is None:
+								todoist_client = todoist.TodoistClient(api_base_url=api_base_url,
+								                                       max_connections=max_in_flight)
+							with METRICS.timer('dedupe_index'):
+								dedupe_index = _make_dedupe_index(todoist_client=todoist_client,
+								                                  todoist_task_cache=todoist_task_cache)
+
+						# Files may be read a while after they were checked for settling (See migrate_vaults(), which
+						# checks them as they're found), by which time they may be gone
+						try:
+							file_migration = _plan_file_migration(markdown_file_name=markdown_file_name,
+							                                      file_tasks=file_tasks, dedupe_index=dedupe_index,
+							                                      migration_ledger=migration_ledger)
+						except OSError as ex:
+							LOG.warning(f"Skipping over file '{markdown_file_name}' which could not be read:  {ex}")
+							METRICS.increment('files_vanished')
+							continue
+						if len(file_migration['tasks']) == 0:
+							# Though some of its lines may have been resumed
+							_write_file_migration(file_migration=file_migration, migration_ledger=migration_ledger,
+							                      written_files=written_files)
+							continue
+
+						# A file's tasks always go in the same batch, so that each file is written just once
+						if len(batch) == 0:
+							batch_started_at = time.monotonic()
+						batch.append(file_migration)
+						batch_task_count += len(file_migration['tasks'])
+
+					# None means the walk hasn't found anything for a while.  The batch may have waited long enough
+					if len(batch) > 0 and (batch_task_count >= PIPELINE_BATCH_SIZE or
+					                       time.monotonic() - batch_started_at >= PIPELINE_BATCH_MAX_WAIT_SECONDS):
+						_send_pending_batch()
+
+					# Finish off batches todoist is done with.  Wait on the oldest one if too many are outstanding
+					while len(in_flight) > 0 and (in_flight[0][0].done() or
+					                              len(in_flight) > PIPELINE_MAX_BATCHES_IN_FLIGHT):
+						_finish_batch(*in_flight.popleft(), dedupe_index=dedupe_index,
+						              migration_ledger=migration_ledger, written_files=written_files)
+
+				if len(batch) > 0:
+					_send_pending_batch()
+			finally:
+				# Even if something went wrong, record the tasks that were already created in todoist in their files
+				while len(in_flight) > 0:
+					_finish_batch(*in_flight.popleft(), dedupe_index=dedupe_index,
+					              migration_ledger=migration_ledger, written_files=written_files)
+	finally:
+		if owns_client is True and todoist_client is not None:
+			todoist_client.close()
+		if migration_ledger is not None:
+			migration_ledger.compact()
+
+	return found_tasks
+
+
+def _all_created_by_earlier_run(file_tasks: list, migration_ledger: MigrationLedger = None) -> bool:
+	"""
+	Returns: True if every one of a file's tasks was created in todoist by an earlier run that was stopped before it
+		could rewrite the file.  See migration_ledger.py
+	"""
+
+	if migration_ledger is None:
+		return False
+
+	for task_dict in file_tasks:
+		record = migration_ledger.find_for_file(task_dict=task_dict)
+		if record is None or record['step'] == PLANNED:
+			return False
+
+	return True
+
+
+def _file_has_settled(markdown_file_name: str, settle_seconds: float) -> bool:
+	"""
+	Check the last modified time of the file.  If it's less than X seconds ago, don't bother with it
+	The idea here is to not ship incomplete to-do items that the user might still by typing out into to
+	Todoist prematurely.  For example, if this program was scheduled on a cron job
+	Returns: False if the file was modified less than settle_seconds ago (or in the future), or can't be stat'ed (e.g.
+		it was deleted or renamed since it was scanned), otherwise True
+	"""
+
+	if settle_seconds <= 0:
+		return True
+
+	# take note of the current timestamp in UTC
+	right_now = datetime.datetime.now(timezone.utc)
+	right_now_utc_timestamp = right_now.timestamp()
+
+	# take note of the timestamp on the file
+	try:
+		file_last_modified_timestamp = os.path.getmtime(markdown_file_name)
+	except OSError as ex:
+		LOG.warning(f"Skipping over file '{markdown_file_name}' which could not be stat'ed:  {ex}")
+		METRICS.increment('files_vanished')
+		return False
+
+	time_diff_sec = right_now_utc_timestamp - file_last_modified_timestamp
+	if file_last_modified_timestamp > right_now_utc_timestamp or time_diff_sec < settle_seconds:
+		METRICS.increment('files_not_settled')
+		return False
+
+	return True
+
+
+def _make_dedupe_index(todoist_client: todoist.TodoistClient, todoist_task_cache: TodoistTaskCache = None) -> DedupeIndex:
+	"""
+	Builds an index of the open tasks in todoist, to check the tasks in the markdown files against for duplicates
+	Args:
+		todoist_client:  The client to talk to todoist with
+		todoist_task_cache:  If supplied, only what changed in todoist since the last run is fetched
+	"""
+
+	# Get the current list of tasks from the todoist API  This will help ensure we don't duplicate tasks
+	if todoist_task_cache is None:
+		todoist_tasks = todoist.get_todoist_tasks(client=todoist_client)
+		return DedupeIndex(todoist_tasks=todoist_tasks)
+
+	# Only what changed in todoist since the last run is fetched
+	todoist_task_cache.refresh(client=todoist_client)
+	LOG.info(todoist_task_cache.summary())
+	dedupe_index = DedupeIndex()
+	for task_hash, cached_task in todoist_task_cache.cached_tasks():
+		dedupe_index.add(todoist_task=cached_task, task_hash=task_hash)
+
+	return dedupe_index
+
+
+def _send_batch(sender: ThreadPoolExecutor, file_migrations: list, todoist_client: todoist.TodoistClient,
+                max_in_flight: int = 4, backend: str = 'rest', migration_ledger: MigrationLedger = None):
+	"""
+	Starts creating the planned tasks of some files in todoist, in the background
+	Either several REST requests are kept in flight at once, rather than waiting on each round trip to the API in
+	turn, or the tasks are sent in batches through the sync API
+	Returns: A tuple of (future for the list of created tasks, the file migrations) to hand to _finish_batch()
+	"""
+
+	if migration_ledger is not None:
+		migration_ledger.record_planned(task_dicts=[task_dict for file_migration in file_migrations
+		                                            for task_dict in file_migration['tasks']])
+
+	new_tasks = [_make_new_task_payload(task_dict=task_dict) for file_migration in file_migrations
+	             for task_dict in file_migration['tasks']]
+	def _create_tasks():
+		with METRICS.timer('create_batch', backend=backend):
+			if backend == 'sync':
+				# Many tasks per request, through the sync API
+				return todoist.create_tasks_in_batches(todoist_api_token=None, new_tasks=new_tasks, client=todoist_client)
+			return todoist.create_tasks(todoist_api_token=None, new_tasks=new_tasks, max_in_flight=max_in_flight,
+			                            client=todoist_client)
+
+	return sender.submit(_create_tasks), file_migrations
+
+
+def _finish_batch(future, file_migrations: list, dedupe_index: DedupeIndex, migration_ledger: MigrationLedger = None,
+                  written_files: dict = None):
+	"""
+	Waits for a batch sent by _send_batch() and rewrites its files to show which tasks were migrated
+	"""
+
+	"""
+	Make the tasks in todoist.  This is the moment we've been waiting for!
+	"""
+	new_todoist_tasks = future.result()
+
+	planned_tasks = [(file_migration, task_dict) for file_migration in file_migrations
+	                 for task_dict in file_migration['tasks']]
+	if migration_ledger is not None:
+		# Before any file is touched, so that a run stopped from here on knows what was created
+		migration_ledger.record_results(task_dicts=[task_dict for _, task_dict in planned_tasks],
+		                                todoist_tasks=new_todoist_tasks)
+
+	for (file_migration, task_dict), new_todoist_task in zip(planned_tasks, new_todoist_tasks):
+		_apply_created_task(file_migration=file_migration, task_dict=task_dict, new_todoist_task=new_todoist_task,
+		                    dedupe_index=dedupe_index)
+
+	# Replace the contents of each modified file with its new lines, in one go
+	for file_migration in file_migrations:
+		_write_file_migration(file_migration=file_migration, migration_ledger=migration_ledger,
+		                      written_files=written_files)
+
+
+def _make_replacement_string(task_dict: dict, todoist_task_url: str) -> str:
+	"""
+	Constructs a markdown string to replace the original to-do with, showing it has been migrated to todoist
+	Args:
+		task_dict:  A task, as returned by find_tasks
+		todoist_task_url:  The URL of the corresponding task in todoist
+	Returns: The replacement string, without any leading indentation or line ending
+	"""
+
+	# Handle the markdown part of the task:  '- [ ] ", or with another list marker, e.g. '* [ ] ' or '1. [ ] '
+	markdown_todo_regex_pattern = "(^\s*(?:[-*+]|[0-9]{1,9}[.)]) \[)( )(\]\s*)"
+	arrow_character = "→" # Used to denote a 'migrated' task.  In markdown any char other than ' ' will signify complete.
+	task_markdown_part = task_dict['markdown_part']  # This looks like:  '- [ ]'
+	markdown_todo_regex_match = re.match(string=task_markdown_part, pattern=markdown_todo_regex_pattern)
+	re_1 = markdown_todo_regex_match.group(1) # Looks like:  - [  or  1. [
+	re_3 = markdown_todo_regex_match.group(3).rstrip() # Looks like:  ].  The empty space would be in group 2
+	new_task_markdown_part = f"{re_1}{arrow_character}{re_3} "
+
+	# Handle the part of the string that links to the new task in todoist
+	todoist_link_part = f" [(This Task Migrated to Todoist)]({todoist_task_url})"
+
+	# Construct a complete line of text to replace the original to-do that was parsed from the file
+	replacement_todo_string = f"{new_task_markdown_part}~~{task_dict['task']}~~{todoist_link_part}"
+
+	return replacement_todo_string
+
+
+def _replace_line(line: str, replacement_string: str) -> str:
+	"""
+	Replaces the content of a line while keeping its indentation and line ending ('\r' when the file uses CRLF)
+	Args:
+		line:  A line of the file, split on '\n'
+		replacement_string:  The new content for the line
+	Returns: The new line
+	"""
+
+	content = line.rstrip('\r')
+	line_ending = line[len(content):]
+	indentation = content[:len(content) - len(content.lstrip())]
+
+	return f"{indentation}{replacement_string}{line_ending}"
+
+
+SPLICE_COPY_BLOCK_SIZE = 1024 * 1024  # How much of a large file is copied at a time when splicing lines into it
+
+
+def _replace_file_atomically(file_name: str, write_contents):
+	"""
+	Replaces a file by writing a temporary file next to it and renaming that over the original.
+	Either the old contents or the new contents end up in place, never a half written file
+	Args:
+		file_name:  The file to replace
+		write_contents:  Called with the temporary file, opened for writing bytes, to write the new contents to
+	Returns: The os.stat_result of the new file
+	"""
+
+	file_dir = os.path.dirname(os.path.abspath(file_name))
+	fd, tmp_file_name = tempfile.mkstemp(dir=file_dir, prefix=f".{os.path.basename(file_name)}.", suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			write_contents(f)
+			f.flush()
+			os.fsync(f.fileno())
+			stat_result = os.fstat(f.fileno())  # Renaming it leaves its modified time and size as they are
+		shutil.copymode(file_name, tmp_file_name)
+		os.replace(tmp_file_name, file_name)
+	except BaseException:
+		if os.path.exists(tmp_file_name):
+			os.remove(tmp_file_name)
+		raise
+
+	return stat_result
+
+
+def _write_file_atomically(file_name: str, data: str):
+	"""
+	Writes a file atomically.  See _replace_file_atomically()
+	Args:
+		file_name:  The file to (over)write
+		data:  The new contents of the file.  Written as-is, with no newline translation
+	Returns: The os.stat_result of the new file
+	"""
+
+	return _replace_file_atomically(file_name=file_name, write_contents=lambda f: f.write(data.encode('utf-8')))
+
+
+def _splice_file_atomically(file_name: str, splices: list):
+	"""
+	Replaces ranges of bytes in a file, without reading the whole file into memory.  Everything around the ranges is
+	copied across as-is, SPLICE_COPY_BLOCK_SIZE bytes at a time.  The file is replaced atomically.  See
+	_replace_file_atomically()
+	Args:
+		file_name:  The file to splice into
+		splices:  A list of (start, end, replacement bytes) tuples.  The ranges mustn't overlap
+	Returns: The os.stat_result of the new file
+	"""
+
+	def _write_contents(f):
+		with open(file_name, 'rb') as original_file:
+			position = 0
+			for start, end, replacement in sorted(splices):
+				remaining = start - position
+				while remaining > 0:
+					block = original_file.read(min(remaining, SPLICE_COPY_BLOCK_SIZE))
+					if not block:
+						raise ValueError(f"The file '{file_name}' is shorter than expected.  It may have been edited")
+					f.write(block)
+					remaining -= len(block)
+				f.write(replacement)
+				original_file.seek(end)
+				position = end
+			shutil.copyfileobj(original_file, f, SPLICE_COPY_BLOCK_SIZE)
+
+	return _replace_file_atomically(file_name=file_name, write_contents=_write_contents)
+
+
+def _read_task_lines(markdown_file_name: str, file_tasks: list) -> tuple:
+	"""
+	Reads just the lines that a large file's tasks were found on, through a memory map, rather than the whole file.
+	Each line is found by the byte_offset recorded for its task (See find_tasks._parse_large_file())
+	Args:
+		markdown_file_name:  The file the tasks were found in
+		file_tasks:  The tasks (as returned by find_tasks) that were found in the file
+	Returns: A tuple of (dict of line index -> (start byte, end byte, the line), the file's os.stat_result).  Tasks whose
+		byte_offset is no longer the start of a line are left out
+	"""
+
+	line_spans = {}
+	with open(markdown_file_name, 'rb') as f:
+		stat_result = os.fstat(f.fileno())
+		if stat_result.st_size == 0:
+			return line_spans, stat_result  # An empty file can't be mapped
+
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+			for task_dict in file_tasks:
+				start = task_dict['byte_offset']
+				if start >= len(mapped_file) or (start > 0 and mapped_file[start - 1] != ord('\n')):
+					continue
+				end = mapped_file.find(b'\n', start)
+				if end == -1:
+					end = len(mapped_file)
+				try:
+					line = mapped_file[start:end].decode('utf-8')
+				except UnicodeDecodeError:
+					continue
+				line_spans[task_dict['line_number'] - 1] = (start, end, line)
+
+	return line_spans, stat_result
+
+
+def _get_line(file_migration: dict, line_index: int):
+	"""
+	Returns: A line of a file being migrated (See _plan_file_migration()), or None if it wasn't read
+	"""
+
+	if file_migration['line_spans'] is not None:
+		line_span = file_migration['line_spans'].get(line_index)
+		return line_span[2] if line_span is not None else None
+
+	lines = file_migration['lines']
+	return lines[line_index] if line_index < len(lines) else None
+
+
+def _set_line(file_migration: dict, line_index: int, line: str):
+	"""
+	Replaces a line of a file being migrated (See _plan_file_migration()), in memory
+	"""
+
+	if file_migration['line_spans'] is not None:
+		start, end, _ = file_migration['line_spans'][line_index]
+		file_migration['line_spans'][line_index] = (start, end, line)
+	else:
+		file_migration['lines'][line_index] = line
+
+
+def _plan_file_migration(markdown_file_name: str, file_tasks: list, dedupe_index: DedupeIndex,
+                         migration_ledger: MigrationLedger = None) -> dict:
+	"""
+	Reads a markdown file (once) and works out which of the tasks found in it should be created in todoist
+	Tasks that an earlier run created in todoist, but didn't get as far as recording in the file, have their lines
+	replaced straight away instead.  See migration_ledger.py
+	Args:
+		markdown_file_name:  The file the tasks were found in
+		file_tasks:  The tasks (as returned by find_tasks) that were found in the file
+		dedupe_index:  Todoist tasks to check for duplicates against.  Planned tasks are added to it, so the same
+			to-do appearing twice in the vault is only planned once.  May only be None if every task is in
+			migration_ledger as created
+		migration_ledger:  An optional MigrationLedger to resume tasks from
+	Returns: A dict with the file_name, its lines (or for a large file, line_spans.  See _read_task_lines()), the
+		tasks to create, and the tasks whose lines have been replaced so far
+	"""
+
+	file_migration = dict(file_name=markdown_file_name, lines=None, line_spans=None, stat=None, tasks=[],
+	                      replaced_tasks=[])
+
+	if all(task_dict.get('byte_offset') is not None for task_dict in file_tasks):
+		# A large file (See find_tasks.LARGE_FILE_MIN_SIZE).  Only the lines of its tasks are read
+		file_migration['line_spans'], file_migration['stat'] = _read_task_lines(markdown_file_name=markdown_file_name,
+		                                                                        file_tasks=file_tasks)
+	else:
+		# Read the file.  newline='' keeps line endings exactly as they are, including any trailing newline.  Its stat
+		# is kept to tell whether it's been edited by the time it's written (See _write_file_migration())
+		with open(markdown_file_name, 'r', encoding='utf-8', newline='') as f:
+			file_migration['stat'] = os.fstat(f.fileno())
+			file_migration['lines'] = f.read().split('\n')
+
+	planned_tasks = file_migration['tasks']
+	for task_dict in file_tasks:
+
+		# Make sure the line still holds the to-do we parsed.  The file may have been edited since it was scanned
+		line_index = task_dict['line_number'] - 1
+		line = _get_line(file_migration=file_migration, line_index=line_index)
+		if line is None or line.strip() != task_dict['original_string']:
+			LOG.info(f"The task '{task_dict['task']}' is no longer on line {task_dict['line_number']} of the file "
+			         f"'{markdown_file_name}'.  It will be picked up again next time.")
+			METRICS.increment('tasks_moved')
+			continue
+
+		# Pick up where an earlier run left off
+		ledger_record = migration_ledger.find_for_file(task_dict=task_dict) if migration_ledger is not None else None
+		if ledger_record is not None and ledger_record['step'] != PLANNED:
+			LOG.warning(f"The task '{task_dict['task']}' from the file '{markdown_file_name}' was already created in "
+			            f"todoist by an earlier run.  Its line will be updated.")
+			METRICS.increment('tasks_resumed')
+			_apply_created_task(file_migration=file_migration, task_dict=task_dict, dedupe_index=dedupe_index,
+			                    new_todoist_task=types.SimpleNamespace(id=ledger_record['todoist_id'],
+			                                                           content=ledger_record['task'],
+			                                                           url=ledger_record['url']))
+			continue
 
 		"""
 		For good measure, bump the list of existing tasks from todoist up against that which is in scope right now
 		"""
 		markdown_task_md5_hash = task_dict['task_md5_hash']
-		matching_task_in_todoist = False
-		for tdt in todoist_tasks:
-			todoist_task_md5_hash = make_task_hash(task_description=tdt.content)
-			if todoist_task_md5_hash == markdown_task_md5_hash:
-				matching_task_in_todoist = True
-				break
-
-		if matching_task_in_todoist is True:
+		matching_task_in_todoist = dedupe_index.find(task_hash=markdown_task_md5_hash)
+
+		# An earlier run was stopped while this task was being created, or never heard back whether it was.  If it was,
+		# this is it
+		if ledger_record is not None and getattr(matching_task_in_todoist, 'id', None) is not None:
+			LOG.warning(f"The task '{task_dict['task']}' from the file '{markdown_file_name}' may have been created in "
+			            f"todoist by an earlier run.  The matching task in todoist will be linked to.")
+			METRICS.increment('tasks_adopted')
+			todoist_task_url = getattr(matching_task_in_todoist, 'url', None) or \
+			                   f"{todoist.TASK_URL}/{matching_task_in_todoist.id}"
+			migration_ledger.record_results(task_dicts=[task_dict], todoist_tasks=[types.SimpleNamespace(
+				id=matching_task_in_todoist.id, url=todoist_task_url)])
+			_apply_created_task(file_migration=file_migration, task_dict=task_dict, dedupe_index=dedupe_index,
+			                    new_todoist_task=types.SimpleNamespace(id=matching_task_in_todoist.id,
+			                                                           content=matching_task_in_todoist.content,
+			                                                           url=todoist_task_url))
+			continue
+
+		if matching_task_in_todoist is not None:
 			# TODO:  Read behavior for this out of a config file to enable or disable
-			print(f"The task '{task_dict['task']}' parsed from the markdown file '{markdown_file_name}' seems to be a "
-			      f"duplicate of a task that already exists in todoist, '{tdt.content}'.  "
-			      f"As such, it will be skipped over.", file=sys.stderr)
+			LOG.info(f"The task '{task_dict['task']}' parsed from the markdown file '{markdown_file_name}' seems to be "
+			         f"a duplicate of a task that already exists in todoist, '{matching_task_in_todoist.content}'.  "
+			         f"As such, it will be skipped over.")
+			METRICS.increment('duplicates_skipped')
 			continue
 
-		"""
-		Make the task in todoist.  This is the moment we've been waiting for!
-		"""
-		task_content = task_dict['task']
-		original_file_name = os.path.basename(markdown_file_name)
-		task_description = f"Migrated from [{original_file_name}]({task_dict['obsidian_uri']}). " \
-		               f"(Link may break if file was renamed or moved.)"  #TODO:  Make a post on message board to try to uinderstand this behavior
+		# The same to-do might appear again further down the vault.  Don't create it twice.  This placeholder is replaced
+		# by the created task, or removed if it couldn't be created (See _apply_created_task())
+		dedupe_index.add(todoist_task=types.SimpleNamespace(content=task_dict['task']), task_hash=markdown_task_md5_hash)
+		planned_tasks.append(task_dict)
 
+	return file_migration
 
-		new_todoist_task = todoist.create_task(todoist_api_token=todoist_api_token,
-		                                       task_content=task_content,
-		                                       task_description=task_description)
-		if new_todoist_task is Exception:
-			raise new_todoist_task
-		else:
-			todoist_task_url = new_todoist_task.url
 
+def _make_new_task_payload(task_dict: dict) -> dict:
+	"""
+	Args:
+		task_dict:  A task, as returned by find_tasks
+	Returns: The keyword arguments for todoist.create_task() to create the task with
+	"""
 
-		"""
-		Construct a markdown string to replace the original with
-		"""
+	original_file_name = os.path.basename(task_dict['file_name'])
+	task_description = f"Migrated from [{original_file_name}]({task_dict['obsidian_uri']}). " \
+	               f"(Link may break if file was renamed or moved.)"  #TODO:  Make a post on message board to try to uinderstand this behavior
 
-		# Handle the markdown part of the task:  '- [ ] "
-		markdown_todo_regex_pattern = "(^\s*- \[)( )(\]\s*)"
-		arrow_character = "→" # Used to denote a 'migrated' task.  In markdown any char other than ' ' will signify complete.
-		task_markdown_part = task_dict['markdown_part']  # This looks like:  '- [ ]'
-		markdown_todo_regex_match = re.match(string=task_markdown_part, pattern=markdown_todo_regex_pattern)
-		re_1 = markdown_todo_regex_match.group(1) # Looks like:  - [
-		re_3 = markdown_todo_regex_match.group(3).rstrip() # Looks like:  ].  The empty space would be in group 2
-		new_task_markdown_part = f"{re_1}{arrow_character}{re_3} "
-
-		# Handle the part of the string that links to the new task in todoist
-		todoist_link_part = f" [(This Task Migrated to Todoist)]({todoist_task_url})"
-
-		# Construct a complete line of text to replace the original to-do that was parsed from the file
-		replacement_todo_string = f"{new_task_markdown_part}~~{task_dict['task']}~~{todoist_link_part}"
-
-
-		#TODO:  Drop these helper messages.  Or don't
-		print("\nThe program will find and replace the following:")
-		print(f"\tWithin the file '{markdown_file_name}'")
-		print(f"\tThis string will be sought:            {task_dict['original_string']}")
-		print(f"\tWhich will be replaced by the string:  {replacement_todo_string}")
-
-		# Create a backup copy of the file before modifying it
-		#TODO:  Probably safe to comment this out or disable via config after having used this tool for a while
-		# backup_file_name = f"{markdown_file_name}.{right_now.strftime('%Y-%m-%d')}.bak"
-		# if not os.path.isfile(backup_file_name):
-		# 	shutil.copy(src=markdown_file_name, dst=backup_file_name)
-		# 	print(f"Created a backup file before modifying to-do item in place in the original.  Backup file name is:  '{backup_file_name}'")
-		# else:
-		# 	print(f"A backup file '{backup_file_name}' already exists.  Will not create another backup file")
+	return dict(task_content=task_dict['task'], task_description=task_description)
 
-		"""
-		Replace the original line in the file with a to-do item on it with the new field that 
-		show's it's been migrated to todoist
-		"""
-		# Read the lines of the file first
-		with open(markdown_file_name, 'r') as f:
-			lines = f.readlines()
 
-		# Modify the lines
-		new_lines = []
-		for line in lines:
-			if line.strip().startswith(task_dict['original_string']):
-				new_lines.append(replacement_todo_string)
-			else:
-				new_lines.append(line.rstrip())  # We don't want trailing \n char or we'll get doubles when we join
-		new_file_data = "\n".join(new_lines)  #TODO:  Might need to do a check here to place nicely with windows
+def _apply_created_task(file_migration: dict, task_dict: dict, new_todoist_task, dedupe_index: DedupeIndex):
+	"""
+	Replaces the line a task came from (in memory) with one that shows it's been migrated to todoist
+	Args:
+		file_migration:  As returned by _plan_file_migration()
+		task_dict:  The task, as returned by find_tasks
+		new_todoist_task:  The task created in todoist, or the exception raised while trying to create it
+		dedupe_index:  Updated with the created task, if there is one.  The placeholder added for the task when it was
+			planned is removed either way (See _plan_file_migration())
+	"""
 
-		# Replace the lines of the original file with the new lines
-		with open(markdown_file_name, 'w') as f:
-			f.write(new_file_data)
-			f.close()
-		recently_modified_files.append(markdown_file_name) # Helps us merge many tasks from the same file in without TS check
+	markdown_file_name = file_migration['file_name']
+	if dedupe_index is not None:
+		dedupe_index.discard(task_hash=task_dict['task_md5_hash'])
+
+	# Leave the line alone if the task couldn't be created.  It will be picked up again next time
+	if isinstance(new_todoist_task, Exception):
+		LOG.error(f"The task '{task_dict['task']}' from the file '{markdown_file_name}' could not be created in "
+		          f"todoist and will be left as-is:  {new_todoist_task}",
+		          extra=dict(fields=dict(event='task_failed', file_name=markdown_file_name,
+		                                 line_number=task_dict['line_number'], task=task_dict['task'])))
+		METRICS.increment('tasks_failed')
+		return
 
+	METRICS.increment('tasks_migrated')
+	todoist_task_url = new_todoist_task.url
+	if dedupe_index is not None:
+		dedupe_index.add(todoist_task=new_todoist_task, task_hash=task_dict['task_md5_hash'])
 
-		# To Do:  Cross out the todo in the markdown file
-		# Pick back up here next time
-		# TODO:  After buttoning up the piece that would create the todoist task
-		# Modify the markdown file here.
-		# Make it create a .backup file with the original contents and a datestamp
+	replacement_todo_string = _make_replacement_string(task_dict=task_dict, todoist_task_url=todoist_task_url)
 
+	# Only shown when verbose (See run_log.py)
+	if LOG.isEnabledFor(logging.DEBUG):
+		LOG.debug(f"\nThe program will find and replace the following:\n"
+		          f"\tWithin the file '{markdown_file_name}', on line {task_dict['line_number']}\n"
+		          f"\tThis string will be sought:            {task_dict['original_string']}\n"
+		          f"\tWhich will be replaced by the string:  {replacement_todo_string}",
+		          extra=dict(fields=dict(event='task_migrated', file_name=markdown_file_name,
+		                                 line_number=task_dict['line_number'], task=task_dict['task'],
+		                                 url=todoist_task_url)))
 
-if __name__ == '__main__':
+	"""
+	Replace the original line with a to-do item on it with the new field that show's it's been migrated to todoist.
+	This only happens in memory for now.  The file is written once all of its tasks have been handled
+	"""
+	line_index = task_dict['line_number'] - 1
+	_set_line(file_migration=file_migration, line_index=line_index,
+	          line=_replace_line(line=_get_line(file_migration=file_migration, line_index=line_index),
+	                             replacement_string=replacement_todo_string))
+	file_migration['replaced_tasks'].append(task_dict)
 
-	# Resolve the path to the vault.  If it's not passed in, get it from the config file
-	args = sys.argv
 
-	if len(args) >= 2:
-		base_dir = args[1]
+def _carry_over_edits(file_migration: dict) -> bool:
+	"""
+	Makes sure that writing a file's new lines won't write over edits made to it since it was read, e.g. while its tasks
+	were being created in todoist.  If it's been edited, it's read again and the replaced lines are carried over to what
+	it holds now.  Tasks whose lines have moved or changed are left as-is.  Their migrations are still in the ledger (if
+	there is one), so their lines are updated next time (See migration_ledger.py)
+	Args:
+		file_migration:  As returned by _plan_file_migration(), for a file that was read whole.  Its lines and
+			replaced_tasks are updated
+	Returns: False if there's nothing left to write
+	"""
+
+	markdown_file_name = file_migration['file_name']
+	try:
+		stat_result = os.stat(markdown_file_name)
+	except FileNotFoundError:
+		LOG.warning(f"The file '{markdown_file_name}' was removed while its tasks were being migrated.")
+		return False
+	if (stat_result.st_mtime_ns, stat_result.st_size) == (file_migration['stat'].st_mtime_ns,
+	                                                      file_migration['stat'].st_size):
+		return True
+
+	METRICS.increment('files_changed_before_rewrite')
+	with open(markdown_file_name, 'r', encoding='utf-8', newline='') as f:
+		current_lines = f.read().split('\n')
+
+	carried_over_tasks = []
+	for task_dict in file_migration['replaced_tasks']:
+		line_index = task_dict['line_number'] - 1
+		if line_index >= len(current_lines) or current_lines[line_index].strip() != task_dict['original_string']:
+			LOG.warning(f"The file '{markdown_file_name}' was changed while its tasks were being migrated, and the task "
+			            f"'{task_dict['task']}' is no longer on line {task_dict['line_number']}.  It was created in "
+			            f"todoist, and its line will be updated next time.")
+			METRICS.increment('tasks_moved')
+			continue
+
+		# The replaced line is the replacement string, give or take its indentation and line ending
+		current_lines[line_index] = _replace_line(line=current_lines[line_index],
+		                                          replacement_string=file_migration['lines'][line_index].strip())
+		carried_over_tasks.append(task_dict)
+
+	file_migration['lines'] = current_lines
+	file_migration['replaced_tasks'] = carried_over_tasks
+	return len(carried_over_tasks) > 0
+
+
+def _write_file_migration(file_migration: dict, migration_ledger: MigrationLedger = None, written_files: dict = None):
+	"""
+	Writes a file's new lines back to disk, if any of them were replaced
+	Args:
+		file_migration:  As returned by _plan_file_migration()
+		migration_ledger:  If supplied, the migrations of the replaced lines' tasks are recorded as finished
+		written_files:  See migrate_tasks()
+	"""
+
+	if len(file_migration['replaced_tasks']) == 0:
+		return
+
+	markdown_file_name = file_migration['file_name']
+
+	# Create a backup copy of the file before modifying it
+	#TODO:  Probably safe to comment this out or disable via config after having used this tool for a while
+	# backup_file_name = f"{markdown_file_name}.{datetime.datetime.now().strftime('%Y-%m-%d')}.bak"
+	# if not os.path.isfile(backup_file_name):
+	# 	shutil.copy(src=markdown_file_name, dst=backup_file_name)
+	# 	print(f"Created a backup file before modifying to-do item in place in the original.  Backup file name is:  '{backup_file_name}'")
+	# else:
+	# 	print(f"A backup file '{backup_file_name}' already exists.  Will not create another backup file")
+
+	if file_migration['line_spans'] is not None:
+		# A large file.  Its new lines are spliced in where the old ones were, which only works if nothing else moved
+		stat_result = os.stat(markdown_file_name)
+		if (stat_result.st_mtime_ns, stat_result.st_size) != (file_migration['stat'].st_mtime_ns,
+		                                                      file_migration['stat'].st_size):
+			LOG.warning(f"The file '{markdown_file_name}' was changed while its tasks were being migrated, so its "
+			            f"lines will be left as-is.")
+			METRICS.increment('files_changed_before_rewrite')
+			return
+
+		line_spans = file_migration['line_spans']
+		splices = []
+		for task_dict in file_migration['replaced_tasks']:
+			start, end, line = line_spans[task_dict['line_number'] - 1]
+			splices.append((start, end, line.encode('utf-8')))
+		with METRICS.timer('rewrite'):
+			stat_result = _splice_file_atomically(file_name=markdown_file_name, splices=splices)
 	else:
-		base_dir = _read_base_dir_from_config()
+		if not _carry_over_edits(file_migration=file_migration):
+			return
+		with METRICS.timer('rewrite'):
+			stat_result = _write_file_atomically(file_name=markdown_file_name, data="\n".join(file_migration['lines']))
+	METRICS.increment('files_rewritten')
+	if written_files is not None:
+		written_files[markdown_file_name] = (stat_result.st_mtime_ns, stat_result.st_size)
+
+	if migration_ledger is not None:
+		migration_ledger.record_written(task_dicts=file_migration['replaced_tasks'])
 
-	migrate_tasks(parent_directory=base_dir)
 
+if __name__ == '__main__':
+
+	# Resolve the path to the vault.  If it's not passed in, get the vault(s) from the config file
+	args = sys.argv
+
+	vaults = _read_vaults_from_config(base_dir=args[1] if len(args) >= 2 else None)
 
+	metrics_config = _read_metrics_config_from_config()
+	logging_config = _read_logging_config_from_config()
+	configure_logging(verbosity=logging_config['verbosity'] or 'quiet', json_file=logging_config['json_file'])
 
+	with profile(output_file=metrics_config['profile_file']):
+		migrate_vaults(vaults=vaults, scan_indexes=scan_indexes_for_vaults(vaults),
+		               workers=_read_scan_workers_from_config(),
+		               max_in_flight=_read_todoist_max_in_flight_from_config(),
+		               backend=_read_todoist_backend_from_config(),
+		               todoist_task_cache=TodoistTaskCache(),
+		               migration_ledger=MigrationLedger())
+	log_run_summary(command='migrate')
 
+	METRICS.export(json_file=metrics_config['json_file'], prometheus_file=metrics_config['prometheus_file'])
@@ -0,0 +1,232 @@
+"""
+An append-only record of where each to-do item is in being migrated, so that a run that's stopped part way through can
+be picked up where it left off
+
+Migrating a to-do item takes three steps:  it's planned, created in Todoist, then its line is rewritten to link to the
+new task.  Each step is appended to the ledger (cache/migration_ledger.jsonl) as it happens, one JSON object per line.
+Should a run be killed after a task was created in Todoist but before its line was rewritten, the next run finds the
+task's Todoist ID and URL in the ledger and just rewrites the line.  Nothing is fetched from Todoist and nothing is
+created twice.  A task whose create request was still in flight is only known to have been planned.  If the next run
+finds a matching task in Todoist, it adopts that one rather than skipping the to-do item as a duplicate
+
+Records are only kept until their task's line is rewritten, so the ledger is compacted (rewritten with just the
+unfinished records) at the end of every run.  Lookups are by task hash (See hashing.py), from a dict built when the
+ledger is loaded
+"""
+
+import json
+import os
+import time
+
+from hashing import upgrade_task_hash
+from run_log import get_logger
+
+LEDGER_FORMAT_VERSION = 1
+
+# The steps of a migration, in order.  'failed' means Todoist turned the task down, and is as good as never planned.
+# A task whose create request failed in a way that leaves it unclear whether it was created (a timeout, a 5xx or a 429)
+# is left as 'planned', so that the next run adopts it if it turns up in Todoist
+PLANNED = 'planned'
+CREATED = 'created'
+WRITTEN = 'written'
+FAILED = 'failed'
+
+LOG = get_logger('migration_ledger')
+
+
+def _is_rejection(ex: Exception) -> bool:
+    """
+    Args:
+        ex:  The exception raised trying to create a task in todoist
+    Returns: True if Todoist definitely didn't create the task, i.e. it answered with a 4xx other than a 429.  False
+        if the task may have been created anyway (a timeout, a dropped connection, a 5xx, a 429 or anything else)
+    """
+
+    # A TodoistSyncError (See todoist.py) has an http_code, and an httpx.HTTPStatusError has a response
+    http_code = getattr(ex, 'http_code', None)
+    if http_code is None:
+        http_code = getattr(getattr(ex, 'response', None), 'status_code', None)
+
+    return isinstance(http_code, int) and 400 <= http_code < 500 and http_code != 429
+
+
+class MigrationLedger:
+    """
+    The unfinished migrations of to-do items, keyed by task hash, backed by an append-only file.  See the module
+    docstring.  Disposable:  a missing or corrupt ledger just means nothing is resumed
+    """
+
+    def __init__(self, ledger_file_name: str = 'cache/migration_ledger.jsonl', max_age_days: float = 30):
+        """
+        Args:
+            ledger_file_name:  Where the ledger is kept.  It's fine if the file doesn't exist yet
+            max_age_days:  Unfinished records older than this are dropped when the ledger is compacted, e.g. for
+                to-do items that were deleted from their note before they could be resumed
+        """
+
+        self.ledger_file_name = ledger_file_name
+        self.max_age_days = max_age_days
+        self.records = {}  # Task hash -> the latest record for it
+
+        self._line_count = 0  # Lines in the file.  Compacting is only worth it once some of them are finished with
+        self._file = None
+
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.ledger_file_name):
+            return
+
+        try:
+            with open(self.ledger_file_name, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline() or '{}')
+                if header.get('version') != LEDGER_FORMAT_VERSION:
+                    raise ValueError("Unexpected ledger format")
+                self._line_count = 1
+                for line in f:
+                    self._line_count += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Most likely the last line, half written when the run was killed
+                        LOG.warning(f"Skipping over a line of the migration ledger '{self.ledger_file_name}' that "
+                                    f"could not be read:  {line.strip()}")
+                        continue
+                    # Hashes made by an older version of hashing.py are made afresh, so that they can still be matched
+                    record['task_hash'] = upgrade_task_hash(task_hash=record['task_hash'],
+                                                            task_description=record['task'])
+                    self._apply(record=record)
+        except Exception as ex:
+            LOG.warning(f"The migration ledger '{self.ledger_file_name}' could not be read and will be started "
+                        f"afresh.  Got exception of type {type(ex)}:  {ex}")
+            self.records = {}
+            self._line_count = 0
+
+    def _apply(self, record: dict):
+        if record['step'] in (WRITTEN, FAILED):
+            self.records.pop(record['task_hash'], None)
+        else:
+            self.records[record['task_hash']] = record
+
+    def _append(self, records: list):
+        """
+        Applies records, and appends them to the file in a single write.  They're on disk before this returns
+        """
+
+        if len(records) == 0:
+            return
+
+        for record in records:
+            self._apply(record=record)
+
+        if self._file is None:
+            ledger_dir = os.path.dirname(self.ledger_file_name)
+            if ledger_dir:
+                os.makedirs(ledger_dir, exist_ok=True)
+            if self._line_count == 0:
+                self._write_all(records=[])
+            self._file = open(self.ledger_file_name, 'a', encoding='utf-8')
+
+        self._file.write(''.join(f"{json.dumps(record)}\n" for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._line_count += len(records)
+
+    def _write_all(self, records: list):
+        """
+        Replaces the file with a header and the given records.  Written to a temporary file first then renamed, so an
+        interrupted run can't leave a half written file behind
+        """
+
+        tmp_file_name = f"{self.ledger_file_name}.tmp"
+        with open(tmp_file_name, 'w', encoding='utf-8') as f:
+            f.write(f"{json.dumps(dict(version=LEDGER_FORMAT_VERSION))}\n")
+            f.write(''.join(f"{json.dumps(record)}\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_name, self.ledger_file_name)
+        self._line_count = 1 + len(records)
+
+    @staticmethod
+    def _make_record(step: str, task_dict: dict, **kwargs) -> dict:
+        return dict(step=step, task_hash=task_dict['task_md5_hash'], file_name=task_dict['file_name'],
+                    task=task_dict['task'], at=time.time(), **kwargs)
+
+    def find(self, task_hash: str):
+        """
+        Returns: The latest record of the unfinished migration of a task (a dict with the keys step, task_hash,
+            file_name, task and at, plus todoist_id and url once it's been created), or None
+        """
+
+        return self.records.get(task_hash)
+
+    def find_for_file(self, task_dict: dict):
+        """
+        Returns: The record of the unfinished migration of a task (See find()), but only if it came from the same file
+            as task_dict.  The same to-do item in another file is a duplicate, not the one that was being migrated
+        """
+
+        record = self.records.get(task_dict['task_md5_hash'])
+        if record is None or record['file_name'] != task_dict['file_name']:
+            return None
+        return record
+
+    def record_planned(self, task_dicts: list):
+        """
+        Records that tasks (as returned by find_tasks) are about to be created in todoist
+        """
+
+        self._append(records=[self._make_record(step=PLANNED, task_dict=task_dict) for task_dict in task_dicts])
+
+    def record_results(self, task_dicts: list, todoist_tasks: list):
+        """
+        Records which tasks were created in todoist, and which Todoist turned down.  Tasks that may or may not have
+        been created are left as planned.  See _is_rejection()
+        Args:
+            task_dicts:  The tasks, as returned by find_tasks
+            todoist_tasks:  For each one, the task created in todoist or the exception raised trying to create it
+        """
+
+        records = []
+        for task_dict, todoist_task in zip(task_dicts, todoist_tasks):
+            if isinstance(todoist_task, Exception):
+                if _is_rejection(ex=todoist_task):
+                    records.append(self._make_record(step=FAILED, task_dict=task_dict))
+            else:
+                records.append(self._make_record(step=CREATED, task_dict=task_dict, todoist_id=str(todoist_task.id),
+                                                 url=todoist_task.url))
+        self._append(records=records)
+
+    def record_written(self, task_dicts: list):
+        """
+        Records that the lines of tasks have been rewritten to link to todoist.  That's the end of their migration
+        """
+
+        self._append(records=[self._make_record(step=WRITTEN, task_dict=task_dict) for task_dict in task_dicts])
+
+    def compact(self):
+        """
+        Rewrites the file with just the records of unfinished migrations, dropping any older than max_age_days
+        """
+
+        oldest = time.time() - self.max_age_days * 86400
+        for task_hash, record in list(self.records.items()):
+            if record['at'] < oldest:
+                LOG.warning(f"Forgetting the unfinished migration of the task '{record['task']}' from the file "
+                            f"'{record['file_name']}', which was last {record['step']} over {self.max_age_days} "
+                            f"days ago")
+                del self.records[task_hash]
+
+        if self._line_count <= 1 + len(self.records):
+            return  # Nothing to drop
+
+        self.close()
+        ledger_dir = os.path.dirname(self.ledger_file_name)
+        if ledger_dir:
+            os.makedirs(ledger_dir, exist_ok=True)
+        self._write_all(records=list(self.records.values()))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -3,25 +3,234 @@ String parsing functions to drive the main program
 """
 
 import re
-import sys
+import time
+from typing import TYPE_CHECKING
 
 from hashing import make_task_hash
+from hashing import make_task_hashes
+from metrics import METRICS
+from run_log import get_logger
 import os
-import frontmatter
-from yaml import parser as yaml_parser
+
+if TYPE_CHECKING:
+    import frontmatter  # Only for annotations.  It's slow to import, so it's imported where it's used
+
+# Every to-do item that parse_tasks_from_strings() can match contains these bytes, whatever list marker it has.  Files
+# without them can be passed over without being decoded, and without their frontmatter being parsed
+OPEN_TASK_MARKER = b'[ ]'
+
+NEWLINE_COUNT_BLOCK_SIZE = 1024 * 1024  # How much of a memory map is copied at a time, to count the lines in it
+
+# What scan_task_lines() looks for.  Every line it has to look at holds one of these:  an open to-do item, a line that
+# opens a fenced code block, or one that opens an HTML comment
+_TASK_ANCHORS = {str: ('[ ]',), bytes: (b'[ ]',)}
+_BLOCK_ANCHORS = {str: ('```', '~~~', '<!--'), bytes: (b'```', b'~~~', b'<!--')}
+
+# An open to-do item, on a line of its own.  The list marker may be -, * or +, or a number followed by . or )
+_TASK_LINE = re.compile(r'\s*((?:[-*+]|[0-9]{1,9}[.)]) \[ \]\s+)(\S.*?)\s*$')
+_DASH_TASK_LINE = re.compile(r'\s*(- \[ \]\s+)(\S.*?)\s*$')  # As the line by line parser matches
+
+# The opening line of a fenced code block, and the line of its closing fence.  The info string after an opening fence of
+# backticks may not hold a backtick, or it's inline code
+_OPENING_FENCE = re.compile(r'[ \t]*(`{3,}(?=[^`]*$)|~{3,})')
+_CLOSING_FENCE = re.compile(r'[ \t]*(`{3,}|~{3,})\s*$')
+_OPENING_COMMENT = re.compile(r'[ \t]*<!--')
+
+LOG = get_logger('parsers')
+
+
+def might_contain_tasks(data) -> bool:
+    """
+    A cheap test of the raw contents of a file, done before any decoding, YAML or regex work
+    Args:
+        data:  The raw bytes of a file, or anything else with a bytes-like find() method (e.g. an mmap)
+    Returns: False if the contents certainly hold no open to-do items.  True if they might
+    """
+
+    return data.find(OPEN_TASK_MARKER) != -1
+
+
+def _count_newlines(buffer, start: int, end: int) -> int:
+    """
+    Returns: How many newlines there are in a range of a string, bytes or memory map.  A memory map is counted a block
+        at a time, so that no more than NEWLINE_COUNT_BLOCK_SIZE bytes of it are ever copied at once
+    """
+
+    if isinstance(buffer, (str, bytes)):
+        return buffer.count('\n' if isinstance(buffer, str) else b'\n', start, end)
+
+    count = 0
+    for block_start in range(start, end, NEWLINE_COUNT_BLOCK_SIZE):
+        count += buffer[block_start:min(block_start + NEWLINE_COUNT_BLOCK_SIZE, end)].count(b'\n')
+    return count
+
+
+def _line_at(buffer, position: int, newline) -> tuple:
+    """
+    Returns: A tuple of (where the line holding position starts, where it ends, the line as a string)
+    """
+
+    line_start = buffer.rfind(newline, 0, position) + 1
+    line_end = buffer.find(newline, position)
+    if line_end == -1:
+        line_end = len(buffer)
+
+    line = buffer[line_start:line_end]
+    return line_start, line_end, line if isinstance(line, str) else line.decode('utf-8')
+
+
+def _end_of_block(buffer, opening_match: re.Match, line_start: int, line_end: int, newline) -> int:
+    """
+    Finds where a fenced code block or HTML comment ends
+    Args:
+        buffer:  As for scan_task_lines()
+        opening_match:  The match of _OPENING_FENCE or _OPENING_COMMENT on the line that opens the block
+        line_start:  Where that line starts
+        line_end:  Where it ends
+        newline:  '\n' in the same type as the buffer
+    Returns: Where the line after the block starts.  The end of the buffer if the block is never closed, as in
+        CommonMark, where an unclosed block runs to the end of the document
+    """
+
+    if opening_match.re is _OPENING_COMMENT:
+        # The comment ends with the line that holds the first -->, which may be the line it opens on.  Only spaces and
+        # tabs come before the <!--, so the end of the match is the same number of characters and bytes into the line
+        closing = '-->' if isinstance(buffer, str) else b'-->'
+        closing_position = buffer.find(closing, line_start + opening_match.end())
+        if closing_position == -1:
+            return len(buffer)
+        _, line_end, _ = _line_at(buffer=buffer, position=closing_position, newline=newline)
+        return line_end + 1
+
+    # The fence is closed by a line of the same character, at least as many of them, and nothing else
+    fence = opening_match.group(1)
+    closing = fence[:3] if isinstance(buffer, str) else fence[:3].encode('ascii')
+    position = line_end + 1
+    while position < len(buffer):
+        closing_position = buffer.find(closing, position)
+        if closing_position == -1:
+            break
+        _, line_end, line = _line_at(buffer=buffer, position=closing_position, newline=newline)
+        closing_match = _CLOSING_FENCE.match(line)
+        if closing_match is not None and closing_match.group(1)[0] == fence[0] and \
+                len(closing_match.group(1)) >= len(fence):
+            return line_end + 1
+        position = line_end + 1
+    return len(buffer)
+
+
+def scan_task_lines(buffer, skip_blocks: bool = True, all_list_markers: bool = True) -> list:
+    """
+    Finds the open to-do items in the whole of a note in a single pass.  Rather than splitting it into lines and testing
+    each one, it looks for the few substrings that any line worth a closer look must hold (See _TASK_ANCHORS and
+    _BLOCK_ANCHORS), then tests just the lines those are on.  To-do items inside fenced code blocks and HTML comments
+    are passed over, as Obsidian doesn't show them as to-do items either
+    Args:
+        buffer:  The text of the note.  A string, or its raw bytes or a memory map of it, in which case only the lines
+            that are tested are decoded (as UTF-8)
+        skip_blocks:  Set to False to find to-do items inside fenced code blocks and HTML comments too
+        all_list_markers:  Set to False to only find to-do items with the list marker '-'.  With skip_blocks=False too,
+            exactly the same to-do items are found as by _parse_tasks_line_by_line().  See compare_parsers.py
+    Returns: A list of dictionaries describing the to-do items found, as parse_tasks_from_strings() does but without
+        task_md5_hash.  When the buffer is bytes or a memory map, each also records the byte_offset its line starts at
+    """
+
+    newline = '\n' if isinstance(buffer, str) else b'\n'
+    task_line_pattern = _TASK_LINE if all_list_markers is True else _DASH_TASK_LINE
+    buffer_type = str if isinstance(buffer, str) else bytes
+    anchors = _TASK_ANCHORS[buffer_type] + (_BLOCK_ANCHORS[buffer_type] if skip_blocks is True else ())
+
+    all_todos = []
+    line_number = 1
+    counted_up_to = 0  # line_number is the number of the line that holds this position
+    next_positions = [buffer.find(anchor) for anchor in anchors]
+    while True:
+        found_positions = [anchor_position for anchor_position in next_positions if anchor_position != -1]
+        if len(found_positions) == 0:
+            break
+
+        line_start, line_end, line = _line_at(buffer=buffer, position=min(found_positions), newline=newline)
+        next_line_start = line_end + 1
+
+        todo_match = task_line_pattern.match(line)
+        if todo_match is not None:
+            line_number += _count_newlines(buffer=buffer, start=counted_up_to, end=line_start)
+            counted_up_to = line_start
+
+            task_part = todo_match.group(2)
+            for c in ('#', '@'):  # As _parse_task_from_string() does
+                task_part = task_part.replace(c, '')
+
+            todo = dict(markdown_part=todo_match.group(1), task=task_part, task_md5_hash=None,
+                        original_string=line.strip(), line_number=line_number)
+            if not isinstance(buffer, str):
+                todo['byte_offset'] = line_start
+            all_todos.append(todo)
+        elif skip_blocks is True:
+            block_match = _OPENING_FENCE.match(line) or _OPENING_COMMENT.match(line)
+            if block_match is not None:
+                next_line_start = _end_of_block(buffer=buffer, opening_match=block_match, line_start=line_start,
+                                                line_end=line_end, newline=newline)
+
+        next_positions = [anchor_position if anchor_position == -1 or anchor_position >= next_line_start
+                          else buffer.find(anchor, next_line_start)
+                          for anchor, anchor_position in zip(anchors, next_positions)]
+
+    return all_todos
 
 
 def parse_tasks_from_strings(input_data):
     """
-    Passes each line in a string to parse_line (singular) and returns each of the matches
+    Finds the open to-do items in a note.  See scan_task_lines()
     Args:
         input_data: A string or list of strings (e.g. Markdown Syntax).  May or may not be multiple lines of text
     Returns:  A list of dictionaries describing the matches or None, if none are found
+        Each match also records the (1 based) line_number it was found on, so it can be addressed exactly later
+    Raises:
+        TypeError:  If the input is neither a string nor a list of strings
+        ValueError:  If an item of a list holds a newline
     """
 
+    if type(input_data) not in [str, list]:
+        raise TypeError(f"Error.  Expected a string or list of strings.  Got {type(input_data)}")
+
+    started = time.perf_counter()
+    if type(input_data) is list:
+        input_string = '\n'.join(input_data)
+        if input_string.count('\n') != max(len(input_data) - 1, 0):
+            raise ValueError("The lines of the input must not contain any newline characters.")
+        line_count = len(input_data)
+    else:
+        input_string = input_data
+        line_count = input_string.count('\n') + 1
+
+    all_todos = scan_task_lines(buffer=input_string)
+
+    # Hash them all in one go.  Quicker than one at a time
+    task_hashes = make_task_hashes(task_descriptions=[todo['task'] for todo in all_todos])
+    for todo, task_hash in zip(all_todos, task_hashes):
+        todo['task_md5_hash'] = task_hash
+
+    METRICS.observe('parse', time.perf_counter() - started)
+    METRICS.increment('lines_parsed', line_count)
+
+    # If we found anything return the list, otherwise return None
+    if len(all_todos) > 0:
+        return all_todos
+    else:
+        return None
+
+
+def _parse_tasks_line_by_line(input_data):
     """
-    Validate the type of the input
+    Finds the open to-do items in a note the way parse_tasks_from_strings() used to:  by splitting it into lines and
+    passing each one to _parse_task_from_string().  Only '- [ ]' to-do items are found, including those inside code
+    blocks and comments.  Kept to check scan_task_lines() against.  See compare_parsers.py
+    Args:
+        input_data: A string or list of strings
+    Returns:  As parse_tasks_from_strings()
     """
+
     if type(input_data) not in [str, list]:
         raise TypeError(f"Error.  Expected a string or list of strings.  Got {type(input_data)}")
 
@@ -30,33 +239,39 @@ def parse_tasks_from_strings(input_data):
         input_data = input_data.split('\n')
 
     all_todos = []  # Running list of To-do items
-    for line in input_data:
+    for line_number, line in enumerate(input_data, start=1):
 
         # Short circuit of the line is an empty string
         if line.strip() == "":
             continue
 
-        todo_match = _parse_task_from_string(input_string=line)
+        todo_match = _parse_task_from_string(input_string=line, hash_task=False)
 
         if todo_match is None:
             continue
         else:
+            todo_match['line_number'] = line_number
             all_todos.append(todo_match)
 
-    # If we found anything return the list, otherwise return None
+    task_hashes = make_task_hashes(task_descriptions=[todo['task'] for todo in all_todos])
+    for todo, task_hash in zip(all_todos, task_hashes):
+        todo['task_md5_hash'] = task_hash
+
     if len(all_todos) > 0:
         return all_todos
     else:
         return None
 
 
-def _parse_task_from_string(input_string: str):
+def _parse_task_from_string(input_string: str, hash_task: bool = True):
     """
     Uses regex against a line of text to seek an incomplete to-do item
     The line of text should be a single line.  An exception will be thrown if it is not
     Args:
     input_string:  An input string to test the regex_pattern against
     then it will be defaulted tp the value in INCOMPLETE_MARKDOWN_TODO_PATTERN
+    hash_task:  If False, task_md5_hash is left as None for the caller to fill in (e.g. with a batch of hashes.  See
+    hashing.make_task_hashes())
 
     Returns:
     None or a String
@@ -87,7 +302,7 @@ def _parse_task_from_string(input_string: str):
 
     # Input_string mustn't contain any newline characters
     if '\n' in str(input_string):
-        raise ValueError(f"The input string must not contain any newline characters.")
+        raise ValueError("The input string must not contain any newline characters.")
 
     # Test the string against the regex for matches
     regex_match = re.match(string=input_string, pattern=todo_regex_pattern)
@@ -102,7 +317,7 @@ def _parse_task_from_string(input_string: str):
         for c in drop_chars:
             task_part = task_part.replace(c, '')
 
-        task_md5_hash = make_task_hash(task_description=task_part)
+        task_md5_hash = make_task_hash(task_description=task_part) if hash_task is True else None
 
         ret_val = dict(markdown_part=markdown_part,
                        task=task_part,
@@ -115,17 +330,23 @@ def _parse_task_from_string(input_string: str):
     return ret_val
 
 
-def parse_frontmatter(input_string: str) -> frontmatter.Post:
+def parse_frontmatter(input_string: str, read_file: bool = True) -> 'frontmatter.Post':
     """
     Parses front matter from a file or string
     Args:
         input_string: A fully qualified file path or a string
+        read_file: If False, input_string is always treated as the text to parse, even if it happens to look like
+            the path of a file.  Useful when the caller already has the contents of the file in hand
 
     Returns:
     """
 
+    # These take a while to import, so they're only imported once there's some frontmatter to parse
+    import frontmatter
+    from yaml import parser as yaml_parser
+
     # Is input_string a file?
-    if os.path.isfile(input_string):
+    if read_file is True and os.path.isfile(input_string):
         with open(input_string, 'r') as f:
             input_string = f.read()
     try:
@@ -145,11 +366,13 @@ def parse_frontmatter(input_string: str) -> frontmatter.Post:
         ---
         """
 
-        ret_val = frontmatter.loads(text=input_string, encoding='utf-8')
+        METRICS.increment('yaml_parses')
+        with METRICS.timer('frontmatter'):
+            ret_val = frontmatter.loads(text=input_string, encoding='utf-8')
     except yaml_parser.ParserError as ex:
-        # print(f"Got Exception of type {type(ex)} while trying to parse the input below.  "
-        #       f"Continuing: \n{input_string}", file=sys.stderr)
-        # print(ex, file=sys.stderr)
+        METRICS.increment('yaml_failures')
+        # LOG.debug(f"Got Exception of type {type(ex)} while trying to parse the input below.  "
+        #           f"Continuing: \n{input_string}\n{ex}")
         ret_val = None
 
 
@@ -157,44 +380,184 @@ def parse_frontmatter(input_string: str) -> frontmatter.Post:
     return ret_val
 
 
-def get_todoist_front_matter_setting(input_string:str):
+# Where frontmatter starts and ends.  The same boundary python-frontmatter looks for, so that both agree on what the
+# frontmatter of a note is.  It must be at the very start of the note, ignoring whitespace
+_FRONTMATTER_START = re.compile(r'\s*-{3,}\s*$', re.MULTILINE)
+_FRONTMATTER_BOUNDARY = re.compile(r'^-{3,}\s*$', re.MULTILINE)
+
+# A top level 'todoist:' key, and the rest of its line
+_TODOIST_KEY_LINE = re.compile(r'^(?:todoist|"todoist"|\'todoist\')[ \t]*:(?:[ \t]+(.*?))?[ \t\r]*$', re.MULTILINE)
+
+# JSON and TOML frontmatter, which python-frontmatter also understands
+_OTHER_FRONTMATTER_START = re.compile(r'\s*(?:\{|\+{3})')
+
+# How YAML 1.1 (and so PyYAML) reads the plain scalars that mean true, false or nothing
+_YAML_PLAIN_SCALARS = {'true': True, 'True': True, 'TRUE': True, 'yes': True, 'Yes': True, 'YES': True,
+                       'on': True, 'On': True, 'ON': True,
+                       'false': False, 'False': False, 'FALSE': False, 'no': False, 'No': False, 'NO': False,
+                       'off': False, 'Off': False, 'OFF': False,
+                       '~': None, 'null': None, 'Null': None, 'NULL': None}
+
+
+def _find_frontmatter(input_string: str):
+    """
+    Finds the YAML frontmatter block at the start of a note, without parsing it
+    Args:
+        input_string:  The text of the note
+    Returns: The text between the opening and closing '---' lines, or None if the note has no frontmatter
+    """
+
+    opening = _FRONTMATTER_START.match(input_string)
+    if opening is None:
+        return None
+
+    closing = _FRONTMATTER_BOUNDARY.search(input_string, opening.end())
+    if closing is None:
+        return None
+
+    return input_string[opening.end():closing.start()]
+
+
+def _scan_todoist_key(block: str):
+    """
+    Reads the todoist key straight out of the lines of a frontmatter block, without parsing the YAML
+    Args:
+        block:  The frontmatter, as returned by _find_frontmatter()
+    Returns: A tuple of (whether the answer can be trusted, the value of the key or None if it's not set).  The answer
+        can't be trusted when the key is written in a way that only a YAML parser can be sure of, e.g. more than once,
+        with a value that isn't a plain true/false/null, or after a quote or bracket that might still be open
+    """
+
+    if 'todoist' not in block:
+        return True, None
+
+    key_lines = list(_TODOIST_KEY_LINE.finditer(block))
+    if len(key_lines) != 1 or block.count('todoist') != 1:
+        return False, None
+
+    key_line = key_lines[0]
+    value = key_line.group(1) or ''
+    value = re.split(r'[ \t]#', value, maxsplit=1)[0].rstrip()  # Drop any trailing comment
+    if value == '' or value not in _YAML_PLAIN_SCALARS:
+        return False, None  # A value on the lines that follow, an anchor, a tag, a quoted string...
+
+    before = block[:key_line.start()]
+    if '"' in before or "'" in before or before.count('[') != before.count(']') or \
+            before.count('{') != before.count('}'):
+        return False, _YAML_PLAIN_SCALARS[value]
+
+    return True, _YAML_PLAIN_SCALARS[value]
+
+
+def _load_frontmatter_yaml(block: str):
+    """
+    Parses a frontmatter block as YAML, with the C loader if PyYAML was built with it
+    Returns: What the YAML holds
+    Raises: yaml.YAMLError if it isn't valid YAML
+    """
+
+    import yaml  # Slow to import, and only needed for frontmatter the line scan can't make sense of
+
+    METRICS.increment('yaml_parses')
+    with METRICS.timer('frontmatter'):
+        return yaml.load(block, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def _todoist_setting_from_value(todoist, input_string: str):
+    """
+    Returns: The todoist setting for the value of the todoist key in a note's frontmatter.  See
+        get_todoist_front_matter_setting()
+    """
+
+    if todoist is None:
+        ret_val = True
+    elif todoist is False:
+        ret_val = False  # Expected when frontmatter explicitly contains 'todoist: false'
+    elif todoist is True:
+        ret_val = True   # Not necessary to supply, but this is when the frontmatter explicitly contains 'todoist: true'
+    else:
+        raise ValueError(f"Could not parse 'todoist' setting front matter.  There is no handling.  "
+                         f"Got value '{todoist}', which is of type {type(todoist)} from the input: \n {input_string}")
+    return ret_val
+
+
+def get_todoist_front_matter_setting(input_string:str, read_file: bool = True):
     """
     Parses the todoist property from the frontmatter of a string or file that that string is the path for
 
     This is used to disallow specific notes (e.g. Packing list Template) from having parsed To-do's migrated to Todoist
 
+    Most notes have no frontmatter, or frontmatter without a todoist key, and the rest almost always have it on a line
+    of its own.  So rather than parse all of the YAML, the frontmatter is found and scanned for that line.  YAML is
+    only parsed when the line scan can't be sure of the answer (See _scan_todoist_key()).  Which also means that
+    frontmatter YAML can't parse (e.g. unfilled Obsidian templates, with values like {{date}}) is handled without a
+    fuss:  the todoist key is still read from it if it's there.  See compare_frontmatter.py, which checks this against
+    a full parse with python-frontmatter
+
     Args:
         input_string: A fully qualified file path or a string
+        read_file: If False, input_string is always treated as text.  See parse_frontmatter()
 
-    Returns: A Boolean flag, defaulting to True where no setting is found.
+    Returns: A Boolean flag, defaulting to True where no setting is found.  None if the todoist key is there, but the
+        frontmatter couldn't be parsed well enough to read it
     Raises: Value error if the 'todoist' key is supplied in the frontmatter with any value other than 'true' or 'false'
     """
 
-    fm = parse_frontmatter(input_string=input_string)
+    # Is input_string a file?
+    if read_file is True and os.path.isfile(input_string):
+        with open(input_string, 'r') as f:
+            input_string = f.read()
+
+    block = _find_frontmatter(input_string=input_string)
+    if block is None:
+        if _OTHER_FRONTMATTER_START.match(input_string):
+            return _get_todoist_front_matter_setting_by_full_parse(input_string=input_string)
+        return True
+
+    trusted, todoist = _scan_todoist_key(block=block)
+    if trusted is True:
+        METRICS.increment('frontmatter_fast_path')
+        return _todoist_setting_from_value(todoist=todoist, input_string=input_string)
+
+    import yaml  # Only imported once there's YAML to parse.  See _load_frontmatter_yaml()
+
+    try:
+        metadata = _load_frontmatter_yaml(block=block)
+    except yaml.YAMLError:
+        METRICS.increment('yaml_failures')
+        if todoist is not None:
+            return todoist  # The YAML is broken, but the todoist key was still plain to see
+        return None
+
+    if not isinstance(metadata, dict):
+        return True  # python-frontmatter ignores frontmatter that isn't a mapping
+    return _todoist_setting_from_value(todoist=metadata.get('todoist'), input_string=input_string)
+
+
+def _get_todoist_front_matter_setting_by_full_parse(input_string: str):
+    """
+    Works out the todoist setting of a note the way get_todoist_front_matter_setting() used to:  by having
+    python-frontmatter parse the whole of its frontmatter
+    Args:
+        input_string:  The text of the note
+    Returns: As get_todoist_front_matter_setting()
+    """
+
+    import frontmatter  # Already imported by parse_frontmatter()
+
+    fm = parse_frontmatter(input_string=input_string, read_file=False)
 
     ret_val = None
     if fm is None:
         # This might happen due to the try block in parse_frontmatter.  Move on with life
         return ret_val
     elif type(fm) is not frontmatter.Post:
-        print(f"The resulting object was not of type {type(frontmatter.Post)}, which is unexpected.  Continuing.",
-              file=sys.stderr)
+        LOG.warning(f"The resulting object was not of type {type(frontmatter.Post)}, which is unexpected.  Continuing.")
         return ret_val
     elif not hasattr(fm, 'metadata'):
-        print(f"The resulting object of type {type(frontmatter.Post)} does not have a 'metadata' attribute, which is "
-              f"unexpected.  Continuing.", file=sys.stderr)
+        LOG.warning(f"The resulting object of type {type(frontmatter.Post)} does not have a 'metadata' attribute, "
+                    f"which is unexpected.  Continuing.")
         return ret_val
 
     metadata = fm.metadata  # This is a dict
-    todoist = metadata.get('todoist')
-
-    if todoist is None:
-        ret_val = True
-    elif todoist is False:
-        ret_val = False  # Expected when frontmatter explicitly contains 'todoist: false'
-    elif todoist is True:
-        ret_val = True   # Not necessary to supply, but this is when the frontmatter explicitly contains 'todoist: true'
-    else:
-        raise ValueError(f"Could not parse 'todoist' setting front matter.  There is no handling.  "
-                         f"Got value '{todoist}', which is of type {type(todoist)} from the input: \n {input_string}")
-    return ret_val
+    return _todoist_setting_from_value(todoist=metadata.get('todoist'), input_string=input_string)
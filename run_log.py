@@ -0,0 +1,189 @@
+"""
+Logging for a run:  levels, a quiet mode for cron, and JSON lines
+
+Modules log through a logger of their own (See get_logger()) rather than printing.  What's shown depends on the
+verbosity given to configure_logging():
+
+    quiet:    Warnings, errors and a one line summary of the run (See log_run_summary()).  The default for migrations,
+              which usually run under cron
+    normal:   As well as those, what the run is doing (e.g. the scan index and Todoist task cache summaries)
+    verbose:  Everything, including each note and to-do item found and each line rewritten, as this program used to
+              print.  The default for finding to-do items
+
+Records can also be written to a file as JSON lines, one object per record, along with any structured fields passed
+as extra={'fields': {...}}.  Both the console and the JSON lines file are written through a BufferedStreamHandler, so
+records go out in batches rather than with a write (and a flush) each.  Until configure_logging() is called, only
+warnings and errors are shown, on stderr, as the logging module does by default
+"""
+
+import json
+import logging
+import sys
+import time
+
+LOGGER_NAME = 'markdown_todoist'
+
+# A level of its own for the one line summary of a run, so that it's shown even in quiet mode but isn't a warning
+SUMMARY = 35
+logging.addLevelName(SUMMARY, 'SUMMARY')
+
+VERBOSITY_LEVELS = {'quiet': logging.WARNING, 'normal': logging.INFO, 'verbose': logging.DEBUG}
+
+LOG_BUFFER_RECORDS = 1000  # How many records may wait in a buffer before they're written out
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns: The logger for a module, e.g. get_logger('find_tasks').  Every one of them is configured by
+        configure_logging()
+    """
+
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """
+    A StreamHandler that formats records as they come, but only writes them out once capacity of them are waiting, as
+    soon as one is at least flush_level, or when it's flushed (e.g. at exit).  Each batch is a single write
+    """
+
+    def __init__(self, stream=None, capacity: int = LOG_BUFFER_RECORDS, flush_level: int = logging.ERROR,
+                 close_stream: bool = False):
+        """
+        Args:
+            stream:  Where to write.  sys.stderr if not supplied
+            capacity:  How many records to hold before writing them out
+            flush_level:  Records at this level or above are written out straight away, along with any before them
+            close_stream:  Set to True to close the stream when the handler is closed, e.g. a file opened just for it
+        """
+
+        super().__init__(stream=stream)
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self.close_stream = close_stream
+        self._buffer = []
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self._buffer.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+
+        if len(self._buffer) >= self.capacity or record.levelno >= self.flush_level:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if len(self._buffer) > 0 and self.stream is not None:
+                self.stream.write(''.join(self._buffer))
+                self._buffer = []
+            super().flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            self.flush()
+            if self.close_stream is True and self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+            super().close()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as a single line of JSON, with the keys at, level, logger and message, plus any fields passed as
+    extra={'fields': {...}}
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = dict(at=record.created, level=record.levelname, logger=record.name, message=record.getMessage())
+        payload.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(verbosity: str = 'normal', json_file: str = None):
+    """
+    Sets up what's logged and where.  Replaces any earlier configuration
+    Args:
+        verbosity:  One of VERBOSITY_LEVELS.  See the module docstring
+        json_file:  If supplied, every record shown on the console is also appended to this file as a JSON line
+    """
+
+    if verbosity not in VERBOSITY_LEVELS:
+        raise ValueError(f"Unknown verbosity '{verbosity}'.  Expected one of {sorted(VERBOSITY_LEVELS)}")
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.setLevel(VERBOSITY_LEVELS[verbosity])
+    logger.propagate = False
+
+    # Warnings and errors go to stderr as soon as they happen.  Everything else (including the summary) goes to stdout
+    # in batches
+    stdout_handler = BufferedStreamHandler(stream=sys.stdout)
+    stdout_handler.addFilter(lambda record: record.levelno < logging.WARNING or record.levelno == SUMMARY)
+    stderr_handler = BufferedStreamHandler(stream=sys.stderr, flush_level=logging.WARNING)
+    stderr_handler.addFilter(lambda record: record.levelno >= logging.WARNING and record.levelno != SUMMARY)
+    for handler in (stdout_handler, stderr_handler):
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+
+    if json_file is not None:
+        json_handler = BufferedStreamHandler(stream=open(json_file, 'a', encoding='utf-8'), close_stream=True)
+        json_handler.setFormatter(JsonLinesFormatter())
+        logger.addHandler(json_handler)
+
+
+def add_verbosity_arguments(arg_parser):
+    """
+    Adds the --verbose and --quiet options to an argparse.ArgumentParser.  Either one sets args.verbosity, which is
+    None if neither was given
+    """
+
+    verbosity_group = arg_parser.add_mutually_exclusive_group()
+    verbosity_group.add_argument('--verbose', '-v', dest='verbosity', action='store_const', const='verbose',
+                                 help='Show every note and to-do item found, and every line rewritten')
+    verbosity_group.add_argument('--quiet', '-q', dest='verbosity', action='store_const', const='quiet',
+                                 help='Show only warnings, errors and a one line summary')
+
+
+def flush_logs():
+    """
+    Writes out any records still waiting in a buffer.  Called at exit anyway, but worth calling at the end of each
+    pass of a long running process (e.g. watch mode)
+    """
+
+    for handler in logging.getLogger(LOGGER_NAME).handlers:
+        handler.flush()
+
+
+def log_run_summary(command: str = 'migrate'):
+    """
+    Logs a one line summary of the run so far, from what was recorded in METRICS.  Shown even in quiet mode
+    Args:
+        command:  'find' or 'migrate', which is what the summary is about
+    """
+
+    from metrics import METRICS  # metrics.py logs through this module, so it can't be imported before it is
+
+    fields = {name: METRICS.total(name) for name in ('files_walked', 'files_with_tasks', 'tasks_found',
+                                                     'tasks_migrated', 'tasks_failed', 'duplicates_skipped',
+                                                     'tasks_resumed', 'tasks_adopted', 'files_rewritten')}
+    fields['seconds'] = round(time.time() - METRICS.started_at, 3)
+
+    summary = f"{fields['tasks_found']} to-do items found in {fields['files_with_tasks']} notes"
+    if command == 'migrate':
+        summary = f"Migrated {fields['tasks_migrated']} of {summary}.  {fields['duplicates_skipped']} duplicates " \
+                  f"skipped, {fields['tasks_failed']} failed, {fields['files_rewritten']} notes rewritten"
+    summary = f"{summary} in {fields['seconds']:.1f}s"
+
+    get_logger('run').log(SUMMARY, summary, extra=dict(fields=dict(event='run_summary', command=command, **fields)))
@@ -0,0 +1,141 @@
+"""
+Stamps of what each vault looked like the last time a migration over it left nothing to do
+
+Telling whether anything in a vault has changed since then takes only a walk of the vault, stat'ing each note (See
+vault_walk.py).  Nothing is read, nothing slow is imported and Todoist isn't asked anything, so a cron job that finds
+every vault as it was can exit in a few tens of milliseconds.
+
+A stamp is only recorded once a run has left nothing behind:  no tasks that failed to migrate, and no notes that were
+still waiting to settle.  The notes a run rewrites count as changes, so the run after a migration is always a full one
+(which then finds nothing to do, and records the stamp).  Stamps also expire, so that every so often a full run
+happens anyway (e.g. to pick up a to-do item that was skipped as a duplicate of a task since deleted in Todoist)
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from vault_walk import IgnoreRules
+from run_log import get_logger
+from vault_walk import walk_vault
+
+LOG = get_logger('run_stamp')
+
+STAMP_FORMAT_VERSION = 1  # Bump whenever what goes into a stamp changes.  Older stamps are discarded
+
+
+def stamp_vault(vault: dict):
+    """
+    Works out a stamp for a vault from the path, inode, modified time and size of each of its notes, and from the
+    vault's settings (so that changing them forces a full run)
+    Args:
+        vault:  A dict with the keys path, file_ext, ignore_patterns and settle_seconds.  See
+            config._read_vaults_from_config()
+    Returns: A tuple of (the stamp, the modified time of the newest note or None if there are no notes).  Or
+        (None, None) if the vault doesn't exist, which never matches a recorded stamp
+    """
+
+    parent_directory = os.path.realpath(os.path.expanduser(vault['path']))
+    if not os.path.isdir(parent_directory):
+        return None, None
+
+    file_ext = vault['file_ext']
+    if type(file_ext) is str:
+        file_ext = [file_ext]
+    file_ext = tuple(sorted({item if item.startswith('.') else f".{item}" for item in file_ext}))
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([STAMP_FORMAT_VERSION, parent_directory, file_ext, vault['ignore_patterns'],
+                              vault['settle_seconds']]).encode('utf-8'))
+
+    newest_modified_time = None
+    for root, files in walk_vault(directory=parent_directory,
+                                  ignore_rules=IgnoreRules(patterns=vault['ignore_patterns'])):
+        for entry in files:
+            if not entry.name.endswith(file_ext):
+                continue
+            try:
+                stat_result = entry.stat()
+            except OSError:
+                continue
+
+            digest.update(f"{entry.path}\0{stat_result.st_ino}\0{stat_result.st_mtime_ns}\0{stat_result.st_size}\n"
+                          .encode('utf-8', 'surrogateescape'))
+            if newest_modified_time is None or stat_result.st_mtime > newest_modified_time:
+                newest_modified_time = stat_result.st_mtime
+
+    return digest.hexdigest(), newest_modified_time
+
+
+class RunStamps:
+    """
+    The stamps recorded for each vault (See stamp_vault()), persisted between runs.  Disposable:  a missing or corrupt
+    file just means one full run
+    """
+
+    def __init__(self, stamps_file_name: str = 'cache/run_stamps.json'):
+        """
+        Args:
+            stamps_file_name:  Where the stamps are persisted.  It's fine if the file doesn't exist yet
+        """
+
+        self.stamps_file_name = stamps_file_name
+        self.stamps = {}  # Vault name -> dict(stamp, recorded_at)
+
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.stamps_file_name):
+            return
+
+        try:
+            with open(self.stamps_file_name, 'r') as f:
+                payload = json.load(f)
+            if payload.get('version') != STAMP_FORMAT_VERSION or type(payload.get('vaults')) is not dict:
+                raise ValueError("Unexpected stamps format")
+            self.stamps = payload['vaults']
+        except Exception as ex:
+            LOG.warning(f"The run stamps '{self.stamps_file_name}' could not be read and will be rebuilt.  Got "
+                        f"exception of type {type(ex)}:  {ex}")
+            self.stamps = {}
+
+    def is_unchanged(self, vault_name: str, stamp: str, max_age_seconds: float = 3600) -> bool:
+        """
+        Returns: True if the stamp is the one recorded for the vault, and it was recorded less than max_age_seconds
+            ago.  Otherwise False, and the vault needs a full run
+        """
+
+        recorded = self.stamps.get(vault_name)
+        if stamp is None or recorded is None or recorded['stamp'] != stamp:
+            return False
+
+        return 0 <= time.time() - recorded['recorded_at'] < max_age_seconds
+
+    def record(self, vault_name: str, stamp: str):
+        """
+        Records that a run over the vault, as of the stamp, left nothing to do
+        """
+
+        self.stamps[vault_name] = dict(stamp=stamp, recorded_at=time.time())
+
+    def forget(self, vault_name: str):
+        """
+        Forgets the vault's stamp, so that the next run over it is a full one
+        """
+
+        self.stamps.pop(vault_name, None)
+
+    def save(self):
+        """
+        Writes the stamps to disk.  Written to a temporary file first then renamed, so an interrupted run can't leave
+        a half written file behind
+        """
+
+        stamps_dir = os.path.dirname(self.stamps_file_name)
+        if stamps_dir:
+            os.makedirs(stamps_dir, exist_ok=True)
+        tmp_file_name = f"{self.stamps_file_name}.tmp"
+        with open(tmp_file_name, 'w') as f:
+            json.dump(dict(version=STAMP_FORMAT_VERSION, vaults=self.stamps), f)
+        os.replace(tmp_file_name, self.stamps_file_name)
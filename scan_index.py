@@ -0,0 +1,286 @@
+"""
+A persistent, on-disk index of the markdown files that find_tasks has already looked at
+
+Most notes in a vault don't change between two runs of this program, so there's no point in re-reading and re-parsing
+them every time.  For each file we keep its inode, modified time, size and a digest of its content along with the
+verdict from the frontmatter and the parsed tasks.  Files whose stat data still match what's in the index are served
+straight from the index and are never opened.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from hashing import upgrade_task_hash
+from run_log import get_logger
+
+# Bump whenever the shape of the parsed tasks, or how they're parsed, changes.  Older indexes are rebuilt
+INDEX_FORMAT_VERSION = 5
+
+LOG = get_logger('scan_index')
+
+
+def digest_file_contents(data: bytes) -> str:
+    """
+    Returns a digest of the raw contents of a file.  Used to tell whether a file that was touched actually changed
+    Args:
+        data: The raw bytes of the file
+    Returns: A hex digest string
+    """
+
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def index_file_name_for_vault(vault_name: str, vault_count: int = 1) -> str:
+    """
+    Returns: Where a vault's ScanIndex is kept.  A single vault uses the usual index.  Several vaults are scanned at
+        the same time, so each gets an index of its own, named after the vault
+    Args:
+        vault_name:  The name of the vault
+        vault_count:  How many vaults are configured
+    """
+
+    if vault_count == 1:
+        return 'cache/scan_index.json'
+
+    safe_vault_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', vault_name)
+    return f"cache/scan_index-{safe_vault_name}.json"
+
+
+def scan_indexes_for_vaults(vaults: list) -> dict:
+    """
+    Loads a ScanIndex for each vault.  See index_file_name_for_vault()
+    Args:
+        vaults:  A list of dicts with (at least) the key name.  See config._read_vaults_from_config()
+    Returns: A dict of vault name -> ScanIndex
+    """
+
+    return {vault['name']: ScanIndex(index_file_name=index_file_name_for_vault(vault_name=vault['name'],
+                                                                               vault_count=len(vaults)))
+            for vault in vaults}
+
+
+class ScanIndex:
+    """
+    Index of previously scanned files, keyed by fully qualified path (and by inode, to follow renamed files)
+
+    Typical use is:  construct, hand to find_tasks(), which will call lookup() / store() for every file it walks,
+    then prune() and save() once the walk is done.
+    """
+
+    def __init__(self, index_file_name: str = 'cache/scan_index.json'):
+        """
+        Args:
+            index_file_name:  Where the index is persisted.  It's fine if the file doesn't exist yet
+        """
+
+        self.index_file_name = index_file_name
+        self.entries = {}   # Fully qualified path -> entry dict
+        self._seen = set()  # Paths that were walked during this run.  Anything else under the walked root is stale
+        self._paths_by_inode = None  # Built lazily, only if we need to follow a renamed file
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.renames = 0
+
+        self._load()
+
+    def _load(self):
+        """
+        Reads the index from disk.  A missing index is expected on the first run.  A corrupt index is discarded, which
+        just costs us one full scan
+        """
+
+        if not os.path.isfile(self.index_file_name):
+            return
+
+        try:
+            with open(self.index_file_name, 'r') as f:
+                payload = json.load(f)
+            if payload.get('version') != INDEX_FORMAT_VERSION or type(payload.get('files')) is not dict:
+                raise ValueError("Unexpected index format")
+            self.entries = payload['files']
+            self._upgrade_task_hashes()
+        except Exception as ex:
+            LOG.warning(f"The scan index '{self.index_file_name}' could not be read and will be rebuilt.  Got "
+                        f"exception of type {type(ex)}:  {ex}")
+            self.entries = {}
+
+    def _upgrade_task_hashes(self):
+        """
+        Re-hashes any tasks whose hashes were made by an older version of hashing.make_task_hash(), so that they can be
+        compared with those made now.  The files they came from needn't be read again
+        """
+
+        for entry in self.entries.values():
+            for task in entry['tasks'] or []:
+                task['task_md5_hash'] = upgrade_task_hash(task_hash=task['task_md5_hash'], task_description=task['task'])
+
+    def start_run(self):
+        """
+        Forgets what was seen during the previous run and zeroes the counters.  Only needed when one index is kept in
+        memory across several runs (e.g. in watch mode)
+        """
+
+        self._seen = set()
+        self._paths_by_inode = None  # Rebuilt from the entries as they are now, if it's needed
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.renames = 0
+
+    def _remember_inode(self, file_name: str, inode: int):
+        """
+        Keeps the map of inodes to paths (if it's been built yet) up to date as an entry is stored or moved, so that a
+        file stored during this run can still be followed if it's renamed during a later one (e.g. in watch mode)
+        """
+
+        if self._paths_by_inode is not None:
+            self._paths_by_inode[inode] = file_name
+
+    @staticmethod
+    def _stat_matches(entry: dict, stat_result: os.stat_result) -> bool:
+        """
+        Returns True if the stat data in an index entry matches the stat data of the file on disk
+        """
+
+        return entry.get('inode') == stat_result.st_ino \
+            and entry.get('mtime_ns') == stat_result.st_mtime_ns \
+            and entry.get('size') == stat_result.st_size
+
+    def _find_renamed_entry(self, file_name: str, stat_result: os.stat_result):
+        """
+        Looks for an entry that was stored under some other path for the same inode, where that other path no longer
+        exists.  That's what a rename or a move within the same filesystem looks like
+        Returns: The old path, or None
+        """
+
+        if self._paths_by_inode is None:
+            self._paths_by_inode = {entry.get('inode'): path for path, entry in self.entries.items()}
+
+        old_file_name = self._paths_by_inode.get(stat_result.st_ino)
+        if old_file_name is None or old_file_name == file_name or old_file_name in self._seen:
+            return None
+
+        entry = self.entries.get(old_file_name)
+        if entry is not None and self._stat_matches(entry=entry, stat_result=stat_result) \
+                and not os.path.exists(old_file_name):
+            return old_file_name
+
+        return None
+
+    def lookup(self, file_name: str, stat_result: os.stat_result):
+        """
+        Returns the index entry for a file if the file hasn't changed since it was stored, otherwise None
+        Args:
+            file_name:  The fully qualified path to the file
+            stat_result:  The result of os.stat() for that file
+        Returns: A dict with the keys 'todoist_setting' and 'tasks' or None
+        """
+
+        self._seen.add(file_name)
+
+        entry = self.entries.get(file_name)
+        if entry is not None and self._stat_matches(entry=entry, stat_result=stat_result):
+            self.hits += 1
+            return entry
+
+        # Maybe the file was renamed or moved.  If so, re-key the entry under the new path
+        if entry is None:
+            old_file_name = self._find_renamed_entry(file_name=file_name, stat_result=stat_result)
+            if old_file_name is not None:
+                entry = self.entries.pop(old_file_name)
+                self.entries[file_name] = entry
+                self._remember_inode(file_name=file_name, inode=stat_result.st_ino)
+                self.renames += 1
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def revalidate(self, file_name: str, stat_result: os.stat_result, digest: str):
+        """
+        For a file that missed on stat data, check whether the content is actually the same (e.g. the file was only
+        touched).  If it is, refresh the stored stat data so the next run is a plain hit
+        Returns: The index entry or None
+        """
+
+        entry = self.entries.get(file_name)
+        if entry is None or entry.get('digest') != digest:
+            return None
+
+        entry['inode'] = stat_result.st_ino
+        entry['mtime_ns'] = stat_result.st_mtime_ns
+        entry['size'] = stat_result.st_size
+        self._remember_inode(file_name=file_name, inode=stat_result.st_ino)
+        return entry
+
+    def previous_digest(self, file_name: str):
+        """
+        Returns: The content digest stored for a file, or None if the file isn't in the index
+        """
+
+        entry = self.entries.get(file_name)
+        if entry is None:
+            return None
+        return entry.get('digest')
+
+    def store(self, file_name: str, stat_result: os.stat_result, digest: str, todoist_setting, tasks):
+        """
+        Stores the result of scanning a file
+        Args:
+            file_name:  The fully qualified path to the file
+            stat_result:  The result of os.stat() for that file, taken before the file was read
+            digest:  The digest of the file contents.  See digest_file_contents()
+            todoist_setting:  The value returned by parsers.get_todoist_front_matter_setting()
+            tasks:  The list of tasks parsed out of the file (without any file / host metadata) or None
+        """
+
+        self._seen.add(file_name)
+        self.entries[file_name] = dict(inode=stat_result.st_ino,
+                                       mtime_ns=stat_result.st_mtime_ns,
+                                       size=stat_result.st_size,
+                                       digest=digest,
+                                       todoist_setting=todoist_setting,
+                                       tasks=[dict(t) for t in tasks] if tasks else None)
+        self._remember_inode(file_name=file_name, inode=stat_result.st_ino)
+
+    def prune(self, parent_directory: str):
+        """
+        Evicts entries for files under parent_directory that were not seen during this run (i.e. they were deleted)
+        Entries for files under other directories (e.g. other vaults) are left alone
+        Args:
+            parent_directory:  The directory that was walked.  Should be a real, fully qualified path
+        """
+
+        prefix = os.path.join(parent_directory, '')
+        for file_name in list(self.entries.keys()):
+            if file_name.startswith(prefix) and file_name not in self._seen:
+                del self.entries[file_name]
+                self.evictions += 1
+
+    def save(self):
+        """
+        Persists the index.  Writes to a temporary file first, then renames it so that a crash can't leave a
+        half written index behind
+        """
+
+        index_dir = os.path.dirname(self.index_file_name)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+
+        tmp_file_name = f"{self.index_file_name}.tmp"
+        with open(tmp_file_name, 'w') as f:
+            json.dump(dict(version=INDEX_FORMAT_VERSION, files=self.entries), f)
+        os.replace(tmp_file_name, self.index_file_name)
+
+    def summary(self) -> str:
+        """
+        Returns: A one line description of how useful the index was for this run
+        """
+
+        return f"Scan index:  {self.hits} hits, {self.misses} misses, {self.evictions} evictions " \
+               f"({self.renames} renamed files followed)"
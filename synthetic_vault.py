@@ -0,0 +1,264 @@
+"""
+Generates a synthetic vault of markdown notes, for benchmarking
+
+The notes look roughly like real ones:  most have headings, prose and plain bullet lists, and a configurable share of
+them (task_density) hold open to-do items.  How many folders deep the notes go, how their sizes are spread, what
+kinds of frontmatter they carry and whether there are any huge notes can all be configured.  The same arguments
+always give the same vault.
+
+Run it on its own with:
+    python synthetic_vault.py /tmp/vault --notes 5000 --task-density 0.1 --depth 3 --sizes lognormal \
+        --frontmatter plain=0.5,none=0.3,todoist_false=0.1,template=0.1 --huge-notes 2
+"""
+
+import argparse
+import math
+import os
+import random
+import time
+
+_WORDS = ('alpha', 'budget', 'call', 'draft', 'email', 'follow', 'groceries', 'hotel', 'invoice', 'journal', 'kick',
+          'launch', 'meeting', 'notes', 'order', 'plan', 'quarterly', 'review', 'schedule', 'ticket', 'update',
+          'vendor', 'weekly', 'yard', 'zoom', 'the', 'a', 'with', 'for', 'about', 'and', 'to', 'from', 'on')
+
+# The kinds of frontmatter a note can have.  See make_note()
+FRONTMATTER_VARIANTS = ('plain', 'none', 'todoist_false', 'todoist_true', 'template')
+DEFAULT_FRONTMATTER_MIX = (('plain', 0.7), ('none', 0.3))
+
+# How note sizes (in lines) are spread around lines_per_note
+SIZE_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+
+def _sentence(rng: random.Random, word_count: int) -> str:
+    return ' '.join(rng.choice(_WORDS) for _ in range(word_count)).capitalize()
+
+
+def _make_frontmatter(rng: random.Random, variant: str) -> list:
+    """
+    Returns: The lines of a block of frontmatter of the given variant (See FRONTMATTER_VARIANTS)
+    """
+
+    if variant == 'none':
+        return []
+    if variant == 'template':
+        # An Obsidian template that was never filled in.  These make YAML parsers raise
+        return ['---', 'tags:', '  - {{date}}', '  - {{date:YYYY}}-MM-DD', '  - {{date:MMMM}}', '  - DailyNote',
+                'publish: false', '---']
+
+    lines = ['---', "tags:", f"  - {rng.choice(_WORDS)}", f"  - {rng.choice(_WORDS)}",
+             f"created: 2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}", 'publish: false']
+    if variant == 'todoist_false':
+        lines.append('todoist: false')
+    elif variant == 'todoist_true':
+        lines.append('todoist: true')
+    lines.append('---')
+
+    return lines
+
+
+def make_note(rng: random.Random, note_number: int, lines: int = 40, open_tasks: int = 0,
+              frontmatter_variant: str = None) -> str:
+    """
+    Makes the text of one note
+    Args:
+        rng:  The source of randomness
+        note_number:  Used to keep the to-do items of different notes distinct
+        lines:  About how many lines the note should have
+        open_tasks:  How many open to-do items ('- [ ] ...') to put in the note
+        frontmatter_variant:  One of FRONTMATTER_VARIANTS.  If not supplied, it's chosen from DEFAULT_FRONTMATTER_MIX
+    Returns: The text of the note
+    """
+
+    if frontmatter_variant is None:
+        frontmatter_variant = _choose_variant(rng=rng, mix=DEFAULT_FRONTMATTER_MIX)
+
+    note_lines = _make_frontmatter(rng=rng, variant=frontmatter_variant)
+    note_lines.append(f"# {_sentence(rng, 4)}")
+
+    task_lines = [i * lines // (open_tasks + 1) for i in range(1, open_tasks + 1)]
+    task_number = 0
+    while len(note_lines) < lines:
+        if task_number < open_tasks and len(note_lines) >= task_lines[task_number]:
+            note_lines.append(f"- [ ] {_sentence(rng, 5)} {note_number}-{task_number}")
+            task_number += 1
+            continue
+
+        kind = rng.random()
+        if kind < 0.1:
+            note_lines.extend(['', f"## {_sentence(rng, 3)}"])
+        elif kind < 0.4:
+            note_lines.append(f"- {_sentence(rng, 6)}")
+        elif kind < 0.45:
+            note_lines.append(f"- [x] {_sentence(rng, 5)}")  # Done to-do items don't count
+        else:
+            note_lines.append(f"{_sentence(rng, rng.randint(8, 30))}.")
+
+    while task_number < open_tasks:
+        note_lines.append(f"- [ ] {_sentence(rng, 5)} {note_number}-{task_number}")
+        task_number += 1
+
+    return '\n'.join(note_lines) + '\n'
+
+
+def _choose_variant(rng: random.Random, mix) -> str:
+    """
+    Picks a frontmatter variant
+    Args:
+        mix:  A sequence of (variant, weight) tuples.  The weights needn't add up to 1
+    """
+
+    total = sum(weight for _, weight in mix)
+    pick = rng.random() * total
+    for variant, weight in mix:
+        if pick < weight:
+            return variant
+        pick -= weight
+
+    return mix[-1][0]
+
+
+def _choose_line_count(rng: random.Random, lines_per_note: int, sizes: str) -> int:
+    """
+    Returns: How many lines a note should have.  See SIZE_DISTRIBUTIONS
+    """
+
+    if sizes == 'fixed':
+        return lines_per_note
+    if sizes == 'uniform':
+        return rng.randint(1, 2 * lines_per_note)
+    if sizes == 'lognormal':
+        # Most notes are short, a few are long.  The median is lines_per_note
+        return max(1, min(int(rng.lognormvariate(math.log(lines_per_note), 1.0)), 100 * lines_per_note))
+
+    raise ValueError(f"The sizes argument must be one of {SIZE_DISTRIBUTIONS}.  Got '{sizes}'")
+
+
+def _make_folder(directory: str, note_number: int, folders: int, depth: int) -> str:
+    """
+    Returns: The folder a note goes in.  Notes are spread over folders folders at each of depth levels
+    """
+
+    parts = [f"folder-{(note_number // folders ** level) % folders:03d}" for level in range(depth)]
+    return os.path.join(directory, *parts)
+
+
+def parse_frontmatter_mix(text: str) -> tuple:
+    """
+    Parses a frontmatter mix from the command line, e.g. 'plain=0.6,none=0.3,template=0.1'
+    Returns: A tuple of (variant, weight) tuples
+    """
+
+    mix = []
+    for item in text.split(','):
+        variant, _, weight = item.partition('=')
+        variant = variant.strip()
+        if variant not in FRONTMATTER_VARIANTS:
+            raise ValueError(f"Unknown frontmatter variant '{variant}'.  Expected one of {FRONTMATTER_VARIANTS}")
+        mix.append((variant, float(weight or 1)))
+
+    return tuple(mix)
+
+
+def make_synthetic_vault(directory: str, notes: int = 1000, task_density: float = 0.1, tasks_per_note: int = 3,
+                         lines_per_note: int = 40, folders: int = 20, seed: int = 0, age_seconds: float = 3600,
+                         depth: int = 1, sizes: str = 'fixed', frontmatter_mix=DEFAULT_FRONTMATTER_MIX,
+                         huge_notes: int = 0, huge_note_lines: int = 200000):
+    """
+    Writes a synthetic vault
+    Args:
+        directory:  Where to write the vault.  Created if it doesn't exist
+        notes:  How many notes to write
+        task_density:  The share of notes (0 to 1) that hold open to-do items
+        tasks_per_note:  How many open to-do items each of those notes holds
+        lines_per_note:  About how many lines each note has.  The median, for some size distributions
+        folders:  How many folders to spread the notes over, at each level
+        seed:  Seed for the randomness, so the same arguments always make the same vault
+        age_seconds:  How long ago the notes should look like they were last modified.  The default is old enough
+            that migrate_tasks won't think the notes are still being edited
+        depth:  How many levels of folders to nest the notes in
+        sizes:  How note sizes are spread.  One of SIZE_DISTRIBUTIONS
+        frontmatter_mix:  A sequence of (variant, weight) tuples saying how often each kind of frontmatter appears.
+            See FRONTMATTER_VARIANTS
+        huge_notes:  How many huge notes to write, in addition to the others, at the top of the vault.  Each holds
+            tasks_per_note open to-do items
+        huge_note_lines:  How many lines each huge note has
+    Returns: A list of the fully qualified paths of the notes written
+    """
+
+    if sizes not in SIZE_DISTRIBUTIONS:
+        raise ValueError(f"The sizes argument must be one of {SIZE_DISTRIBUTIONS}.  Got '{sizes}'")
+
+    rng = random.Random(seed)
+    modified_time = time.time() - age_seconds
+
+    note_numbers_with_tasks = set(rng.sample(range(notes), k=round(notes * task_density)))
+
+    def _write_note(file_name: str, text: str):
+        with open(file_name, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        os.utime(file_name, (modified_time, modified_time))
+        file_names.append(file_name)
+
+    file_names = []
+    for note_number in range(notes):
+        folder = _make_folder(directory=directory, note_number=note_number, folders=folders, depth=depth)
+        os.makedirs(folder, exist_ok=True)
+
+        open_tasks = tasks_per_note if note_number in note_numbers_with_tasks else 0
+        lines = _choose_line_count(rng=rng, lines_per_note=lines_per_note, sizes=sizes)
+        frontmatter_variant = _choose_variant(rng=rng, mix=frontmatter_mix)
+        _write_note(file_name=os.path.join(folder, f"note-{note_number:06d}.md"),
+                    text=make_note(rng=rng, note_number=note_number, lines=lines, open_tasks=open_tasks,
+                                   frontmatter_variant=frontmatter_variant))
+
+    os.makedirs(directory, exist_ok=True)
+    for huge_note_number in range(huge_notes):
+        _write_note(file_name=os.path.join(directory, f"huge-note-{huge_note_number:03d}.md"),
+                    text=make_note(rng=rng, note_number=notes + huge_note_number, lines=huge_note_lines,
+                                   open_tasks=tasks_per_note, frontmatter_variant='plain'))
+
+    return file_names
+
+
+def add_vault_arguments(arg_parser: argparse.ArgumentParser):
+    """
+    Adds the arguments of make_synthetic_vault() to a command line parser.  See vault_arguments()
+    """
+
+    arg_parser.add_argument('--notes', type=int, default=1000, help='How many notes to write')
+    arg_parser.add_argument('--task-density', type=float, default=0.1,
+                            help='The share of notes (0 to 1) with open to-do items in them')
+    arg_parser.add_argument('--tasks-per-note', type=int, default=3)
+    arg_parser.add_argument('--lines-per-note', type=int, default=40)
+    arg_parser.add_argument('--folders', type=int, default=20, help='How many folders at each level')
+    arg_parser.add_argument('--depth', type=int, default=1, help='How many levels of folders')
+    arg_parser.add_argument('--sizes', choices=SIZE_DISTRIBUTIONS, default='fixed',
+                            help='How note sizes are spread around --lines-per-note')
+    arg_parser.add_argument('--frontmatter', type=parse_frontmatter_mix, default=DEFAULT_FRONTMATTER_MIX,
+                            help=f"Weights for each kind of frontmatter, e.g. plain=0.6,none=0.3,template=0.1.  "
+                                 f"Kinds are {', '.join(FRONTMATTER_VARIANTS)}")
+    arg_parser.add_argument('--huge-notes', type=int, default=0, help='How many huge notes to add')
+    arg_parser.add_argument('--huge-note-lines', type=int, default=200000)
+    arg_parser.add_argument('--seed', type=int, default=0)
+
+
+def vault_arguments(args: argparse.Namespace) -> dict:
+    """
+    Returns: The keyword arguments for make_synthetic_vault() from parsed command line arguments.  See
+        add_vault_arguments()
+    """
+
+    return dict(notes=args.notes, task_density=args.task_density, tasks_per_note=args.tasks_per_note,
+                lines_per_note=args.lines_per_note, folders=args.folders, depth=args.depth, sizes=args.sizes,
+                frontmatter_mix=args.frontmatter, huge_notes=args.huge_notes, huge_note_lines=args.huge_note_lines,
+                seed=args.seed)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('directory')
+    add_vault_arguments(arg_parser=arg_parser)
+    args = arg_parser.parse_args()
+
+    written = make_synthetic_vault(directory=args.directory, **vault_arguments(args))
+    print(f"Wrote {len(written)} notes under '{args.directory}'")
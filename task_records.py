@@ -0,0 +1,137 @@
+"""
+Compact records for the to-do items found in markdown files
+
+Every to-do item found in a file used to be a dict carrying its own copy of the file's details (inode, name, Obsidian
+URI...) and of this host's details.  A TaskRecord instead holds just what's particular to the to-do item and points
+at a FileRecord shared by every to-do item in the same file, and at a HostRecord shared by every to-do item found
+during the run.
+
+A TaskRecord can still be read like the dict it replaces (task['file_name'], dict(task), json.dumps(task.to_dict()))
+"""
+
+import functools
+import socket
+import uuid
+from collections.abc import Mapping
+from operator import attrgetter
+
+
+class HostRecord:
+    """
+    Details of the host the to-do items were found on.  See get_host_record()
+    """
+
+    __slots__ = ('mac_address', 'host_name')
+
+    def __init__(self, mac_address: str, host_name: str):
+        self.mac_address = mac_address
+        self.host_name = host_name
+
+
+@functools.lru_cache(maxsize=None)
+def get_host_record() -> HostRecord:
+    """
+    Returns: The HostRecord for this host.  Built once, then shared
+    """
+
+    return HostRecord(mac_address=hex(uuid.getnode()), host_name=socket.gethostname())
+
+
+class FileRecord:
+    """
+    Details of a file that to-do items were found in, shared by all of its TaskRecords
+    """
+
+    __slots__ = ('file_name', 'inode', 'file_name_escaped', 'obsidian_uri')
+
+    def __init__(self, file_name: str, inode: int, file_name_escaped: str, obsidian_uri: str):
+        self.file_name = file_name
+        self.inode = inode
+        self.file_name_escaped = file_name_escaped
+        self.obsidian_uri = obsidian_uri
+
+
+# How each key of the dict view of a TaskRecord is looked up, in the order the keys have always come in
+_DICT_VIEW = {
+    'markdown_part': attrgetter('markdown_part'),
+    'task': attrgetter('task'),
+    'task_md5_hash': attrgetter('task_md5_hash'),
+    'original_string': attrgetter('original_string'),
+    'line_number': attrgetter('line_number'),
+    'from_file_inode': attrgetter('file.inode'),
+    'from_mac_address': attrgetter('host.mac_address'),
+    'from_hostname': attrgetter('host.host_name'),
+    'file_name': attrgetter('file.file_name'),
+    'file_name_escaped': attrgetter('file.file_name_escaped'),
+    'obsidian_uri': attrgetter('file.obsidian_uri'),
+    'byte_offset': attrgetter('byte_offset'),
+}
+
+# Keys of the dict view that are left out when their value is None, rather than showing up in every to-do item's JSON
+_OMITTED_IF_NONE = frozenset({'byte_offset'})
+
+
+class TaskRecord(Mapping):
+    """
+    A to-do item found in a markdown file.  Reads like a (read only) dict with the keys in _DICT_VIEW, less any in
+    _OMITTED_IF_NONE that are None
+    """
+
+    __slots__ = ('markdown_part', 'task', 'task_md5_hash', 'original_string', 'line_number', 'file', 'host',
+                 'byte_offset')
+
+    def __init__(self, markdown_part: str, task: str, task_md5_hash: str, original_string: str, line_number: int,
+                 file: FileRecord, host: HostRecord, byte_offset: int = None):
+        self.markdown_part = markdown_part
+        self.task = task
+        self.task_md5_hash = task_md5_hash
+        self.original_string = original_string
+        self.line_number = line_number
+        self.file = file
+        self.host = host
+        self.byte_offset = byte_offset  # Where the line starts in the file.  Only recorded for large files
+
+    def __getitem__(self, key: str):
+        try:
+            getter = _DICT_VIEW[key]
+        except KeyError:
+            raise KeyError(key) from None
+        value = getter(self)
+        if value is None and key in _OMITTED_IF_NONE:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key, getter in _DICT_VIEW.items() if key not in _OMITTED_IF_NONE or getter(self) is not None)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"TaskRecord({self.to_dict()!r})"
+
+    def to_dict(self) -> dict:
+        """
+        Returns: The to-do item as a plain dict, as it used to be represented.  Handy for JSON output
+        """
+
+        return {key: self[key] for key in self}
+
+
+def make_task_records(parsed_tasks: list, file_record: FileRecord, host_record: HostRecord = None) -> list:
+    """
+    Builds TaskRecords for the to-do items found in one file
+    Args:
+        parsed_tasks:  The to-do items, as returned by parsers.parse_tasks_from_strings()
+        file_record:  The file they were found in
+        host_record:  The host they were found on.  Defaults to this host
+    Returns: A list of TaskRecords
+    """
+
+    if host_record is None:
+        host_record = get_host_record()
+
+    return [TaskRecord(markdown_part=t['markdown_part'], task=t['task'], task_md5_hash=t['task_md5_hash'],
+                       original_string=t['original_string'], line_number=t['line_number'], file=file_record,
+                       host=host_record, byte_offset=t.get('byte_offset'))
+            for t in parsed_tasks]
@@ -1,31 +1,145 @@
 """
 Code to manage the creation of new items in Todoist
 See:  https://pypi.org/project/todoist-api-python/
+
+httpx and todoist_api_python take a good while to import, so they're only imported once a TodoistClient is built.
+Runs that never talk to Todoist never pay for them
 """
+import collections
 import os.path
-import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from todoist_api_python.api import TodoistAPI
 import json
 
 from config import _read_api_token_from_file
+from run_log import get_logger
+
+BACKENDS = ('rest', 'sync')  # The ways tasks can be created.  See create_tasks() and create_tasks_in_batches()
+SYNC_API_URL = "https://api.todoist.com/api/v1/sync"
+SYNC_COMMANDS_PER_REQUEST = 100  # The most commands Todoist accepts in a single sync request
+TASK_URL = "https://app.todoist.com/app/task"
+
+LOG = get_logger('todoist')
+
+# What create_tasks_in_batches() hands back for each created task.  Quacks like the Task objects from the REST API,
+# as far as the rest of this package is concerned
+SyncCreatedTask = collections.namedtuple('SyncCreatedTask', ['id', 'content', 'url'])
+
+
+class TodoistSyncError(Exception):
+    """
+    Raised (or returned, See create_tasks_in_batches) when the sync API rejects a command
+    """
+
+    def __init__(self, message: str, http_code: int = None):
+        """
+        Args:
+            message:  What went wrong
+            http_code:  The HTTP status the command was rejected with, or None if it's not known whether the command
+                ran (e.g. it's missing from the response)
+        """
+
+        super().__init__(message)
+        self.http_code = http_code
 
 
-def get_todoist_tasks(todoist_api_token:str):
+class TodoistClient:
+    """
+    A long-lived connection to the Todoist API.  Build one per run and pass it to the functions in this module so
+    that every request reuses the same pool of keep-alive connections, rather than each call paying for a new session
+    and TLS handshake.  The API token is resolved once, when the client is built.
+
+    Can be used as a context manager, which closes the connections on exit.
+    """
+
+    def __init__(self, todoist_api_token: str = None, api_base_url: str = None, max_connections: int = 10,
+                 timeout: float = 60.0, todoist_api_config_file: str = 'config/todoist_api_config.json'):
+        """
+        Args:
+            todoist_api_token:  The token, required to interact with todoist API.  Read from the api config file
+                (See get_api_token) if not supplied
+            api_base_url:  Optionally, a server to talk to instead of the real Todoist API (e.g. http://127.0.0.1:8765)
+                See fake_todoist.py
+            max_connections:  The most connections to hold open to the API at once.  Should be at least as many as
+                the number of requests that will be made concurrently
+            timeout:  Seconds to wait on the API before giving up on a request
+            todoist_api_config_file:  Where to read the token from, if it's not supplied
+        """
+
+        import httpx
+        from todoist_api_python.api import TodoistAPI
+        from todoist_transport import BaseUrlTransport
+        from todoist_transport import InstrumentedTransport
+
+        if todoist_api_token is None:
+            todoist_api_token = get_api_token(todoist_api_config_file=todoist_api_config_file)
+        self.todoist_api_token = todoist_api_token
+
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        if api_base_url is None:
+            transport = InstrumentedTransport(limits=limits)
+        else:
+            transport = BaseUrlTransport(api_base_url=api_base_url, limits=limits)
+
+        self.http_client = httpx.Client(transport=transport, timeout=httpx.Timeout(timeout, connect=10.0))
+        self.api = TodoistAPI(todoist_api_token, client=self.http_client)
+
+    def close(self):
+        """
+        Closes any open connections to the API
+        """
+
+        self.http_client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _resolve_client(todoist_api_token: str = None, api_base_url: str = None, client: TodoistClient = None):
+    """
+    Returns the client to use for a call, building a short-lived one if the caller didn't supply one
+    Returns: A tuple of (TodoistClient, whether the caller should close it when done)
+    """
+
+    if client is not None:
+        return client, False
+
+    return TodoistClient(todoist_api_token=todoist_api_token, api_base_url=api_base_url), True
+
+
+def get_todoist_tasks(todoist_api_token:str = None, api_base_url: str = None, client: TodoistClient = None):
     """
     Gets a list of all open tasks in todoist
     Args:
-        todoist_api_token:
+        todoist_api_token:  Not needed if a client is supplied
+        api_base_url:  Optionally, a server to talk to instead of the real Todoist API.  See TodoistClient
+        client:  A TodoistClient to make the request with.  A short-lived one is built if not supplied
     Returns:
     """
 
-    api = TodoistAPI(todoist_api_token)
+    client, close_client = _resolve_client(todoist_api_token=todoist_api_token, api_base_url=api_base_url,
+                                           client=client)
     try:
-        tasks = api.get_tasks()
-        return tasks
+        tasks = client.api.get_tasks()
+
+        # Newer versions of todoist-api-python hand back pages (lists) of tasks rather than one list.  Flatten those
+        flattened_tasks = []
+        for item in tasks:
+            if isinstance(item, list):
+                flattened_tasks.extend(item)
+            else:
+                flattened_tasks.append(item)
+        return flattened_tasks
     except Exception as ex:
-        print(f"Got Exception while trying to collect tasks from the Todoist API:\n{ex}.", file=sys.stderr)
+        LOG.error(f"Got Exception while trying to collect tasks from the Todoist API:\n{ex}.")
         raise ex
+    finally:
+        if close_client is True:
+            client.close()
 
 
 def get_api_token(todoist_api_config_file: str = 'config/todoist_api_config.json'):
@@ -49,7 +163,28 @@ def get_api_token(todoist_api_config_file: str = 'config/todoist_api_config.json
 
     return todoist_api_token
 
-def create_task(todoist_api_token:str, task_content:str, task_description:str = None, due_string:str = "Today") -> str:
+def get_sync_changes(client: TodoistClient, sync_token: str = '*', resource_types: tuple = ('items',)) -> dict:
+    """
+    Reads changes from the sync API.  With a sync_token from a previous call, only what changed since that call is
+    returned.  With '*', everything is returned
+    See:  https://developer.todoist.com/api/v1/#tag/Sync/Overview/Read-resources
+    Args:
+        client:  The TodoistClient to make the request with
+        sync_token:  The sync_token returned by a previous call, or '*' for a full sync
+        resource_types:  Which kinds of resources to return.  Tasks are 'items'
+    Returns: The decoded JSON response, which holds the new 'sync_token', 'full_sync' and one key per resource type
+    Raises: httpx.HTTPStatusError if the request fails, which is what happens when the sync_token is no longer valid
+    """
+
+    response = client.http_client.post(SYNC_API_URL,
+                                       headers=dict(Authorization=f"Bearer {client.todoist_api_token}"),
+                                       data=dict(sync_token=sync_token, resource_types=json.dumps(list(resource_types))))
+    response.raise_for_status()
+    return response.json()
+
+
+def create_task(todoist_api_token:str, task_content:str, task_description:str = None, due_string:str = "Today",
+                api_base_url: str = None, client: TodoistClient = None) -> str:
     """
     Creates a task in todoist and returns the URL for that task
     Note that the create method for the API takes a lot of optional parameters
@@ -66,7 +201,9 @@ def create_task(todoist_api_token:str, task_content:str, task_description:str =
             This is the ADDITIONAL, optional 'flavor text' so to speak.  Example "...and him a treat cause you love him"
         due_string: "A natural language string that tells the todoist API when a task is due"
             More Details here:  https://todoist.com/help/articles/due-dates-and-times
-        todoist_api_token:  The token, required to interact with todoist API
+        todoist_api_token:  The token, required to interact with todoist API.  Not needed if a client is supplied
+        api_base_url:  Optionally, a server to talk to instead of the real Todoist API.  See TodoistClient
+        client:  A TodoistClient to make the request with.  A short-lived one is built if not supplied
 
 
     Returns: A string, which is the URL to the created task
@@ -85,17 +222,160 @@ def create_task(todoist_api_token:str, task_content:str, task_description:str =
         data['due_string'] = str(due_string)
 
     # init API
-    api = TodoistAPI(todoist_api_token)
+    client, close_client = _resolve_client(todoist_api_token=todoist_api_token, api_base_url=api_base_url,
+                                           client=client)
     try:
-        task = api.add_task(**data)
+        task = client.api.add_task(**data)
     except Exception as ex:
-        print(f"Encountered exception of type {type(ex)} while trying to create a task with todoist with the payload:"
-              f" {data}\n{ex}", file=sys.stderr)
+        LOG.warning(f"Encountered exception of type {type(ex)} while trying to create a task with todoist with the "
+                    f"payload: {data}\n{ex}")
         return ex
+    finally:
+        if close_client is True:
+            client.close()
 
     return task
 
 
+def create_tasks(todoist_api_token: str, new_tasks: list, max_in_flight: int = 4, api_base_url: str = None,
+                 client: TodoistClient = None) -> list:
+    """
+    Creates many tasks in todoist, keeping up to max_in_flight requests going at once rather than waiting for each
+    round trip to the API in turn
+    Args:
+        todoist_api_token:  The token, required to interact with todoist API.  Not needed if a client is supplied
+        new_tasks:  A list of dicts, each holding the keyword arguments for create_task() (task_content and,
+            optionally, task_description and due_string)
+        max_in_flight:  The most requests to have outstanding at any one time
+        api_base_url:  Optionally, a server to talk to instead of the real Todoist API.  See TodoistClient
+        client:  A TodoistClient to make the requests with.  One is built (and shared by every request) if not
+            supplied
+    Returns: A list the same length and order as new_tasks.  Each item is either the created task or, if creating
+        that task failed, the exception that was raised.  See create_task()
+    """
+
+    if len(new_tasks) == 0:
+        return []
+
+    client, close_client = _resolve_client(todoist_api_token=todoist_api_token, api_base_url=api_base_url,
+                                           client=client)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(new_tasks)))) as pool:
+            futures = [pool.submit(create_task, todoist_api_token=None, client=client, **new_task)
+                       for new_task in new_tasks]
+            ret_val = [future.result() for future in futures]
+    finally:
+        if close_client is True:
+            client.close()
+
+    return ret_val
+
+
+
+def _make_item_add_command(task_content: str, task_description: str = None, due_string: str = "Today") -> dict:
+    """
+    Builds an 'item_add' command for the sync API.  Takes the same arguments as create_task()
+    See:  https://developer.todoist.com/api/v1/#tag/Sync/Tasks/Add-a-task
+    Returns: The command, as a dict
+    """
+
+    args = dict(content=task_content)
+    if task_description:
+        args['description'] = str(task_description)
+    if due_string:
+        args['due'] = dict(string=str(due_string))
+
+    return dict(type='item_add', temp_id=str(uuid.uuid4()), uuid=str(uuid.uuid4()), args=args)
+
+
+def _post_sync_commands(client: TodoistClient, commands: list) -> dict:
+    """
+    Sends a batch of commands to the sync API
+    Args:
+        client:  The TodoistClient to make the request with
+        commands:  A list of commands, e.g. from _make_item_add_command()
+    Returns: The decoded JSON response, which holds 'sync_status' and 'temp_id_mapping'
+    Raises: httpx.HTTPError if the request as a whole fails
+    """
+
+    response = client.http_client.post(SYNC_API_URL,
+                                       headers=dict(Authorization=f"Bearer {client.todoist_api_token}"),
+                                       data=dict(commands=json.dumps(commands)))
+    response.raise_for_status()
+    return response.json()
+
+
+def create_tasks_in_batches(todoist_api_token: str, new_tasks: list, batch_size: int = SYNC_COMMANDS_PER_REQUEST,
+                            api_base_url: str = None, client: TodoistClient = None) -> list:
+    """
+    Creates many tasks in todoist through the sync API, which carries many 'item_add' commands per request, instead of
+    making one REST request per task.  The temporary IDs given to each command are mapped back to the real task IDs
+    to work out each task's URL
+    Args:
+        todoist_api_token:  The token, required to interact with todoist API.  Not needed if a client is supplied
+        new_tasks:  A list of dicts, each holding the keyword arguments for create_task() (task_content and,
+            optionally, task_description and due_string)
+        batch_size:  The most commands to send in one request.  Todoist won't accept more than 100
+        api_base_url:  Optionally, a server to talk to instead of the real Todoist API.  See TodoistClient
+        client:  A TodoistClient to make the requests with.  A short-lived one is built if not supplied
+    Returns: A list the same length and order as new_tasks.  Each item is either a SyncCreatedTask or, if creating
+        that task failed, the exception describing why.  A command can fail on its own while the rest of its batch
+        succeeds, and a failed request fails every task in that batch
+    """
+
+    if not 1 <= batch_size <= SYNC_COMMANDS_PER_REQUEST:
+        raise ValueError(f"The batch_size must be between 1 and {SYNC_COMMANDS_PER_REQUEST}.  Got {batch_size}")
+
+    if len(new_tasks) == 0:
+        return []
+
+    client, close_client = _resolve_client(todoist_api_token=todoist_api_token, api_base_url=api_base_url,
+                                           client=client)
+    try:
+        ret_val = _create_tasks_in_batches(client=client, new_tasks=new_tasks, batch_size=batch_size)
+    finally:
+        if close_client is True:
+            client.close()
+
+    return ret_val
+
+
+def _create_tasks_in_batches(client: TodoistClient, new_tasks: list, batch_size: int) -> list:
+    """
+    See create_tasks_in_batches()
+    """
+
+    ret_val = []
+    for batch_start in range(0, len(new_tasks), batch_size):
+        batch = new_tasks[batch_start:batch_start + batch_size]
+        commands = [_make_item_add_command(**new_task) for new_task in batch]
+
+        try:
+            response = _post_sync_commands(client=client, commands=commands)
+        except Exception as ex:
+            LOG.warning(f"Encountered exception of type {type(ex)} while trying to create a batch of {len(commands)} "
+                        f"tasks with the todoist sync API\n{ex}")
+            ret_val.extend([ex] * len(commands))
+            continue
+
+        sync_status = response.get('sync_status', {})
+        temp_id_mapping = response.get('temp_id_mapping', {})
+        for command in commands:
+            status = sync_status.get(command['uuid'])
+            task_id = temp_id_mapping.get(command['temp_id'])
+            if status == 'ok' and task_id is not None:
+                ret_val.append(SyncCreatedTask(id=task_id, content=command['args']['content'],
+                                               url=f"{TASK_URL}/{task_id}"))
+            else:
+                # A command's error carries its own http_code.  Without one, it was still turned down
+                http_code = status.get('http_code', 400) if isinstance(status, dict) else None
+                ex = TodoistSyncError(f"The sync API did not create the task '{command['args']['content']}':  "
+                                      f"{status}", http_code=http_code)
+                LOG.warning(ex)
+                ret_val.append(ex)
+
+    return ret_val
+
 
 if __name__ == '__main__':
 
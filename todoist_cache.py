@@ -0,0 +1,169 @@
+"""
+A local cache of the open tasks in Todoist, kept up to date with the sync API's incremental (delta) syncs
+
+Downloading every open task on every run just to check for duplicates scales with the size of the Todoist account
+rather than with the amount of new work.  Instead, we keep the open tasks (and their hashes) on disk along with the
+sync_token Todoist gave us, and on each run ask only for what changed since then.
+"""
+
+import collections
+import json
+import os
+
+import todoist
+from hashing import make_task_hashes
+from hashing import upgrade_task_hash
+from run_log import get_logger
+
+CACHE_FORMAT_VERSION = 1
+
+LOG = get_logger('todoist_cache')
+
+# A task as held in the cache.  Just enough of a Todoist task for duplicate checks
+CachedTask = collections.namedtuple('CachedTask', ['id', 'content'])
+
+
+def _is_invalid_sync_token_error(ex) -> bool:
+    """
+    Args:
+        ex:  The httpx.HTTPStatusError a sync request failed with
+    Returns: True if Todoist turned down the request because it no longer accepts the sync_token, otherwise False
+    """
+
+    if ex.response.status_code != 400:
+        return False
+    try:
+        error_tag = ex.response.json().get('error_tag')
+    except (ValueError, AttributeError):  # Not JSON, or not a JSON object
+        return False
+
+    return error_tag == 'INVALID_SYNC_TOKEN'
+
+
+class TodoistTaskCache:
+    """
+    The open tasks in Todoist, keyed by task ID, along with the sync_token to fetch changes from.
+
+    Typical use is:  construct, then call refresh() with a TodoistClient once per run and build a DedupeIndex from
+    the result.  refresh() saves the cache as it goes.
+    """
+
+    def __init__(self, cache_file_name: str = 'cache/todoist_tasks.json'):
+        """
+        Args:
+            cache_file_name:  Where the cache is persisted.  It's fine if the file doesn't exist yet
+        """
+
+        self.cache_file_name = cache_file_name
+        self.sync_token = '*'  # '*' asks Todoist for everything
+        self.tasks = {}  # Task ID -> dict(content=..., task_hash=...)
+
+        self.full_syncs = 0
+        self.changes_applied = 0
+
+        self._load()
+
+    def _load(self):
+        """
+        Reads the cache from disk.  A missing or corrupt cache just means the next refresh is a full sync
+        """
+
+        if not os.path.isfile(self.cache_file_name):
+            return
+
+        try:
+            with open(self.cache_file_name, 'r') as f:
+                payload = json.load(f)
+            if payload.get('version') != CACHE_FORMAT_VERSION or type(payload.get('tasks')) is not dict:
+                raise ValueError("Unexpected cache format")
+            self.sync_token = payload['sync_token']
+            self.tasks = payload['tasks']
+            for task in self.tasks.values():  # Hashes saved by an older version of hashing.py are made afresh
+                task['task_hash'] = upgrade_task_hash(task_hash=task['task_hash'], task_description=task['content'])
+        except Exception as ex:
+            LOG.warning(f"The Todoist task cache '{self.cache_file_name}' could not be read and will be rebuilt.  Got "
+                        f"exception of type {type(ex)}:  {ex}")
+            self.sync_token = '*'
+            self.tasks = {}
+
+    def save(self):
+        """
+        Persists the cache.  Writes to a temporary file first, then renames it over the old one
+        """
+
+        cache_dir = os.path.dirname(self.cache_file_name)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        tmp_file_name = f"{self.cache_file_name}.tmp"
+        with open(tmp_file_name, 'w') as f:
+            json.dump(dict(version=CACHE_FORMAT_VERSION, sync_token=self.sync_token, tasks=self.tasks), f)
+        os.replace(tmp_file_name, self.cache_file_name)
+
+    def _apply_changes(self, items: list, full_sync: bool):
+        """
+        Applies a list of changed items from the sync API.  Completed and deleted tasks are dropped
+        """
+
+        if full_sync is True:
+            self.tasks = {}
+
+        open_items = [item for item in items if not (item.get('checked') or item.get('is_deleted'))]
+        task_hashes = iter(make_task_hashes(task_descriptions=[item['content'] for item in open_items]))
+
+        for item in items:
+            task_id = str(item['id'])
+            if item.get('checked') or item.get('is_deleted'):
+                self.tasks.pop(task_id, None)
+            else:
+                self.tasks[task_id] = dict(content=item['content'], task_hash=next(task_hashes))
+            self.changes_applied += 1
+
+    def refresh(self, client: todoist.TodoistClient):
+        """
+        Brings the cache up to date with Todoist.  Only changes since the last refresh are fetched, unless Todoist no
+        longer accepts our sync_token, in which case everything is fetched again
+        Args:
+            client:  The TodoistClient to make the request with
+        Returns: self, for chaining
+        Raises: httpx.HTTPStatusError if the request fails for any other reason.  The cache is left as it was
+        """
+
+        import httpx  # Already imported by the client.  See todoist.py
+
+        try:
+            response = todoist.get_sync_changes(client=client, sync_token=self.sync_token)
+        except httpx.HTTPStatusError as ex:
+            # Anything else (e.g. an outage or a bad API token) isn't the sync_token's fault, so keep it for next time
+            if self.sync_token == '*' or _is_invalid_sync_token_error(ex) is False:
+                raise
+            LOG.warning(f"Todoist did not accept the cached sync token, so all open tasks will be fetched again:  {ex}")
+            self.sync_token = '*'
+            response = todoist.get_sync_changes(client=client, sync_token=self.sync_token)
+
+        full_sync = bool(response.get('full_sync')) or self.sync_token == '*'
+        if full_sync is True:
+            self.full_syncs += 1
+        self._apply_changes(items=response.get('items') or [], full_sync=full_sync)
+        self.sync_token = response['sync_token']
+        self.save()
+
+        return self
+
+    def cached_tasks(self) -> list:
+        """
+        Returns: A list of (task_hash, task) tuples, where each task has 'id' and 'content' attributes.
+            Suited to feeding a DedupeIndex without re-hashing anything
+        """
+
+        return [(task['task_hash'], CachedTask(id=task_id, content=task['content']))
+                for task_id, task in self.tasks.items()]
+
+    def summary(self) -> str:
+        """
+        Returns: A one line description of the last refresh
+        """
+
+        sync_kind = 'full' if self.full_syncs > 0 else 'incremental'
+        return f"Todoist task cache:  {len(self.tasks)} open tasks ({sync_kind} sync, " \
+               f"{self.changes_applied} changes applied)"
@@ -0,0 +1,48 @@
+"""
+The httpx transports a TodoistClient (See todoist.py) sends its requests through.  Kept apart from todoist.py, since
+importing httpx is slow and todoist.py only imports it once it's needed
+"""
+
+import time
+
+import httpx
+
+from metrics import METRICS
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """
+    An httpx transport that records every request made to the API in METRICS:  how many, to which endpoint, with
+    what result, and how long until the response came back
+    """
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = request.url.path
+        started = time.perf_counter()
+        try:
+            response = super().handle_request(request)
+        except Exception as ex:
+            METRICS.increment('api_errors', method=request.method, endpoint=endpoint, error=type(ex).__name__)
+            raise
+        finally:
+            METRICS.observe('api_request', time.perf_counter() - started, method=request.method, endpoint=endpoint)
+
+        METRICS.increment('api_calls', method=request.method, endpoint=endpoint, status=response.status_code)
+        return response
+
+
+class BaseUrlTransport(InstrumentedTransport):
+    """
+    An httpx transport that sends requests meant for the Todoist API to some other server instead.
+    See fake_todoist.py
+    """
+
+    def __init__(self, api_base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self._base_url = httpx.URL(api_base_url)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self._base_url.scheme,
+                                            host=self._base_url.host,
+                                            port=self._base_url.port)
+        return super().handle_request(request)
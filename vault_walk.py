@@ -0,0 +1,200 @@
+"""
+Walks a vault, skipping the directories that hold no notes worth reading
+
+Vaults are full of things that aren't notes:  Obsidian's own settings (.obsidian/), deleted notes (.trash/), version
+control (.git/) and, often, huge folders of attachments.  Ignore rules say which of these to leave alone.  They're
+written like the lines of a .gitignore file:
+
+    .obsidian/          A directory called .obsidian, wherever it is
+    /Attachments/       Only the Attachments directory at the top of the vault
+    Archive/**/*.md     Any note anywhere under a top level Archive directory
+    *.excalidraw.md     Any file with a name ending in .excalidraw.md
+    !.trash/            Don't ignore .trash after all (the last rule to match a path wins)
+
+Ignored directories are pruned from the walk, so nothing under them is ever listed.  See DEFAULT_IGNORE_PATTERNS for
+what's ignored out of the box
+"""
+
+import os
+import re
+
+from run_log import get_logger
+
+LOG = get_logger('vault_walk')
+
+# Ignored unless a rule (e.g. '!.trash/') says otherwise
+DEFAULT_IGNORE_PATTERNS = ('.obsidian/', '.trash/', '.git/', '.hg/', '.svn/', '.stversions/', 'node_modules/')
+
+
+def _translate_pattern(pattern: str) -> str:
+    """
+    Turns the body of a gitignore style pattern (no leading '!' or trailing '/') into a regular expression that
+    matches paths relative to the top of the vault, separated by '/'
+    """
+
+    anchored = '/' in pattern
+    if pattern.startswith('/'):
+        pattern = pattern[1:]
+
+    regex = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            regex.append('(?:.*/)?')  # Any number of directories, including none
+            i += 3
+        elif pattern.startswith('**', i) and i + 2 == len(pattern) and (i == 0 or pattern[i - 1] == '/'):
+            regex.append('.*')  # Everything inside
+            i += 2
+        elif pattern[i] == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            regex.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex.append(f"[{body}]")
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+
+    # A pattern without a '/' in it matches a name at any depth.  Otherwise it's relative to the top of the vault
+    prefix = '' if anchored else '(?:.*/)?'
+    return f"^{prefix}{''.join(regex)}$"
+
+
+class IgnoreRules:
+    """
+    A list of gitignore style patterns (See the module docstring), for testing paths relative to the top of a vault
+    """
+
+    def __init__(self, patterns: list = None, use_defaults: bool = True):
+        """
+        Args:
+            patterns:  Patterns to apply after the defaults.  Blank ones and ones starting with '#' are skipped
+            use_defaults:  Whether to start with DEFAULT_IGNORE_PATTERNS
+        """
+
+        self.patterns = (list(DEFAULT_IGNORE_PATTERNS) if use_defaults is True else []) + list(patterns or [])
+
+        self._directory_rules = []  # (compiled regex, ignore) tuples, in order.  The last to match wins
+        self._file_rules = []
+        for pattern in self.patterns:
+            if type(pattern) is not str:
+                raise TypeError(f"Ignore patterns should be strings.  Got value [{pattern}] which is of type "
+                                f"{type(pattern)}")
+            pattern = pattern.rstrip()
+            if pattern == '' or pattern.startswith('#'):
+                continue
+
+            ignore = True
+            if pattern.startswith('!'):
+                ignore = False
+                pattern = pattern[1:]
+            elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+                pattern = pattern[1:]
+
+            directory_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if pattern == '':
+                continue
+
+            rule = (re.compile(_translate_pattern(pattern)), ignore)
+            self._directory_rules.append(rule)
+            if directory_only is False:
+                self._file_rules.append(rule)
+
+    def is_ignored(self, relative_path: str, is_directory: bool) -> bool:
+        """
+        Tests a single path against the rules.  Doesn't look at the directories above it (See is_path_ignored())
+        Args:
+            relative_path:  The path relative to the top of the vault, separated by '/'
+            is_directory:  Whether the path is a directory.  Patterns ending in '/' only match directories
+        """
+
+        ignored = False
+        for regex, ignore in (self._directory_rules if is_directory is True else self._file_rules):
+            if ignored is not ignore and regex.match(relative_path):
+                ignored = ignore
+
+        return ignored
+
+    def is_path_ignored(self, relative_path: str, is_directory: bool = False) -> bool:
+        """
+        Tests a path, and every directory above it, against the rules.  For paths that didn't come from walk_vault()
+        (which never goes into ignored directories), e.g. files reported as changed
+        """
+
+        parts = relative_path.split('/')
+        for depth in range(1, len(parts)):
+            if self.is_ignored('/'.join(parts[:depth]), is_directory=True):
+                return True
+
+        return self.is_ignored(relative_path, is_directory=is_directory)
+
+
+def relative_vault_path(file_name: str, parent_directory: str) -> str:
+    """
+    Returns: The path of file_name relative to parent_directory, separated by '/' whatever the platform
+    """
+
+    return os.path.relpath(file_name, parent_directory).replace(os.sep, '/')
+
+
+def walk_vault(directory: str, ignore_rules: IgnoreRules = None, parent_directory: str = None):
+    """
+    Walks a directory tree top down, like os.walk(), but with os.scandir() so that the DirEntry of each file can be
+    handed back.  DirEntry caches the result of its stat() call, so each file is stat'ed at most once however many
+    times the caller asks.  Directories that are ignored are never opened.  Symlinked directories aren't followed, as
+    with os.walk().  Directories that can't be listed are reported and skipped
+    Args:
+        directory:  The directory to walk
+        ignore_rules:  The rules to prune the walk with.  Nothing is ignored if not supplied
+        parent_directory:  The top of the vault, which ignore rules are relative to.  Defaults to directory
+    Returns: A generator of tuples of (directory path, list of os.DirEntry for the files in it), in the same order
+        as os.walk()
+    """
+
+    if parent_directory is None:
+        parent_directory = directory
+    relative_directory = relative_vault_path(directory, parent_directory)
+    if relative_directory == '.':
+        relative_directory = ''
+
+    stack = [(directory, relative_directory)]
+    while len(stack) > 0:
+        root, relative_root = stack.pop()
+        try:
+            with os.scandir(root) as entries:
+                entries = list(entries)
+        except OSError as ex:
+            LOG.warning(f"Skipping over directory '{root}' which could not be listed:  {ex}")
+            continue
+
+        files = []
+        directories = []
+        for entry in entries:
+            relative_path = f"{relative_root}/{entry.name}" if relative_root else entry.name
+            try:
+                is_directory = entry.is_dir()
+            except OSError:
+                is_directory = False
+
+            if ignore_rules is not None and ignore_rules.is_ignored(relative_path, is_directory=is_directory):
+                continue
+
+            if is_directory is False:
+                files.append(entry)
+            elif not entry.is_symlink():
+                directories.append((entry.path, relative_path))
+
+        yield root, files
+
+        stack.extend(reversed(directories))
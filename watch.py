@@ -0,0 +1,418 @@
+"""
+A long-running 'watch' mode, as an alternative to running migrate_tasks.py from cron
+
+Instead of walking the whole vault every so often, this watches it for changes (with Linux inotify where available,
+and by polling otherwise).  A note is migrated once it has gone settle_seconds without being modified, rather than
+waiting on the next cron run.  The scan index, Todoist client and Todoist task cache are kept warm between changes.
+
+On start up, and every so often after that, the whole vault is reconciled (i.e. a regular migrate_tasks run) to
+pick up anything that changed while nothing was watching.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import todoist
+from config import _read_logging_config_from_config
+from config import _read_metrics_config_from_config
+from config import _read_scan_workers_from_config
+from config import _read_todoist_backend_from_config
+from config import _read_todoist_max_in_flight_from_config
+from config import _read_vaults_from_config
+from helpers import VaultResolver
+from metrics import METRICS
+from migrate_tasks import migrate_tasks
+from migration_ledger import MigrationLedger
+from run_log import add_verbosity_arguments
+from run_log import configure_logging
+from run_log import flush_logs
+from run_log import get_logger
+from scan_index import ScanIndex
+from scan_index import index_file_name_for_vault
+from todoist_cache import TodoistTaskCache
+from vault_walk import IgnoreRules
+from vault_walk import relative_vault_path
+from vault_walk import walk_vault
+
+LOG = get_logger('watch')
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len.  Followed by len bytes of (NUL padded) name
+
+
+class _InotifyWatcher:
+    """
+    Watches a directory tree with Linux inotify.  Every directory gets its own watch, and directories created (or
+    moved in) later are picked up as they appear.  Ignored directories aren't watched
+    """
+
+    def __init__(self, parent_directory: str, ignore_rules: IgnoreRules = None):
+        """
+        Raises: OSError if inotify isn't available or the watches can't be set up (e.g. too many directories for
+            fs.inotify.max_user_watches)
+        """
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this platform")
+        self._libc = libc
+
+        self._fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._parent_directory = parent_directory
+        self._ignore_rules = ignore_rules
+        self._paths_by_wd = {}
+        try:
+            self._add_watches(directory=parent_directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watches(self, directory: str) -> list:
+        """
+        Watches a directory and every directory under it
+        Returns: The files found under the directory, which the caller may want to treat as changed
+        """
+
+        found_files = []
+        for root, files in walk_vault(directory=directory, ignore_rules=self._ignore_rules,
+                                      parent_directory=self._parent_directory):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), _WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for '{root}'")
+            self._paths_by_wd[wd] = root
+            found_files.extend(entry.path for entry in files)
+
+        return found_files
+
+    def read_changes(self, timeout: float):
+        """
+        Waits up to timeout seconds for changes
+        Returns: A tuple of (set of paths that changed, whether events were lost and a full reconcile is needed)
+        """
+
+        changed_paths = set()
+        overflowed = False
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return changed_paths, overflowed
+
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+                name = buffer[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + name_length].rstrip(b'\0')
+                offset += _EVENT_HEADER.size + name_length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+
+                directory = self._paths_by_wd.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._paths_by_wd[wd]
+                    continue
+                if not name:
+                    continue
+
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    # A new directory (or one moved in from elsewhere).  Watch it, and treat what's in it as changed
+                    if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path) and not self._is_ignored(path):
+                        try:
+                            changed_paths.update(self._add_watches(directory=path))
+                        except OSError as ex:
+                            LOG.warning(f"Could not watch the new directory '{path}'.  A full reconcile will pick up "
+                                        f"its notes:  {ex}")
+                            overflowed = True
+                else:
+                    changed_paths.add(path)
+
+        return changed_paths, overflowed
+
+    def _is_ignored(self, directory: str) -> bool:
+        if self._ignore_rules is None:
+            return False
+        return self._ignore_rules.is_path_ignored(relative_vault_path(directory, self._parent_directory),
+                                                  is_directory=True)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _PollingWatcher:
+    """
+    Watches a directory tree by walking it every poll_interval seconds and comparing modified times and sizes.
+    Used where inotify isn't available.  Ignored directories aren't walked
+    """
+
+    def __init__(self, parent_directory: str, poll_interval: float = 2.0, ignore_rules: IgnoreRules = None):
+        self._parent_directory = parent_directory
+        self._ignore_rules = ignore_rules
+        self._poll_interval = poll_interval
+        self._snapshot = self._take_snapshot()
+        self._next_poll = time.monotonic() + poll_interval
+
+    def _take_snapshot(self) -> dict:
+        snapshot = {}
+        for root, files in walk_vault(directory=self._parent_directory, ignore_rules=self._ignore_rules):
+            for entry in files:
+                try:
+                    stat_result = entry.stat()
+                except OSError:
+                    continue
+                snapshot[entry.path] = (stat_result.st_mtime_ns, stat_result.st_size)
+        return snapshot
+
+    def read_changes(self, timeout: float):
+        """
+        Waits up to timeout seconds for changes
+        Returns: A tuple of (set of paths that changed, False).  Polling never loses changes
+        """
+
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set(), False
+        if wait > 0:
+            time.sleep(wait)
+
+        snapshot = self._take_snapshot()
+        changed_paths = {file_name for file_name, signature in snapshot.items()
+                         if self._snapshot.get(file_name) != signature}
+        self._snapshot = snapshot
+        self._next_poll = time.monotonic() + self._poll_interval
+
+        return changed_paths, False
+
+    def close(self):
+        pass
+
+
+def _make_watcher(parent_directory: str, use_inotify: bool = True, poll_interval: float = 2.0,
+                  ignore_rules: IgnoreRules = None):
+    """
+    Returns: An inotify based watcher if possible, otherwise a polling one
+    """
+
+    if use_inotify is True:
+        try:
+            return _InotifyWatcher(parent_directory=parent_directory, ignore_rules=ignore_rules)
+        except (OSError, AttributeError) as ex:
+            LOG.warning(f"Could not watch '{parent_directory}' with inotify, so it will be polled every "
+                        f"{poll_interval} seconds instead:  {ex}")
+
+    return _PollingWatcher(parent_directory=parent_directory, poll_interval=poll_interval, ignore_rules=ignore_rules)
+
+
+def _is_own_write(path: str, written_files: dict) -> bool:
+    """
+    Tells whether a change to a note is just migrate_tasks having rewritten it, rather than an edit worth another pass
+    Args:
+        path:  The note that changed
+        written_files:  The notes migrate_tasks rewrote, as file name -> (st_mtime_ns, st_size).  See migrate_tasks().
+            The note is forgotten once its change has been looked at
+    Returns: True if the note is just as migrate_tasks left it, otherwise False
+    """
+
+    written = written_files.pop(path, None)
+    if written is None:
+        return False
+
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return False
+
+    if (stat_result.st_mtime_ns, stat_result.st_size) != written:
+        return False
+
+    METRICS.increment('watch_own_writes_ignored')
+    return True
+
+
+def watch(parent_directory: str = '~/Obsidian', settle_seconds: float = 10, reconcile_seconds: float = 3600,
+          file_ext='.md', use_inotify: bool = True, poll_interval: float = 2.0, workers: int = 1,
+          max_in_flight: int = 4, backend: str = 'rest', api_base_url: str = None, scan_index: ScanIndex = None,
+          todoist_task_cache: TodoistTaskCache = None, vault_resolver: VaultResolver = None,
+          max_seconds: float = None, metrics_json_file: str = None, metrics_prometheus_file: str = None,
+          ignore_rules: IgnoreRules = None, migration_ledger: MigrationLedger = None):
+    """
+    Watches a vault and migrates the to-do items in each note shortly after it has stopped changing
+    Args:
+        parent_directory:  The directory (e.g. Obsidian vault) to watch
+        settle_seconds:  How long a note must go without changing before its to-do items are migrated
+        reconcile_seconds:  How often to walk the whole vault anyway, to catch anything that was missed
+        file_ext:  The extension (or list of extensions) of the notes to watch
+        use_inotify:  Set to False to always poll
+        poll_interval:  Seconds between polls, when polling
+        workers:  See migrate_tasks()
+        max_in_flight:  See migrate_tasks()
+        backend:  See migrate_tasks()
+        api_base_url:  See migrate_tasks()
+        scan_index:  A ScanIndex to keep warm.  One is loaded from the default location if not supplied
+        todoist_task_cache:  A TodoistTaskCache to keep warm.  One is loaded from the default location if not supplied
+        vault_resolver:  A VaultResolver to reuse.  One is built on start up if not supplied
+        max_seconds:  Stop after this long.  Runs until interrupted if not supplied
+        metrics_json_file:  If supplied, METRICS are written here as JSON after every pass.  They add up over the
+            life of the watcher
+        metrics_prometheus_file:  If supplied, METRICS are written here as a Prometheus textfile after every pass
+        ignore_rules:  The IgnoreRules (See vault_walk.py) saying which directories and notes to leave alone.  Only
+            the defaults are used if not supplied.  Ignored directories aren't watched
+        migration_ledger:  A MigrationLedger to record each migration in.  One is loaded from the default location if
+            not supplied
+    """
+
+    parent_directory = os.path.realpath(os.path.expanduser(parent_directory))
+    if not os.path.isdir(parent_directory):
+        raise FileNotFoundError(f"The parent_directory argument '{parent_directory}' does not exist!")
+
+    if scan_index is None:
+        scan_index = ScanIndex()
+    if todoist_task_cache is None:
+        todoist_task_cache = TodoistTaskCache()
+    if vault_resolver is None:
+        vault_resolver = VaultResolver()
+    if ignore_rules is None:
+        ignore_rules = IgnoreRules()
+    if migration_ledger is None:
+        migration_ledger = MigrationLedger()
+
+    if type(file_ext) is str:
+        file_ext = [file_ext]
+    file_ext = tuple(item if item.startswith('.') else f".{item}" for item in file_ext)
+
+    # The notes we rewrote ourselves, so that their rewrites aren't taken for edits.  See _is_own_write()
+    written_files = {}
+
+    migrate_kwargs = dict(parent_directory=parent_directory, file_ext=list(file_ext), scan_index=scan_index,
+                          workers=workers, max_in_flight=max_in_flight, backend=backend,
+                          todoist_task_cache=todoist_task_cache, vault_resolver=vault_resolver,
+                          ignore_rules=ignore_rules, migration_ledger=migration_ledger, written_files=written_files)
+
+    def _migrate(**kwargs):
+        # One bad pass (e.g. Todoist being unreachable) shouldn't bring the whole watcher down
+        try:
+            migrate_tasks(**migrate_kwargs, **kwargs)
+        except Exception as ex:
+            METRICS.increment('watch_failed_passes')
+            LOG.error(f"Migration pass failed with an exception of type {type(ex)}.  Will try again later:  {ex}")
+        METRICS.export(json_file=metrics_json_file, prometheus_file=metrics_prometheus_file)
+        flush_logs()
+
+    started_at = time.monotonic()
+    pending = {}  # File name -> when we last saw it change (monotonic)
+
+    watcher = _make_watcher(parent_directory=parent_directory, use_inotify=use_inotify, poll_interval=poll_interval,
+                            ignore_rules=ignore_rules)
+    try:
+        with todoist.TodoistClient(api_base_url=api_base_url, max_connections=max_in_flight) as todoist_client:
+            migrate_kwargs['todoist_client'] = todoist_client
+
+            # Catch up on anything that changed while we weren't running.  Notes that were still being edited are
+            # left for the follow up reconcile, once they've had time to settle
+            LOG.info(f"Reconciling '{parent_directory}' before watching it for changes")
+            _migrate(settle_seconds=settle_seconds)
+            next_reconcile = time.monotonic() + settle_seconds
+
+            while max_seconds is None or time.monotonic() - started_at < max_seconds:
+                now = time.monotonic()
+                next_deadline = next_reconcile
+                if len(pending) > 0:
+                    next_deadline = min(next_deadline, min(pending.values()) + settle_seconds)
+                timeout = min(max(0.0, next_deadline - now), 1.0)
+
+                changed_paths, overflowed = watcher.read_changes(timeout=timeout)
+
+                now = time.monotonic()
+                for path in changed_paths:
+                    if path.endswith(file_ext) and not _is_own_write(path=path, written_files=written_files):
+                        pending[path] = now
+                if overflowed is True:
+                    LOG.warning("Some file system events were lost.  The whole vault will be reconciled")
+                    next_reconcile = now
+
+                # Migrate the notes that have stopped changing
+                settled = [path for path, last_changed in pending.items() if now - last_changed >= settle_seconds]
+                if len(settled) > 0:
+                    for path in settled:
+                        del pending[path]
+                    _migrate(settle_seconds=0, file_names=sorted(settled))
+
+                if now >= next_reconcile:
+                    _migrate(settle_seconds=settle_seconds)
+                    next_reconcile = time.monotonic() + reconcile_seconds
+    finally:
+        watcher.close()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('base_dir', nargs='?', help='The vault to watch.  Read from config/config.json if omitted')
+    arg_parser.add_argument('--vault', help="With several vaults in config/config.json, the name of the one to watch")
+    arg_parser.add_argument('--settle-seconds', type=float, default=None,
+                            help="How long a note must go unmodified before it's migrated.  Defaults to the "
+                                 "'settle_seconds' setting in config/config.json")
+    arg_parser.add_argument('--reconcile-seconds', type=float, default=3600,
+                            help='How often to walk the whole vault anyway')
+    arg_parser.add_argument('--poll', action='store_true', help="Poll for changes rather than using inotify")
+    arg_parser.add_argument('--poll-interval', type=float, default=2.0)
+    add_verbosity_arguments(arg_parser=arg_parser)
+    args = arg_parser.parse_args()
+
+    # One vault per watcher.  Run a watcher for each vault to watch several
+    all_vaults = _read_vaults_from_config(base_dir=args.base_dir)
+    vaults = all_vaults
+    if args.vault is not None:
+        vaults = [vault for vault in all_vaults if vault['name'] == args.vault]
+        if len(vaults) == 0:
+            arg_parser.error(f"There is no vault named '{args.vault}' in config/config.json")
+    if len(vaults) > 1:
+        arg_parser.error(f"config/config.json has several vaults.  Say which to watch with --vault (one of "
+                         f"{', '.join(vault['name'] for vault in vaults)}), and run a watcher for each")
+    vault = vaults[0]
+
+    metrics_config = _read_metrics_config_from_config()
+    logging_config = _read_logging_config_from_config()
+    configure_logging(verbosity=args.verbosity or logging_config['verbosity'] or 'normal',
+                      json_file=logging_config['json_file'])
+    settle_seconds = args.settle_seconds if args.settle_seconds is not None else vault['settle_seconds']
+
+    try:
+        watch(parent_directory=vault['path'], settle_seconds=settle_seconds, reconcile_seconds=args.reconcile_seconds,
+              file_ext=vault['file_ext'], use_inotify=not args.poll, poll_interval=args.poll_interval,
+              workers=_read_scan_workers_from_config(),
+              max_in_flight=_read_todoist_max_in_flight_from_config(), backend=_read_todoist_backend_from_config(),
+              metrics_json_file=metrics_config['json_file'], metrics_prometheus_file=metrics_config['prometheus_file'],
+              ignore_rules=IgnoreRules(patterns=vault['ignore_patterns']),
+              scan_index=ScanIndex(index_file_name=index_file_name_for_vault(vault_name=vault['name'],
+                                                                             vault_count=len(all_vaults))))
+    except KeyboardInterrupt:
+        pass